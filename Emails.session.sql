@@ -18,18 +18,37 @@ CREATE TABLE folders (
     id INT PRIMARY KEY AUTO_INCREMENT,
     folder_name VARCHAR(100) NOT NULL,
     user_id INT NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX ix_folders_user_name (user_id, folder_name)
 );
 
 CREATE TABLE emails (
     id INT PRIMARY KEY AUTO_INCREMENT,
     sender_id INT NOT NULL,
     subject TEXT NOT NULL,
-    body TEXT NOT NULL,
+    body TEXT NOT NULL, -- legacy; bodies live in email_bodies
     sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     folder_id INT,
     FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
-    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    INDEX ix_emails_sent_at_id (sent_at, id),
+    INDEX ix_emails_sender_sent_at (sender_id, sent_at),
+    INDEX ix_emails_folder_id (folder_id)
+);
+
+CREATE TABLE email_bodies (
+    email_id INT PRIMARY KEY,
+    codec VARCHAR(10) NOT NULL,
+    content BLOB NOT NULL,
+    FOREIGN KEY (email_id) REFERENCES emails(id) ON DELETE CASCADE
+);
+
+CREATE TABLE email_search (
+    email_id INT PRIMARY KEY,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    FULLTEXT INDEX ft_email_search_body (body),
+    FULLTEXT INDEX ft_email_search_subject_body (subject, body)
 );
 
 CREATE TABLE attachments (
@@ -38,7 +57,11 @@ CREATE TABLE attachments (
     file_type VARCHAR(50) NOT NULL,
     file_size INT NOT NULL,
     email_id INT NOT NULL,
-    FOREIGN KEY (email_id) REFERENCES emails(id) ON DELETE CASCADE
+    content_hash VARCHAR(64) NULL,
+    FOREIGN KEY (email_id) REFERENCES emails(id) ON DELETE CASCADE,
+    INDEX ix_attachments_email_id (email_id),
+    INDEX ix_attachments_file_size (file_size),
+    INDEX ix_attachments_content_hash (content_hash)
 );
 
 CREATE TABLE recipients (
@@ -50,7 +73,9 @@ CREATE TABLE recipients (
     FOREIGN KEY (recipient_type_id) REFERENCES recipient_types(id) ON DELETE CASCADE,
     FOREIGN KEY (email_id) REFERENCES emails(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    UNIQUE (recipient_type_id, email_id, user_id)
+    UNIQUE (recipient_type_id, email_id, user_id),
+    INDEX ix_recipients_user_id (user_id),
+    INDEX ix_recipients_email_id (email_id)
 );
 
 CREATE TABLE email_folders (
@@ -59,5 +84,58 @@ CREATE TABLE email_folders (
     folder_id INT NOT NULL,
     FOREIGN KEY (email_id) REFERENCES emails(id) ON DELETE CASCADE,
     FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
-    UNIQUE (email_id, folder_id)
-);
\ No newline at end of file
+    UNIQUE (email_id, folder_id),
+    INDEX ix_email_folders_folder_id (folder_id)
+);
+
+CREATE TABLE search_trigrams (
+    field VARCHAR(40) NOT NULL,
+    trigram VARCHAR(3) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    row_id INT NOT NULL,
+    PRIMARY KEY (field, trigram, row_id),
+    INDEX ix_search_trigrams_row (row_id, field)
+);
+
+CREATE TABLE search_trigram_stats (
+    field VARCHAR(40) NOT NULL,
+    trigram VARCHAR(3) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (field, trigram)
+);
+
+CREATE TABLE table_stats (
+    name VARCHAR(100) PRIMARY KEY,
+    row_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE table_versions (
+    name VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE import_checkpoints (
+    source_key VARCHAR(64) PRIMARY KEY,
+    source VARCHAR(1024) NOT NULL,
+    position VARCHAR(1024) NOT NULL,
+    imported BIGINT NOT NULL DEFAULT 0,
+    skipped BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL
+);
+
+CREATE TABLE mailbox_entries (
+    user_id INT NOT NULL,
+    mailbox VARCHAR(10) NOT NULL,
+    email_id INT NOT NULL,
+    sent_at DATETIME NOT NULL,
+    flags INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, mailbox, email_id),
+    INDEX ix_mailbox_entries_page (user_id, mailbox, sent_at, email_id, flags),
+    INDEX ix_mailbox_entries_email_id (email_id)
+);
+
+CREATE TABLE folder_stats (
+    folder_id INT PRIMARY KEY,
+    email_count INT NOT NULL DEFAULT 0,
+    attachment_bytes BIGINT NOT NULL DEFAULT 0,
+    newest_sent_at DATETIME
+);
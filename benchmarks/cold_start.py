@@ -0,0 +1,138 @@
+"""Measure how long a fresh worker takes to boot and become ready.
+
+Starts `--runs` new Python processes. Each one imports the app, builds it
+with `create_app`, calls GET /ready (the warm-up) and then requests the
+login page twice. The benchmark reports the median of each phase and the
+wall-clock time of the whole process, next to a bare interpreter start for
+reference. `--imports` also lists the slowest imports of one boot, from
+`python -X importtime`.
+
+    python benchmarks/cold_start.py --runs 10 --imports 15 --output boot.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'src'), ROOT]
+
+PHASES = ('import_ms', 'create_app_ms', 'ready_ms', 'first_request_ms', 'second_request_ms')
+
+
+def child(url):
+    """One boot, timed phase by phase; prints a JSON line."""
+    started = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SQLALCHEMY_BINDS': {}, 'RATELIMIT_STORAGE_URI': 'memory://'})
+    app.template_folder = os.path.join(ROOT, 'templates')
+    app.static_folder = os.path.join(ROOT, 'static')
+    created = time.perf_counter()
+
+    client = app.test_client()
+    response = client.get('/ready')
+    ready = time.perf_counter()
+    client.get('/login')
+    first = time.perf_counter()
+    client.get('/login')
+    second = time.perf_counter()
+
+    def ms(a, b):
+        return round((b - a) * 1000, 2)
+
+    print(json.dumps({
+        'ready_status': response.status_code,
+        'import_ms': ms(started, imported),
+        'create_app_ms': ms(imported, created),
+        'ready_ms': ms(created, ready),
+        'first_request_ms': ms(ready, first),
+        'second_request_ms': ms(first, second),
+        'warm_up_steps': {name: step['ms'] for name, step in response.get_json()['warm_up']['steps'].items()},
+    }))
+
+
+def wall_ms(command, env):
+    started = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return (time.perf_counter() - started) * 1000, completed
+
+
+def slowest_imports(url, env, count):
+    """The modules app.py imports directly, by cumulative import time."""
+    _, completed = wall_ms([sys.executable, '-X', 'importtime', __file__, '--child', url], env)
+    pending = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)', line)
+        if not match:
+            continue
+        cumulative, depth, module = int(match.group(1)) / 1000, len(match.group(2)), match.group(3)
+        if module == 'app':
+            # importtime prints children before their parent, two columns deeper.
+            children = [(ms, name) for ms, child_depth, name in pending if child_depth == depth + 2]
+            return sorted(children, reverse=True)[:count]
+        pending.append((cumulative, depth, module))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--imports', type=int, default=0, metavar='N', help='list the N slowest imports')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--child', metavar='URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'boot.db')}"
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path[:2]))
+        subprocess.run(
+            [sys.executable, '-c', 'from app import create_app; from migrations import upgrade\n'
+             f'app = create_app({{"SQLALCHEMY_DATABASE_URI": {url!r}}})\n'
+             'with app.app_context(): upgrade()'],
+            env=env, check=True, capture_output=True,
+        )
+
+        interpreter = statistics.median(wall_ms([sys.executable, '-c', 'pass'], env)[0] for _ in range(args.runs))
+        boots, walls = [], []
+        for _ in range(args.runs):
+            wall, completed = wall_ms([sys.executable, __file__, '--child', url], env)
+            walls.append(wall)
+            boots.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        summary = {phase: round(statistics.median(boot[phase] for boot in boots), 2) for phase in PHASES}
+        summary['process_wall_ms'] = round(statistics.median(walls), 2)
+        summary['interpreter_ms'] = round(interpreter, 2)
+        steps = {name: round(statistics.median(boot['warm_up_steps'][name] for boot in boots), 2)
+                 for name in boots[0]['warm_up_steps']}
+
+        print(f"Median of {args.runs} boots:")
+        for name, value in summary.items():
+            print(f"  {name:<20} {value:>9.2f} ms")
+        print("Warm-up steps:")
+        for name, value in steps.items():
+            print(f"  {name:<20} {value:>9.2f} ms")
+
+        imports = slowest_imports(url, env, args.imports) if args.imports else []
+        if imports:
+            print("Slowest imports (cumulative):")
+            for ms, module in imports:
+                print(f"  {module:<30} {ms:>9.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'runs': args.runs, 'median': summary, 'warm_up_steps': steps, 'boots': boots,
+                       'slowest_imports': imports}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
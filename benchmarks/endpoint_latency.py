@@ -0,0 +1,392 @@
+"""Time every blueprint endpoint against a synthetic mailbox.
+
+Generates a dataset with `mailbox_data` (into a temporary SQLite file
+unless `--database-url` names an empty database), then drives each list,
+add, update, delete and search endpoint through the Flask test client as
+the admin user. For each endpoint it records p50/p95 latency, the number
+of SQL statements per request and the peak Python memory allocated while
+serving one request, and writes them to JSON together with the commit and
+scale, so runs on two commits can be compared with `--compare`.
+
+    python benchmarks/endpoint_latency.py --emails 50000 --output before.json
+    python benchmarks/endpoint_latency.py --emails 50000 --output after.json --compare before.json
+
+The search result cache is off unless `--result-cache` is given, so
+repeated searches measure the queries rather than the cache.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'src'), ROOT]
+
+from mailbox_data import DOMAINS, add_scale_arguments, generate, scale_from_args
+
+
+class Endpoint:
+    """One timed request. `path` may contain {id}, filled in by `prepare`,
+    which runs untimed before each request; `data` builds the form."""
+
+    def __init__(self, name, method, path, data=None, prepare=None, files=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.prepare = prepare
+        self.files = files
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def endpoints(data, rng):
+    """The benchmark's requests, with arguments drawn from the generated `data`."""
+    from db_conn import db
+    from models import Attachment, Email, Folder, Recipient, RecipientType, User
+
+    scale = data.scale
+    user_id = lambda: rng.randint(2, scale.users)
+    email_id = lambda: rng.randint(1, scale.emails)
+    folder_id = lambda: rng.randint(1, data.counts['folders'])
+    word = lambda: rng.choice(data.vocabulary[:300])
+    username = lambda: data.usernames[user_id() - 1]
+
+    def create(model, **values):
+        row = model(**values)
+        db.session.add(row)
+        db.session.commit()
+        return {'id': row.id}
+
+    def doomed_recipient(i):
+        # On an email of its own, so the (type, email, user) triple can't exist yet.
+        email = create(Email, subject=f'Doomed recipient {i}', body='x', sender_id=user_id())
+        return create(Recipient, name=f'Doomed {i}', email_id=email['id'], user_id=1, recipient_type_id=3)
+
+    def existing(model):
+        # A row the generator wrote, with its current values for the form.
+        row = db.session.get(model, rng.randint(1, min(db.session.query(model).count(), 1000)))
+        return {'id': row.id, 'row': row}
+
+    def date_range():
+        start = data.oldest + timedelta(days=rng.randrange(scale.days - 7))
+        return {'start_date': start.strftime('%Y-%m-%d'), 'end_date': (start + timedelta(days=7)).strftime('%Y-%m-%d')}
+
+    return [
+        # Lists
+        Endpoint('emails.list', 'GET', '/emails/list'),
+        Endpoint('users.list', 'GET', '/users/list'),
+        Endpoint('recipients.list', 'GET', '/recipients/list'),
+        Endpoint('attachments.list', 'GET', '/attachments/list'),
+        Endpoint('folders.list', 'GET', '/folders/folders/list'),
+        Endpoint('recipient_types.list', 'GET', '/recipient_types/list'),
+        Endpoint('users.inbox', 'GET', '/users/{id}/inbox', prepare=lambda i: {'id': user_id()}),
+        Endpoint('users.sent', 'GET', '/users/{id}/sent', prepare=lambda i: {'id': user_id()}),
+
+        # Adds
+        Endpoint('emails.add', 'POST', '/emails/emails/add', lambda i, ctx: {
+            'subject': f'Benchmark {i} {word()}', 'body': ' '.join(word() for _ in range(200)),
+            'folder_id': folder_id(),
+        }),
+        Endpoint('users.add', 'POST', '/users/add', lambda i, ctx: {
+            'username': f'bench_user_{i}', 'email': f'bench_user_{i}@{DOMAINS[0]}', 'password': 'Bench-password-1',
+        }),
+        Endpoint('recipients.add', 'POST', '/recipients/add', lambda i, ctx: {
+            'recipient_type': rng.randint(1, 3), 'email_id': email_id(), 'user_id': user_id(),
+            'recipient_name': f'Bench {i}',
+        }),
+        Endpoint('attachments.add', 'POST', '/attachments/add', lambda i, ctx: {'email_id': email_id()},
+                 files=lambda i: {'file': (io.BytesIO(os.urandom(16 * 1024)), f'bench_{i}.bin')}),
+        Endpoint('folders.add', 'POST', '/folders/folders/add', lambda i, ctx: {
+            'folder_name': f'Bench {i}', 'user_id': user_id(),
+        }),
+        Endpoint('recipient_types.add', 'POST', '/recipient_types/add', lambda i, ctx: {'name': f'bench-type-{i}'}),
+
+        # Updates
+        Endpoint('emails.update', 'POST', '/emails/update/{id}', lambda i, ctx: {
+            'subject': f'Updated {i} {word()}', 'body': ' '.join(word() for _ in range(200)),
+        }, prepare=lambda i: {'id': email_id()}),
+        Endpoint('users.update', 'POST', '/users/update/{id}', lambda i, ctx: {
+            'username': ctx['row'].username, 'email': ctx['row'].email,
+        }, prepare=lambda i: existing(User)),
+        Endpoint('recipients.update', 'POST', '/recipients/update_recipient/{id}', lambda i, ctx: {
+            'recipient_type': ctx['row'].recipient_type_id, 'email_id': ctx['row'].email_id,
+            'user_id': ctx['row'].user_id, 'recipient_name': f'Renamed {i}',
+        }, prepare=lambda i: existing(Recipient)),
+        Endpoint('attachments.update', 'POST', '/attachments/attachments/update/{id}', lambda i, ctx: {
+            'file_name': f'renamed_{i}.pdf',
+        }, prepare=lambda i: existing(Attachment)),
+        Endpoint('folders.update', 'POST', '/folders/folders/update/{id}', lambda i, ctx: {
+            'folder_name': f'Renamed {i}', 'user_id': ctx['row'].user_id,
+        }, prepare=lambda i: existing(Folder)),
+        Endpoint('recipient_types.update', 'POST', '/recipient_types/update/{id}', lambda i, ctx: {
+            'name': f'renamed-type-{i}',
+        }, prepare=lambda i: create(RecipientType, name=f'update-type-{i}')),
+
+        # Deletes, each of a row created for it
+        Endpoint('emails.delete', 'POST', '/emails/delete/{id}',
+                 prepare=lambda i: create(Email, subject=f'Doomed {i}', body='x' * 2000, sender_id=user_id())),
+        Endpoint('users.delete', 'POST', '/users/delete/{id}',
+                 prepare=lambda i: create(User, username=f'doomed_{i}', email=f'doomed_{i}@{DOMAINS[0]}', password='x')),
+        Endpoint('recipients.delete', 'POST', '/recipients/delete_recipient/{id}',
+                 prepare=doomed_recipient),
+        Endpoint('attachments.delete', 'POST', '/attachments/attachments/delete/{id}',
+                 prepare=lambda i: create(Attachment, file_name=f'doomed_{i}.txt', file_type='text/plain',
+                                          file_size=10, email_id=email_id())),
+        Endpoint('folders.delete', 'POST', '/folders/folders/delete/{id}',
+                 prepare=lambda i: create(Folder, folder_name=f'Doomed {i}', user_id=1)),
+        Endpoint('recipient_types.delete', 'POST', '/recipient_types/delete/{id}',
+                 prepare=lambda i: create(RecipientType, name=f'doomed-type-{i}')),
+
+        # Searches
+        Endpoint('emails.search_by_sender', 'POST', '/emails/search_by_sender', lambda i, ctx: {'sender': username()}),
+        Endpoint('emails.search_by_keywords', 'POST', '/emails/search_by_keywords', lambda i, ctx: {'keywords': word()}),
+        Endpoint('emails.search_by_date_range', 'POST', '/emails/search_by_date_range', lambda i, ctx: date_range()),
+        Endpoint('emails.search_by_subject_sender', 'POST', '/emails/search_by_subject_sender', lambda i, ctx: {
+            'subject': word(), 'sender': username(),
+        }),
+        Endpoint('emails.search_emails_with_sender', 'POST', '/emails/search_emails_with_sender',
+                 lambda i, ctx: {'keywords': word()}),
+        Endpoint('emails.search_by_recipient', 'POST', '/emails/search_by_recipient', lambda i, ctx: {'recipient': username()}),
+        Endpoint('emails.search_by_domain', 'POST', '/emails/search_by_domain', lambda i, ctx: {'domain': rng.choice(DOMAINS)}),
+        Endpoint('emails.search_full_email_info', 'POST', '/emails/search_full_email_info',
+                 lambda i, ctx: {'keywords': f'{word()} {word()}'}),
+        Endpoint('attachments.search_by_email_id', 'POST', '/attachments/attachments/search_by_email_id',
+                 lambda i, ctx: {'email_id': email_id()}),
+        Endpoint('attachments.search_by_file_name', 'POST', '/attachments/attachments/search_by_file_name',
+                 lambda i, ctx: {'file_name': rng.choice(data.file_names).split('_')[0]}),
+        Endpoint('attachments.search_by_file_size', 'POST', '/attachments/attachments/search_by_file_size', lambda i, ctx: {
+            'min_size': (low := rng.randint(1, 500) * 1024), 'max_size': low + 4096,
+        }),
+        Endpoint('attachments.search_by_email_and_file_name', 'POST',
+                 '/attachments/attachments/search_by_email_and_file_name', lambda i, ctx: {
+                     'email_id': (name := rng.choice(data.file_names)).rsplit('_', 1)[1].split('.')[0],
+                     'file_name': name.split('_')[0],
+                 }),
+        Endpoint('attachments.search_with_users_info', 'POST', '/attachments/attachments/search_with_users_info',
+                 lambda i, ctx: {'search_query': username()}),
+        Endpoint('folders.search_by_name', 'POST', '/folders/folders/search_by_name',
+                 lambda i, ctx: {'folder_name': rng.choice(data.folder_names)}),
+        Endpoint('folders.search_by_user_id', 'POST', '/folders/folders/search_by_user_id',
+                 lambda i, ctx: {'user_id': user_id()}),
+        Endpoint('folders.search_with_user_info', 'POST', '/folders/folders/search_with_user_info',
+                 lambda i, ctx: {'folder_name': rng.choice(data.folder_names)}),
+        Endpoint('folders.search_by_email_folder', 'POST', '/folders/folders/search_by_email_folder',
+                 lambda i, ctx: {'folder_id': folder_id()}),
+        Endpoint('folders.search_with_emails', 'POST', '/folders/folders/search_with_emails',
+                 lambda i, ctx: {'folder_name': rng.choice(data.folder_names)}),
+        Endpoint('recipient_types.search_by_name', 'POST', '/recipient_types/search_by_name',
+                 lambda i, ctx: {'name': rng.choice(('to', 'cc', 'bcc'))}),
+        Endpoint('recipient_types.search_with_recipients', 'POST', '/recipient_types/search_with_recipients',
+                 lambda i, ctx: {'name': rng.choice(('to', 'cc', 'bcc'))}),
+        Endpoint('recipient_types.search_with_emails', 'POST', '/recipient_types/search_with_emails',
+                 lambda i, ctx: {'name': rng.choice(('to', 'cc', 'bcc'))}),
+        Endpoint('recipients.search_by_type', 'POST', '/recipients/search_by_type',
+                 lambda i, ctx: {'type_name': rng.choice(('to', 'cc', 'bcc'))}),
+        Endpoint('recipients.search_recipients_with_emails', 'POST', '/recipients/search_recipients_with_emails',
+                 lambda i, ctx: {'email_subject': word()}),
+        Endpoint('users.search_users_with_folders', 'POST', '/users/search_users_with_folders',
+                 lambda i, ctx: {'folder_name': rng.choice(data.folder_names)}),
+        Endpoint('users.search_users_with_recipients', 'POST', '/users/search_users_with_recipients',
+                 lambda i, ctx: {'recipient_name': username()}),
+        Endpoint('users.search_users_with_email_details', 'POST', '/users/search_users_with_email_details',
+                 lambda i, ctx: {'email_query': word()}),
+        Endpoint('users.search_users_with_folders_emails', 'POST', '/users/search_users_with_folders_emails',
+                 lambda i, ctx: {'username': username()}),
+    ]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def make_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    return client
+
+
+def time_endpoint(app, client, endpoint, iterations, warmup, counter):
+    from db_conn import db
+
+    latencies, queries, statuses = [], [], {}
+    peak = 0
+    for i in range(warmup + iterations + 1):
+        with app.app_context():
+            context = endpoint.prepare(i) if endpoint.prepare else {}
+            form = endpoint.data(i, context) if endpoint.data else None
+            db.session.remove()
+        files = endpoint.files(i) if endpoint.files else {}
+        path = endpoint.path.format(**context)
+        # The last run is measured for memory only; tracing slows it down.
+        traced = i == warmup + iterations
+        if traced:
+            tracemalloc.start()
+
+        counter.count = 0
+        started = time.perf_counter()
+        response = client.open(path, method=endpoint.method, data={**(form or {}), **files})
+        elapsed = time.perf_counter() - started
+
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif i >= warmup:
+            latencies.append(elapsed)
+            queries.append(counter.count)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        response.close()
+        with client.session_transaction() as session:
+            # Redirects are not followed, so nothing would consume these.
+            session.pop('_flashes', None)
+
+    return {
+        'name': endpoint.name,
+        'method': endpoint.method,
+        'path': endpoint.path,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries': statistics.median(queries),
+        'max_queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(output, baseline_path, tolerance):
+    """Print per-endpoint changes against a previous run; returns the regressed names."""
+    with open(baseline_path) as fh:
+        previous = json.load(fh)
+    baseline = {row['name']: row for row in previous['endpoints']}
+    print(f"\nAgainst {baseline_path} (commit {previous['meta'].get('commit')}):")
+    for key in ('dialect', 'scale', 'rows', 'result_cache'):
+        if previous['meta'].get(key) != output['meta'][key]:
+            print(f"warning: {key} differs from the baseline, so timings are not comparable")
+    regressed = []
+    for row in output['endpoints']:
+        before = baseline.get(row['name'])
+        if before is None:
+            continue
+        ratio = row['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+        query_delta = row['queries'] - before['queries']
+        flag = ''
+        if ratio > 1 + tolerance or query_delta > 0:
+            flag = '  REGRESSION'
+            regressed.append(row['name'])
+        print(f"{row['name']:<50} p95 {before['p95_ms']:>9.2f} -> {row['p95_ms']:>9.2f} ms ({ratio:>5.2f}x)  "
+              f"queries {before['queries']:g} -> {row['queries']:g}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='an empty database to fill (default: a temporary SQLite file)')
+    add_scale_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=30, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests per endpoint first')
+    parser.add_argument('--only', nargs='+', help='run endpoints whose name contains any of these')
+    parser.add_argument('--result-cache', action='store_true', help='leave the search result cache on')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='p95 slowdown allowed before --compare reports a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        from app import create_app
+        from migrations import upgrade
+
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': url,
+            'SQLALCHEMY_BINDS': {},
+            'RATELIMIT_STORAGE_URI': 'memory://',
+            'WTF_CSRF_ENABLED': False,
+            'SESSION_COOKIE_SECURE': False,
+            'SQL_SERVER_TIMING': False,
+            'RESULT_CACHE_ENABLED': args.result_cache,
+            'ATTACHMENT_STORE': os.path.join(tmp, 'attachments'),
+        })
+        app.template_folder = os.path.join(ROOT, 'templates')
+        app.static_folder = os.path.join(ROOT, 'static')
+
+        with app.app_context():
+            upgrade()
+            data = generate(scale_from_args(args), seed=args.seed)
+
+        counter = QueryCounter()
+        event.listen(Engine, 'before_cursor_execute', counter)
+        client = make_client(app)
+        rng = random.Random(args.seed)
+
+        results = []
+        for endpoint in endpoints(data, rng):
+            if args.only and not any(part in endpoint.name for part in args.only):
+                continue
+            result = time_endpoint(app, client, endpoint, args.iterations, args.warmup, counter)
+            results.append(result)
+            print(f"{result['name']:<50} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                  f"queries {result['queries']:>5g}  peak {result['peak_memory_kb']:>9.1f} KB  {result['statuses']}")
+
+        with app.app_context():
+            dialect = app.extensions['sqlalchemy'].engine.dialect.name
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'dialect': dialect,
+            'seed': args.seed,
+            'scale': data.scale.as_dict(),
+            'rows': data.counts,
+            'iterations': args.iterations,
+            'result_cache': args.result_cache,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'endpoints': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(output, fh, indent=2)
+
+    if args.compare and compare(output, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Build a synthetic mailbox dataset at a chosen scale.
+
+Fills an empty database (SQLite or MySQL, via `--database-url`) with
+users, per-user folders, emails whose body sizes follow a long-tailed
+distribution, recipients, attachment rows and the email/folder links, then
+rebuilds the counters, search indexes and mailbox index the app maintains. The same seed
+and scale always produce the same rows, so runs on different commits
+compare like with like.
+
+    python benchmarks/mailbox_data.py --database-url sqlite:///bench.db --emails 50000
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from flask import Flask
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from db_conn import db, engine_options
+from migrations import upgrade
+from models import Attachment, Email, EmailBody, EmailFolder, Folder, Recipient, RecipientType, User
+from body_codec import encode_body
+from search import rebuild_search_index
+from stats import rebuild_stats
+from trigram import rebuild_trigram_index
+from mailbox_index import rebuild_mailbox_index
+from folder_stats import reconcile_folder_stats
+
+BATCH_SIZE = 5000
+
+# Every generated account shares this password, hashed once.
+PASSWORD = 'Bench-password-1'
+
+DOMAINS = ('example.com', 'example.org', 'example.net', 'mail.example.com', 'corp.example.org')
+RECIPIENT_TYPES = ('to', 'cc', 'bcc')
+STANDARD_FOLDERS = ('Inbox', 'Sent', 'Archive')
+ATTACHMENT_TYPES = (
+    ('pdf', 'application/pdf'), ('png', 'image/png'), ('jpg', 'image/jpeg'),
+    ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    ('txt', 'text/plain'), ('zip', 'application/zip'),
+)
+SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pra', 'sto', 'len', 'dor', 'fin', 'gal', 'ber')
+
+
+class Scale:
+    """How much data to generate. Means are per user or per email."""
+
+    def __init__(self, users=200, emails=20000, recipients_per_email=2.5, folders_per_user=5,
+                 attachment_ratio=0.2, body_median=1500, body_max=64 * 1024, days=730):
+        self.users = users
+        self.emails = emails
+        self.recipients_per_email = recipients_per_email
+        self.folders_per_user = max(folders_per_user, len(STANDARD_FOLDERS))
+        self.attachment_ratio = attachment_ratio
+        self.body_median = body_median
+        self.body_max = body_max
+        self.days = days
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class Dataset:
+    """What was generated; the endpoint benchmark picks its arguments from here."""
+
+    def __init__(self, scale, seed):
+        self.scale = scale
+        self.seed = seed
+        self.vocabulary = []
+        self.usernames = []
+        self.folder_names = []
+        self.file_names = []
+        self.subjects = []
+        self.counts = {}
+        self.newest = self.oldest = None
+
+    def user_email(self, user_id):
+        return f'{self.usernames[user_id - 1]}@{DOMAINS[user_id % len(DOMAINS)]}'
+
+
+def make_vocabulary(rng, size=3000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+class _Words:
+    """Zipf-distributed words, so a few are very common and most are rare."""
+
+    def __init__(self, rng, vocabulary):
+        self.rng = rng
+        self.vocabulary = vocabulary
+        self.weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+    def take(self, count):
+        return self.rng.choices(self.vocabulary, cum_weights=self.weights, k=count)
+
+    def text(self, length):
+        # ~7 characters per word including the space.
+        return ' '.join(self.take(max(1, length // 7)))[:length]
+
+
+def _batched(execute, model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def generate(scale, seed=1, log=print):
+    """Insert the dataset into the current app's (empty) database."""
+    rng = random.Random(seed)
+    data = Dataset(scale, seed)
+    data.vocabulary = make_vocabulary(rng)
+    words = _Words(rng, data.vocabulary)
+    execute = db.session.execute
+    started = time.perf_counter()
+
+    password = generate_password_hash(PASSWORD)
+    now = datetime(2024, 6, 1)
+    data.newest, data.oldest = now, now - timedelta(days=scale.days)
+
+    # Users: user 1 is the admin the benchmark logs in as.
+    users = []
+    for user_id in range(1, scale.users + 1):
+        username = 'admin' if user_id == 1 else f'{words.take(1)[0]}{user_id}'
+        data.usernames.append(username)
+        users.append({
+            'id': user_id, 'username': username, 'email': data.user_email(user_id), 'password': password,
+            'is_admin': user_id == 1, 'created_at': data.oldest, 'failed_login_attempts': 0,
+        })
+    _batched(execute, User, users)
+
+    execute(insert(RecipientType), [{'id': i, 'name': name} for i, name in enumerate(RECIPIENT_TYPES, 1)])
+
+    # Folders: the standard three for everyone, plus named extras.
+    folders, user_folders = [], {}
+    extra_names = [word.capitalize() for word in words.take(scale.folders_per_user * 4)]
+    for user_id in range(1, scale.users + 1):
+        names = list(STANDARD_FOLDERS)
+        for name in rng.sample(extra_names, min(len(extra_names), scale.folders_per_user - len(names))):
+            if name not in names:
+                names.append(name)
+        for name in names:
+            folders.append({'id': len(folders) + 1, 'folder_name': name, 'user_id': user_id})
+            user_folders.setdefault(user_id, []).append(len(folders))
+    data.folder_names = sorted({folder['folder_name'] for folder in folders})
+    _batched(execute, Folder, folders)
+
+    # Emails, with their bodies, recipients, attachments and folder links.
+    emails, bodies, recipients, attachments, links = [], [], [], [], []
+    log_median = math.log(scale.body_median)
+    span = scale.days * 86400
+    for email_id in range(1, scale.emails + 1):
+        sender_id = rng.randint(1, scale.users)
+        sent_folder = user_folders[sender_id][1]
+        body_length = min(scale.body_max, max(20, int(rng.lognormvariate(log_median, 1.0))))
+        subject = ' '.join(words.take(rng.randint(3, 8))).capitalize()
+        if len(data.subjects) < 200:
+            data.subjects.append(subject)
+        emails.append({
+            'id': email_id, 'subject': subject[:255], 'sender_id': sender_id,
+            'sent_at': now - timedelta(seconds=rng.randrange(span)), 'folder_id': sent_folder,
+        })
+        codec, content = encode_body(words.text(body_length))
+        bodies.append({'email_id': email_id, 'codec': codec, 'content': content})
+        links.append({'email_id': email_id, 'folder_id': sent_folder})
+
+        count = min(scale.users - 1, max(1, round(rng.expovariate(1 / scale.recipients_per_email))))
+        chosen = [user_id for user_id in rng.sample(range(1, scale.users + 1), count + 1) if user_id != sender_id]
+        for user_id in chosen[:count]:
+            recipients.append({
+                'name': data.usernames[user_id - 1], 'email_id': email_id, 'user_id': user_id,
+                'recipient_type_id': rng.choices((1, 2, 3), weights=(8, 3, 1))[0],
+            })
+            folder_id = rng.choice(user_folders[user_id]) if rng.random() < 0.3 else user_folders[user_id][0]
+            links.append({'email_id': email_id, 'folder_id': folder_id})
+
+        if rng.random() < scale.attachment_ratio:
+            for _ in range(rng.choice((1, 1, 1, 2, 3))):
+                extension, file_type = rng.choice(ATTACHMENT_TYPES)
+                file_name = f'{words.take(1)[0]}_{email_id}.{extension}'
+                if len(data.file_names) < 200:
+                    data.file_names.append(file_name)
+                attachments.append({
+                    'file_name': file_name, 'file_type': file_type, 'email_id': email_id,
+                    'file_size': min(25 * 1024 * 1024, int(rng.lognormvariate(math.log(60 * 1024), 1.5))),
+                })
+
+        if len(emails) >= BATCH_SIZE:
+            _flush_emails(execute, emails, bodies, recipients, attachments, links)
+
+    _flush_emails(execute, emails, bodies, recipients, attachments, links)
+    db.session.commit()
+
+    log(f"Inserted rows in {time.perf_counter() - started:.1f}s; rebuilding derived tables")
+    rebuild_stats()
+    rebuild_search_index()
+    rebuild_trigram_index()
+    rebuild_mailbox_index()
+    reconcile_folder_stats()
+    db.session.commit()
+
+    for model in (User, Folder, Email, Recipient, Attachment, EmailFolder):
+        data.counts[model.__tablename__] = db.session.query(model).count()
+    log(f"Generated {data.counts} in {time.perf_counter() - started:.1f}s")
+    return data
+
+
+def _flush_emails(execute, emails, bodies, recipients, attachments, links):
+    # Parents first; the lists are emptied in place for the next batch.
+    for model, rows in ((Email, emails), (EmailBody, bodies), (Recipient, recipients), (Attachment, attachments),
+                        (EmailFolder, links)):
+        _batched(execute, model, rows)
+        rows.clear()
+
+
+def make_app(url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def add_scale_arguments(parser):
+    defaults = Scale()
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--emails', type=int, default=defaults.emails)
+    parser.add_argument('--recipients-per-email', type=float, default=defaults.recipients_per_email)
+    parser.add_argument('--folders-per-user', type=int, default=defaults.folders_per_user)
+    parser.add_argument('--attachment-ratio', type=float, default=defaults.attachment_ratio,
+                        help='fraction of emails with attachments')
+    parser.add_argument('--body-median', type=int, default=defaults.body_median, help='median body size in bytes')
+    parser.add_argument('--body-max', type=int, default=defaults.body_max)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def scale_from_args(args):
+    return Scale(
+        users=args.users, emails=args.emails, recipients_per_email=args.recipients_per_email,
+        folders_per_user=args.folders_per_user, attachment_ratio=args.attachment_ratio,
+        body_median=args.body_median, body_max=args.body_max,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='an empty database to fill')
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        upgrade()
+        generate(scale_from_args(args), seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Measure login throughput of the password service against worker count.
+
+Simulates a burst of logins: `--concurrency` request threads each verify
+passwords through a `PasswordService` with the given number of hashing
+processes (0 = on the request thread). Reports logins per second, latency
+percentiles and how many attempts were turned away as busy.
+
+    python benchmarks/password_throughput.py --workers 0 1 2 4 8 --concurrency 16
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from werkzeug.security import generate_password_hash
+
+from passwords import DEFAULT_METHOD, PasswordService, PasswordServiceBusy
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(workers, concurrency, logins, method, queue_size, queue_timeout):
+    stored = generate_password_hash('Correct-horse-1', method=method, salt_length=16)
+    service = PasswordService(method=method, workers=workers, queue_size=queue_size, queue_timeout=queue_timeout)
+    if workers:
+        service.verify(stored, 'warm-up')  # start the pool outside the timed section
+
+    latencies, busy = [], []
+    lock = threading.Lock()
+    remaining = [logins]
+
+    def request_thread():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                service.verify(stored, 'Correct-horse-1')
+            except PasswordServiceBusy:
+                with lock:
+                    busy.append(1)
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=request_thread) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    service.shutdown()
+
+    return {
+        'workers': workers,
+        'concurrency': concurrency,
+        'logins_per_sec': round(len(latencies) / wall, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'busy': len(busy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=16, help='simultaneous login requests')
+    parser.add_argument('--logins', type=int, default=64, help='login attempts per run')
+    parser.add_argument('--method', default=DEFAULT_METHOD, help='werkzeug hash method to verify against')
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--queue-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, method {args.method}")
+    results = []
+    for workers in args.workers:
+        result = run(workers, args.concurrency, args.logins, args.method, args.queue_size, args.queue_timeout)
+        results.append(result)
+        print(f"{result['workers']:>3} workers  {result['logins_per_sec']:>8.2f} logins/s  "
+              f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  busy {result['busy']}")
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
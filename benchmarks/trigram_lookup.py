@@ -0,0 +1,174 @@
+"""Compare trigram-backed substring lookups with a plain ILIKE scan.
+
+Builds a throwaway SQLite database of N users for each requested size, most
+of them on a few shared mail domains and with usernames built from common
+name parts, indexes it, and times `trigram.contains(column, needle)` against
+the plain match for two kinds of needle:
+
+- rare: part of one user's name, found through the index;
+- common: a shared domain or name part that most rows contain, where the
+  lookup falls back to the scan.
+
+Every lookup must return the same rows as the scan. The run fails if rare
+lookups grow with N faster than --max-slope (the exponent of a power-law fit
+of time against N; a scan is about 1) or if common lookups take more than
+--max-common-ratio times the scan.
+
+    python benchmarks/trigram_lookup.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from flask import Flask
+from sqlalchemy import insert
+
+from db_conn import db
+from models import User
+from stats import rebuild_stats
+from trigram import contains, rebuild_trigram_index
+
+FIRST_NAMES = ['anna', 'john', 'maria', 'james', 'linda', 'robert', 'susan', 'michael', 'karen', 'david']
+LAST_NAMES = ['smith', 'johnson', 'williams', 'brown', 'jones', 'miller', 'davis', 'wilson', 'anderson', 'taylor']
+# Most addresses share a handful of domains, as in a company mailbox.
+DOMAINS = [('example.com', 60), ('mail.example.org', 25), ('corp.example.net', 10)]
+COMMON_NEEDLES = [(User.email, 'example.com'), (User.email, 'example'), (User.email, '.com'), (User.username, 'son')]
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def random_username(rng, i):
+    return f'{rng.choice(FIRST_NAMES)}.{rng.choice(LAST_NAMES)}{i}'
+
+
+def random_domain(rng):
+    if rng.random() < 0.05:
+        return f'host{rng.randrange(10000)}.test'
+    return rng.choices([name for name, _ in DOMAINS], weights=[weight for _, weight in DOMAINS])[0]
+
+
+def populate(size, rng, batch_size=10000):
+    usernames = []
+    for start in range(0, size, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, size)):
+            username = random_username(rng, i)
+            usernames.append(username)
+            rows.append({'username': username, 'email': f'{username}@{random_domain(rng)}', 'password': 'x'})
+        db.session.execute(insert(User), rows)
+    db.session.commit()
+    return usernames
+
+
+def time_lookup(make_filter, repeat):
+    """Median seconds to build the filter (which may read the trigram counts) and fetch the ids."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        ids = [row[0] for row in db.session.query(User.id).filter(make_filter()).all()]
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), sorted(ids)
+
+
+def run(size, lookups, repeat, seed):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            usernames = populate(size, rng)
+            rebuild_stats()
+            rebuild_trigram_index()
+
+            # The digits make these unique: '.smith1234' -> 'ith1234'.
+            rare = [(User.username, name[-7:]) for name in rng.sample(usernames, min(lookups, size))]
+            timings = {}
+            for kind, needles in (('rare', rare), ('common', COMMON_NEEDLES)):
+                trigram_times, scan_times = [], []
+                for column, needle in needles:
+                    trigram_time, found = time_lookup(lambda: contains(column, needle), repeat)
+                    scan_time, expected = time_lookup(lambda: column.icontains(needle, autoescape=True), repeat)
+                    if found != expected:
+                        raise AssertionError(f"{size} users: contains({column}, {needle!r}) returned "
+                                             f"{len(found)} rows, the scan {len(expected)}")
+                    trigram_times.append(trigram_time)
+                    scan_times.append(scan_time)
+                timings[f'{kind}_trigram_ms'] = round(statistics.median(trigram_times) * 1000, 3)
+                timings[f'{kind}_scan_ms'] = round(statistics.median(scan_times) * 1000, 3)
+            db.session.remove()
+            db.engine.dispose()
+
+    return {'users': size, **timings}
+
+
+def growth_exponent(results, key):
+    """Slope of log(time) against log(users): about 1 for a scan, near 0 for an index lookup."""
+    xs = [math.log(result['users']) for result in results]
+    ys = [math.log(max(result[key], 1e-3)) for result in results]
+    mean_x, mean_y = statistics.mean(xs), statistics.mean(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+
+def check(results, max_slope, max_common_ratio):
+    """Problems with `results`, as messages; empty when the lookups scale as they should."""
+    problems = []
+    if len(results) > 1:
+        slope = growth_exponent(results, 'rare_trigram_ms')
+        print(f"rare lookup time grows as users^{slope:.2f}")
+        if slope > max_slope:
+            problems.append(f"rare lookups grow as users^{slope:.2f}, over the allowed users^{max_slope}")
+    for result in results:
+        # 1 ms of slack, so timer noise on small tables does not count.
+        if result['common_trigram_ms'] > result['common_scan_ms'] * max_common_ratio + 1:
+            problems.append(f"{result['users']} users: common lookups took {result['common_trigram_ms']} ms, "
+                            f"the scan {result['common_scan_ms']} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=20, help='distinct rare needles per size')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per needle')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-slope', type=float, default=0.5,
+                        help='largest allowed growth exponent of rare lookups (a scan is about 1)')
+    parser.add_argument('--max-common-ratio', type=float, default=1.5,
+                        help='largest allowed common lookup time as a multiple of the scan')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run(size, args.lookups, args.repeat, args.seed)
+        results.append(result)
+        print(f"{result['users']:>10} users  rare: trigram {result['rare_trigram_ms']:>9.3f} ms  "
+              f"scan {result['rare_scan_ms']:>9.3f} ms  common: trigram {result['common_trigram_ms']:>9.3f} ms  "
+              f"scan {result['common_scan_ms']:>9.3f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    problems = check(results, args.max_slope, args.max_common_ratio)
+    for problem in problems:
+        print(f"FAIL: {problem}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
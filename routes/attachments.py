@@ -1,62 +1,132 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import os
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, current_app
 from sqlalchemy.exc import SQLAlchemyError
 from models import Attachment, Email, User, db 
+from pagination import paginate_request
+from loading import loading_profile
+from blob_store import get_blob_store, BlobTooLarge
+from result_cache import cached_result
+import logging
 
 attachment_bp = Blueprint('attachment', __name__)
+logger = logging.getLogger(__name__)
 
 @attachment_bp.route('/list')
 def list_attachments():
-    attachments = Attachment.query.all()
+    attachments = paginate_request(Attachment.query.options(*loading_profile('row')), Attachment.id)
     return render_template('attachments/list.html', attachments=attachments)
 
+def store_content(attachment, stream, file_name):
+    """Stream an upload into the blob store and describe `attachment` by it."""
+    blob = get_blob_store().save(stream, file_name=file_name)
+    attachment.file_name = file_name
+    attachment.content_hash = blob.digest
+    attachment.file_size = blob.size
+    attachment.file_type = blob.mimetype[:50]
+
+
 @attachment_bp.route('/add', methods=['GET', 'POST'])
 def add_attachment():
     if request.method == 'POST':
-        email_id = request.form['email_id']
-        file_name = request.form['file_name']
-        file_type = request.form['file_type']
-        file_size = request.form['file_size']
-        
-        new_attachment = Attachment(
-            email_id=email_id,
-            file_name=file_name,
-            file_type=file_type,
-            file_size = file_size,
-        )
-        
+        email_id = request.form.get('email_id', type=int)
+        upload = request.files.get('file')
+
+        if not upload or not upload.filename:
+            flash("Please choose a file to attach.", "error")
+            return redirect(url_for('attachment.add_attachment'))
+        if email_id is None or db.session.get(Email, email_id) is None:
+            flash("Email not found.", "error")
+            return redirect(url_for('attachment.add_attachment'))
+
         try:
+            new_attachment = Attachment(email_id=email_id)
+            store_content(new_attachment, upload.stream, os.path.basename(upload.filename))
             db.session.add(new_attachment)
             db.session.commit()
             flash("Attachment added successfully!", "success")
+        except BlobTooLarge as e:
+            flash(str(e), "error")
         except SQLAlchemyError as e:
             db.session.rollback()
             flash("An error occurred while adding the attachment.", "error")
-            print(f"Error: {str(e)}")
+            logger.exception("Error adding attachment")
         return redirect(url_for('attachment.list_attachments'))
     
     return render_template('attachments/add.html')
 
+@attachment_bp.route('/upload', methods=['POST', 'PUT'])
+def upload_attachment():
+    """Attach the raw request body to an email, read in chunks.
+
+    Usage: PUT /attachments/upload?email_id=1&file_name=report.pdf with the file as the body.
+    """
+    email_id = request.args.get('email_id', type=int)
+    file_name = os.path.basename(request.args.get('file_name', '').strip())
+    if not file_name:
+        return jsonify(error="file_name is required."), 400
+    if email_id is None or db.session.get(Email, email_id) is None:
+        return jsonify(error="Email not found."), 404
+
+    try:
+        attachment = Attachment(email_id=email_id)
+        store_content(attachment, request.stream, file_name)
+        db.session.add(attachment)
+        db.session.commit()
+    except BlobTooLarge as e:
+        return jsonify(error=str(e)), 413
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.exception("Error adding attachment")
+        return jsonify(error="An error occurred while adding the attachment."), 500
+
+    return jsonify(
+        id=attachment.id, file_name=attachment.file_name, file_type=attachment.file_type,
+        file_size=attachment.file_size, content_hash=attachment.content_hash,
+    ), 201
+
+@attachment_bp.route('/<int:attachment_id>/download')
+def download_attachment(attachment_id):
+    attachment = Attachment.query.get_or_404(attachment_id)
+    if not attachment.content_hash:
+        abort(404)
+    path = get_blob_store().path(attachment.content_hash)
+    if not os.path.exists(path):
+        abort(404)
+    # The content hash is a strong ETag; conditional=True answers
+    # If-None-Match and Range requests. With USE_X_SENDFILE the front-end
+    # server sends the file, otherwise the WSGI server's file_wrapper does.
+    return send_file(
+        path,
+        mimetype=attachment.file_type,
+        as_attachment=True,
+        download_name=attachment.file_name,
+        etag=attachment.content_hash,
+        conditional=True,
+        max_age=current_app.config.get('ATTACHMENT_CACHE_MAX_AGE', 0),
+    )
+
 @attachment_bp.route('/attachments/update/<int:attachment_id>', methods=['GET', 'POST'])
 def update_attachment(attachment_id):
     attachment = Attachment.query.get_or_404(attachment_id)
     
     if request.method == 'POST':
-        file_name = request.form['file_name']
-        file_path = request.form['file_path']
-        file_size = request.form['file_size']
-        file_type = request.form['file_type']
+        file_name = os.path.basename(request.form['file_name'].strip())
+        upload = request.files.get('file')
 
         try:
-            attachment.file_name = file_name
-            attachment.file_path = file_path
-            attachment.file_size = file_size
-            attachment.file_type = file_type
+            if upload and upload.filename:
+                store_content(attachment, upload.stream, file_name or os.path.basename(upload.filename))
+            elif file_name:
+                attachment.file_name = file_name
             db.session.commit()
             flash("Attachment updated successfully!", "success")
+        except BlobTooLarge as e:
+            flash(str(e), "error")
         except SQLAlchemyError as e:
             db.session.rollback()
             flash("An error occurred while updating the attachment.", "error")
-            print(f"Error: {str(e)}")
+            logger.exception("Error updating attachment %s", attachment_id)
         return redirect(url_for('attachment.list_attachments'))
     
     return render_template('attachments/update.html', attachment=attachment)
@@ -72,10 +142,11 @@ def delete_attachment(attachment_id):
     except SQLAlchemyError as e:
         db.session.rollback()
         flash("An error occurred while deleting the attachment.", "error")
-        print(f"Error: {str(e)}")
+        logger.exception("Error deleting attachment %s", attachment_id)
     return redirect(url_for('attachment.list_attachments'))
 
 @attachment_bp.route('/attachments/search_by_email_id', methods=['GET', 'POST'])
+@cached_result
 def search_by_email_id():
     attachments = []
     if request.method == 'POST':
@@ -92,6 +163,7 @@ def search_by_email_id():
     return render_template('attachments/search_by_email_id.html', attachments=attachments)
 
 @attachment_bp.route('/attachments/search_by_file_name', methods=['GET', 'POST'])
+@cached_result
 def search_by_file_name():
     attachments = []
     if request.method == 'POST':
@@ -100,6 +172,7 @@ def search_by_file_name():
     return render_template('attachments/search_by_file_name.html', attachments=attachments)
 
 @attachment_bp.route('/attachments/search_by_file_size', methods=['GET', 'POST'])
+@cached_result
 def search_by_file_size():
     attachments_with_email_user = []
 
@@ -124,6 +197,7 @@ def search_by_file_size():
 
 
 @attachment_bp.route('/attachments/search_by_email_and_file_name', methods=['GET', 'POST'])
+@cached_result
 def search_by_email_and_file_name():
     attachments = []
     if request.method == 'POST':
@@ -136,6 +210,7 @@ def search_by_email_and_file_name():
 
 
 @attachment_bp.route('/attachments/search_with_users_info', methods=['GET', 'POST'])
+@cached_result
 def search_with_users_info():
     attachments_with_user = []
     
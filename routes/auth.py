@@ -1,23 +1,43 @@
-from flask import Blueprint, request, redirect, url_for, flash, session, render_template, g
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, redirect, url_for, flash, session, render_template, g, current_app
 from datetime import datetime
 from functools import wraps
 from flask_login import login_required, current_user, login_user, logout_user
 import re
-import dns.resolver
 import logging
-from email_validator import validate_email, EmailNotValidError
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from pyotp import TOTP
 
 from models import db, User
+from session_user import invalidate_session_user, load_session_user
+from lockout import is_locked_out, record_failure, clear_failures
+from passwords import hash_password, verify_password, needs_rehash, PasswordServiceBusy
+from email_domains import is_valid_email, has_mail_host
+from rate_limit import limiter, account_key
 
 auth_bp = Blueprint('auth', __name__, template_folder='templates/auth')
+logger = logging.getLogger(__name__)
+# Authentication events, also written to LOG_SECURITY_FILE.
+security_logger = logging.getLogger('security')
 
-limiter = Limiter(key_func=get_remote_address, default_limits=["200 per day", "50 per hour"])
 
-logging.basicConfig(filename='security.log', level=logging.WARNING)
+def ip_rate_limit():
+    return current_app.config['AUTH_RATE_LIMIT_PER_IP']
+
+
+def account_rate_limit():
+    return current_app.config['AUTH_RATE_LIMIT_PER_ACCOUNT']
+
+
+def rate_limited(fn):
+    """Limit POSTs to an auth endpoint per client IP and per target account."""
+    fn = limiter.limit(account_rate_limit, key_func=account_key, methods=['POST'])(fn)
+    return limiter.limit(ip_rate_limit, methods=['POST'])(fn)
+
+
+@auth_bp.app_errorhandler(429)
+def too_many_attempts(e):
+    flash("Too many attempts. Please wait a moment and try again.", "error")
+    if request.endpoint == 'auth.register':
+        return render_template('auth/register.html'), 429
+    return render_template('auth/login.html', mfa_required=False), 429
 
 
 def role_required(*roles):
@@ -39,22 +59,9 @@ def is_strong_password(password):
     return re.match(password_regex, password) is not None
 
 
-def is_valid_email(email):
-    """Validate email format and domain."""
-    try:
-        validate_email(email)
-        return True
-    except EmailNotValidError:
-        return False
-
-
 def has_mx_record(domain):
-    """Check if the email domain has MX (Mail Exchange) records."""
-    try:
-        records = dns.resolver.resolve(domain, 'MX')
-        return len(records) > 0
-    except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN, Exception):
-        return False
+    """Check if the email domain accepts mail (cached, time-boxed DNS)."""
+    return has_mail_host(domain)
 
 
 def is_valid_username(username):
@@ -65,10 +72,11 @@ def is_valid_username(username):
 
 def log_suspicious_activity(activity, details):
     """Log suspicious activity."""
-    logging.warning(f"{activity} - {details}")
+    security_logger.warning("%s - %s", activity, details, extra={'event': 'auth.suspicious'})
 
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@rate_limited
 def register():
     if current_user.is_authenticated:
         flash("You are already logged in.", "info")
@@ -105,7 +113,11 @@ def register():
             flash("Username or email is already registered!", "error")
             return redirect(url_for('auth.register'))
 
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256', salt_length=16)
+        try:
+            hashed_password = hash_password(password)
+        except PasswordServiceBusy:
+            flash("The server is busy. Please try again in a moment.", "error")
+            return render_template('auth/register.html'), 503
         new_user = User(
             username=username,
             password=hashed_password,
@@ -122,6 +134,7 @@ def register():
 
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@rate_limited
 def login():
     if current_user.is_authenticated:
         flash("You are already logged in.", "info")
@@ -131,30 +144,53 @@ def login():
         email = request.form['email']
         password = request.form['password']
 
-        user = User.query.filter_by(email=email).first()
+        user = (
+            db.session.query(User.id, User.password, User.mfa_secret, User.failed_login_attempts, User.lock_time)
+            .filter(User.email == email)
+            .first()
+        )
 
         if user:
-            if user.is_locked():
+            if is_locked_out(user.failed_login_attempts, user.lock_time):
                 flash("Account is locked. Try again later.", "error")
                 return redirect(url_for('auth.login'))
 
-            if check_password_hash(user.password, password):
-                if user.mfa_secret:
-                    session['mfa_user_id'] = user.id  
-                    print(f"User requires MFA, session ID: {session.sid}")
-                    return render_template('auth/login.html', mfa_required=True, email=email)  
-                else:
-                    user.failed_login_attempts = 0
+            try:
+                password_ok = verify_password(user.password, password)
+                new_hash = hash_password(password) if password_ok and needs_rehash(user.password) else None
+            except PasswordServiceBusy:
+                flash("The server is busy. Please try again in a moment.", "error")
+                return render_template('auth/login.html', mfa_required=False), 503
+
+            if password_ok and new_hash:
+                db.session.execute(
+                    db.update(User).where(User.id == user.id).values(password=new_hash)
+                    .execution_options(skip_version_bump=True)
+                )
+
+            if password_ok and user.mfa_secret:
+                db.session.commit()
+                session['mfa_user_id'] = user.id  
+                security_logger.info("Password accepted, MFA required",
+                                     extra={'event': 'auth.mfa_required', 'login_user_id': user.id})
+                return render_template('auth/login.html', mfa_required=True, email=email)  
+            elif password_ok:
+                # The reset re-checks the lock, so a lock set by a concurrent
+                # attempt since the read above still wins.
+                if not clear_failures(user.id):
                     db.session.commit()
-                    print(f"Logging in user {user.id}")
-                    login_user(user, remember=False)
-                    flash("Login successful!", "success")
-                    return redirect(url_for('index'))
+                    flash("Account is locked. Try again later.", "error")
+                    return redirect(url_for('auth.login'))
+                db.session.commit()
+                invalidate_session_user(user.id)
+                security_logger.info("User logged in", extra={'event': 'auth.login', 'login_user_id': user.id})
+                login_user(load_session_user(user.id), remember=False)
+                flash("Login successful!", "success")
+                return redirect(url_for('index'))
             else:
-                user.failed_login_attempts += 1
-                if user.failed_login_attempts >= 5:
-                    user.lock_time = datetime.now()  
+                record_failure(user.id, user.failed_login_attempts)
                 db.session.commit()
+                invalidate_session_user(user.id)
                 flash("Invalid email or password!", "error")
         else:
             flash("Invalid email or password!", "error")
@@ -173,11 +209,12 @@ def logout():
 def enable_mfa():
     """Enable Multi-Factor Authentication (MFA) for the user."""
     if request.method == 'POST':
+        import pyotp
         totp = pyotp.TOTP(pyotp.random_base32())  
-        user = current_user
+        user = User.query.get(current_user.id)
         user.mfa_secret = totp.secret  
 
-        print(f"Generated MFA secret for {user.username}: {user.mfa_secret}")
+        security_logger.info("MFA secret generated", extra={'event': 'auth.mfa_enabled', 'login_user_id': user.id})
 
         db.session.commit() 
         qr_code_url = totp.provisioning_uri(name=user.email, issuer_name="YourAppName")
@@ -190,6 +227,7 @@ def enable_mfa():
 
 
 @auth_bp.route('/verify_mfa', methods=['POST'])
+@rate_limited
 @login_required
 def verify_mfa():
     email = request.form['email']
@@ -213,5 +251,6 @@ def verify_mfa():
     
     
 def verify_mfa_token(mfa_secret, mfa_token):
+    import pyotp
     totp = pyotp.TOTP(mfa_secret)
     return totp.verify(mfa_token)
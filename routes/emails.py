@@ -1,25 +1,25 @@
-from flask import Blueprint, request, flash, redirect, url_for, render_template
+from flask import Blueprint, request, flash, redirect, url_for, render_template, jsonify, abort
 from flask_login import login_required  
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload
 from flask_login import login_required, current_user
-from db_conn import db
+from db_conn import db, replica_reads
 from models import Email, User, Folder, Recipient, RecipientType, EmailFolder
+from pagination import paginate_request, get_page_size
+from search import search_emails, in_rank_order
+from trigram import contains
+from loading import loading_profile
+from result_cache import cached_result
+from export import SEARCHES, export_request
 import logging
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.ERROR)  
-file_handler = logging.FileHandler('error_log.log')
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 
 email_bp = Blueprint('email', __name__)
 
 @email_bp.route('/list')
 def list_emails():
-    emails = Email.query.all()
+    emails = paginate_request(Email.query.options(*loading_profile('email_list_row')), Email.sent_at, Email.id)
     return render_template('emails/list.html', emails=emails)
 
 @email_bp.route('/emails/add', methods=['GET', 'POST'])
@@ -35,26 +35,26 @@ def add_email():
 
             if not subject or not body:
                 flash("Subject and body are required.", "error")
-                return redirect(url_for('emails.add_email'))
+                return redirect(url_for('email.add_email'))
 
             new_email = Email(subject=subject, body=body, sender_id=sender_id, sent_at=sent_at)
             db.session.add(new_email)
-            db.session.commit()
+            db.session.flush()
 
             if folder_id:
                 folder = Folder.query.get(folder_id)
                 if folder:
-                    email_folder = EmailFolder(email_id=new_email.id, folder_id=folder.id)
-                    db.session.add(email_folder)
-                    db.session.commit()
+                    db.session.add(EmailFolder(email_id=new_email.id, folder_id=folder.id))
+
+            db.session.commit()
 
             flash("Email added successfully!", "success")
         except Exception as e:
             db.session.rollback()
             flash(f"An error occurred while adding the email: {e}", "error")
-            print(f"Error: {e}")
+            logger.exception("Error adding email")
 
-        return redirect(url_for('emails.list_emails'))
+        return redirect(url_for('email.list_emails'))
     
     folders = Folder.query.all()
     return render_template('emails/add.html', folders=folders)
@@ -96,6 +96,8 @@ def delete_email(id):
     return redirect(url_for('email.list_emails'))
 
 @email_bp.route('/search_by_sender', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_sender():
     emails = []
     if request.method == 'POST':
@@ -104,9 +106,9 @@ def search_by_sender():
             flash("Please enter a sender name to search.", "info")
         else:
             try:
-                user = User.query.filter(User.username.ilike(f"%{sender_query}%")).first()
+                user = User.query.filter(contains(User.username, sender_query)).first()
                 if user:
-                    emails = Email.query.filter_by(sender_id=user.id).all()
+                    emails = Email.query.options(*loading_profile('email_list_row')).filter_by(sender_id=user.id).all()
                     if not emails:
                         flash("No emails found for the provided sender.", "warning")
                 else:
@@ -119,18 +121,25 @@ def search_by_sender():
 
 
 @email_bp.route('/search_by_keywords', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_keywords():
     emails = []
-    if request.method == 'POST':
-        keywords = request.form['keywords']
+    results = None
+    keywords = request.values.get('keywords', '').strip()
+    if keywords:
         try:
-            emails = Email.query.filter(Email.body.like(f"%{keywords}%")).all()
+            results = search_emails(keywords, fields=('body',), page=request.values.get('page', 1, type=int), per_page=get_page_size())
+            emails = Email.query.options(*loading_profile('email_list_row')).filter(Email.id.in_(results.ids)).all()
+            emails = in_rank_order(emails, results.ids)
         except Exception as e:
             logger.error(f"Error searching by keywords '{keywords}': {str(e)}")
             flash("An error occurred while searching by keywords.", "error")
-    return render_template('emails/search_by_keywords.html', emails=emails)
+    return render_template('emails/search_by_keywords.html', emails=emails, results=results, keywords=keywords)
 
 @email_bp.route('/search_by_date_range', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_date_range():
     emails = []
     if request.method == 'POST':
@@ -141,7 +150,7 @@ def search_by_date_range():
             flash("Please provide both start and end dates.", "info")
         else:
             try:
-                emails = Email.query.filter(Email.sent_at.between(start_date, end_date)).all()
+                emails = Email.query.options(*loading_profile('email_list_row')).filter(Email.sent_at.between(start_date, end_date)).all()
                 if not emails:
                     flash("No emails found within the provided date range.", "warning")
             except Exception as e:
@@ -151,6 +160,8 @@ def search_by_date_range():
     return render_template('emails/search_by_date_range.html', emails=emails)
 
 @email_bp.route('/search_by_subject_sender', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_subject_and_sender():
     emails = []
     if request.method == 'POST':
@@ -162,8 +173,8 @@ def search_by_subject_and_sender():
         else:
             try:
                 sender_query = sender_input.lower().strip()
-                sender_user_by_username = User.query.filter(User.username.ilike(f"%{sender_query}%")).first()
-                sender_user_by_email = User.query.filter(User.email.ilike(f"%{sender_query}%")).first()
+                sender_user_by_username = User.query.filter(contains(User.username, sender_query)).first()
+                sender_user_by_email = User.query.filter(contains(User.email, sender_query)).first()
 
                 if sender_user_by_username:
                     sender_id = sender_user_by_username.id
@@ -173,12 +184,12 @@ def search_by_subject_and_sender():
                     sender_id = None  
 
                 if sender_id:
-                    emails = Email.query.filter(
+                    emails = Email.query.options(*loading_profile('email_list_row')).filter(
                         Email.subject.ilike(f"%{subject}%"),
                         Email.sender_id == sender_id
                     ).all()
                 else:
-                    emails = Email.query.filter(Email.subject.ilike(f"%{subject}%")).all()
+                    emails = Email.query.options(*loading_profile('email_list_row')).filter(Email.subject.ilike(f"%{subject}%")).all()
 
                 if not emails:
                     flash("No emails found for the provided subject and sender.", "warning")
@@ -189,23 +200,31 @@ def search_by_subject_and_sender():
     return render_template('emails/search_by_subject_sender.html', emails=emails)
 
 @email_bp.route('/search_emails_with_sender', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_emails_with_sender():
     emails = []
-    if request.method == 'POST':
-        keywords = request.form['keywords']
+    results = None
+    keywords = request.values.get('keywords', '').strip()
+    if keywords:
         try:
+            results = search_emails(keywords, fields=('body',), page=request.values.get('page', 1, type=int), per_page=get_page_size())
             emails = (
                 db.session.query(Email, User)
                 .join(User, Email.sender_id == User.id) 
-                .filter(Email.body.like(f"%{keywords}%")) 
+                .filter(Email.id.in_(results.ids)) 
+                .options(*loading_profile('email_body'))
                 .all() 
             )
+            emails = in_rank_order(emails, results.ids, key=lambda row: row[0].id)
         except Exception as e:
             logger.error(f"Error searching emails with sender info and keywords '{keywords}': {str(e)}")
             flash("An error occurred while searching emails with sender info.", "error")
-    return render_template('emails/search_emails_with_sender.html', emails=emails)
+    return render_template('emails/search_emails_with_sender.html', emails=emails, results=results, keywords=keywords)
 
 @email_bp.route('/search_by_recipient', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_recipient():
     emails = []
     if request.method == 'POST':
@@ -218,7 +237,7 @@ def search_by_recipient():
                     Recipient.name.ilike(f"%{recipient_name_or_email}%") |
                     Recipient.email_id.ilike(f"%{recipient_name_or_email}%")
                 )
-                .options(joinedload(Recipient))
+                .options(*loading_profile('email_body'))
                 .all()
             )
             if not emails:
@@ -230,6 +249,8 @@ def search_by_recipient():
 
 
 @email_bp.route('/search_by_domain', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_by_domain():
     emails = []
     if request.method == 'POST':
@@ -243,18 +264,29 @@ def search_by_domain():
 
 
 @email_bp.route('/search_full_email_info', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_full_email_info():
     emails = []
-    if request.method == 'POST':
-        keywords = request.form.get('keywords')
-        if keywords:
-            emails = Email.query.options(
-                joinedload(Email.sender),  
-                joinedload(Email.recipients)  
-            ).filter(
-                (Email.subject.like(f'%{keywords}%')) |
-                (Email.body.like(f'%{keywords}%'))
-            ).all() 
+    results = None
+    keywords = request.values.get('keywords', '').strip()
+    if keywords:
+        results = search_emails(keywords, page=request.values.get('page', 1, type=int), per_page=get_page_size())
+        emails = Email.query.options(*loading_profile('email_detail')).filter(Email.id.in_(results.ids)).all()
+        emails = in_rank_order(emails, results.ids)
     
-    return render_template('emails/search_full_email_info.html', emails=emails)
+    return render_template('emails/search_full_email_info.html', emails=emails, results=results, keywords=keywords)
+
 
+@email_bp.route('/export/<search>')
+@login_required
+@replica_reads
+def export_search(search):
+    """Stream every result of a search, e.g. /export/search_by_sender?sender=bob&format=jsonl&gzip=1."""
+    criteria_for = SEARCHES.get(search)
+    if criteria_for is None:
+        abort(404)
+    try:
+        return export_request(criteria_for(request.args), search)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy.orm import joinedload
-from db_conn import db   
+from db_conn import db, replica_reads
 from models import User, Folder, Email, EmailFolder
+from pagination import paginate_request
+from loading import loading_profile
+from trigram import contains
+from bulk import file_emails, BulkValidationError
 import logging
+from result_cache import cached_result
+from export import export_request, folder_criteria
 folders_bp = Blueprint('folders', __name__)
-logging.basicConfig(level=logging.INFO)  
 logger = logging.getLogger(__name__)
 
 @folders_bp.route('/folders/add', methods=['GET', 'POST'])
@@ -34,20 +38,19 @@ def add_folder():
 
             new_folder = Folder(folder_name=folder_name, user_id=user_id)
             db.session.add(new_folder)
-            db.session.commit()
+            db.session.flush()
 
-            for email_id in email_ids:
-                email = Email.query.get(email_id)
-                if email:
-                    email_folder = EmailFolder(email_id=email.id, folder_id=new_folder.id)
-                    db.session.add(email_folder)
+            file_emails(new_folder.id, email_ids)
 
             db.session.commit()
             flash("Folder added and emails associated successfully!", "success")
+        except BulkValidationError as e:
+            db.session.rollback()
+            flash(f"Some emails could not be filed: {e}", "error")
         except Exception as e:
             db.session.rollback()
             flash(f"An error occurred: {e}", "error")
-            print(f"Error: {e}")
+            logger.exception("Error adding folder")
 
         return redirect(url_for('folders.list_folders'))
 
@@ -55,9 +58,54 @@ def add_folder():
     return render_template('folders/add.html', emails=emails)
 
 
+@folders_bp.route('/folders/<int:folder_id>/emails', methods=['POST'])
+@login_required
+def file_emails_in_folder(folder_id):
+    """Copy (or with "move": true, move) many emails into a folder.
+
+    Expects JSON: {"email_ids": [1, 2, 3], "move": false}
+    """
+    payload = request.get_json(silent=True) or {}
+    email_ids = payload.get('email_ids')
+    if not isinstance(email_ids, list) or not email_ids:
+        return jsonify(error="A non-empty email_ids list is required."), 400
+
+    owner_id = db.session.execute(db.select(Folder.user_id).where(Folder.id == folder_id)).scalar()
+    if owner_id is not None and owner_id != current_user.id and not current_user.is_admin_user():
+        return jsonify(error="You do not have permission to file emails in this folder."), 403
+
+    try:
+        inserted, skipped, removed = file_emails(folder_id, email_ids, move=bool(payload.get('move')))
+        db.session.commit()
+    except BulkValidationError as e:
+        db.session.rollback()
+        return jsonify(error="Invalid request.", details=e.errors), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error filing emails in folder {folder_id}: {str(e)}")
+        return jsonify(error="An error occurred while filing the emails."), 500
+
+    return jsonify(inserted=inserted, skipped=skipped, removed=removed)
+
+
+@folders_bp.route('/folders/<int:folder_id>/export')
+@login_required
+@replica_reads
+def export_folder(folder_id):
+    folder = db.session.get(Folder, folder_id)
+    if folder is None:
+        return jsonify(error="Folder not found."), 404
+    if folder.user_id != current_user.id and not current_user.is_admin_user():
+        return jsonify(error="You do not have permission to export this folder."), 403
+    try:
+        return export_request(folder_criteria(folder_id), f"folder-{folder_id}")
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
 @folders_bp.route('/folders/list')
 def list_folders():
-    folders = Folder.query.all()  
+    folders = paginate_request(Folder.query.options(*loading_profile('folder_row')), Folder.id)
     return render_template('folders/list.html', folders=folders)
 
 @folders_bp.route('/folders/update/<int:folder_id>', methods=['GET', 'POST'])
@@ -79,7 +127,7 @@ def update_folder(folder_id):
             flash("Folder updated successfully!", "success")
         except Exception as e:
             db.session.rollback()
-            logging.error(f"Error updating folder: {e}")
+            logger.exception("Error updating folder %s", folder_id)
             flash("An error occurred while updating the folder.", "error")
         return redirect(url_for('folders.list_folders'))
 
@@ -97,21 +145,23 @@ def delete_folder(folder_id):
     except Exception as e:
         db.session.rollback()
         flash("An error occurred while deleting the folder.", "error")
-        print(f"Error: {e}")
+        logger.exception("Error deleting folder %s", folder_id)
 
     return redirect(url_for('folders.list_folders'))
 
 @folders_bp.route('/folders/search_by_name', methods=['GET', 'POST'])
+@cached_result
 def search_by_name():
     folders = []
     if request.method == 'POST':
         folder_name = request.form['folder_name']
-        folders = Folder.query.filter(Folder.folder_name.like(f"%{folder_name}%")).all()
+        folders = Folder.query.filter(contains(Folder.folder_name, folder_name)).all()
         if not folders:
             flash("No folders found with that name.", "info")
     return render_template('folders/search_by_name.html', folders=folders)
 
 @folders_bp.route('/folders/search_by_user_id', methods=['GET', 'POST'])
+@cached_result
 def search_by_user_id():
     folders = []
     if request.method == 'POST':
@@ -122,26 +172,28 @@ def search_by_user_id():
     return render_template('folders/search_by_user_id.html', folders=folders)
 
 @folders_bp.route('/folders/search_with_user_info', methods=['GET', 'POST'])
+@cached_result
 def search_with_user_info():
     folders = []
     if request.method == 'POST':
         folder_name = request.form['folder_name']
         folders = db.session.query(Folder, User.username, User.email) \
             .join(User, Folder.user_id == User.id) \
-            .filter(Folder.folder_name.like(f"%{folder_name}%")) \
+            .filter(contains(Folder.folder_name, folder_name)) \
             .all()
         if not folders:
             flash("No folders found with that name.", "info")
     return render_template('folders/search_with_user_info.html', folders=folders)
 
 @folders_bp.route('/folders/search_by_email_folder', methods=['GET', 'POST'])
+@cached_result
 def search_by_email_folder():
-    folders = Folder.query.all()  
+    folders = Folder.query.options(*loading_profile('folder_row')).all()
     emails = []
 
     if request.method == 'POST':
         folder_id = request.form['folder_id']
-        folder = Folder.query.get(folder_id)
+        folder = Folder.query.options(*loading_profile('folder_contents')).get(folder_id)
         if folder:
             emails = [email_folder.email for email_folder in folder.email_folders]
         else:
@@ -152,6 +204,7 @@ def search_by_email_folder():
 
 
 @folders_bp.route('/folders/search_with_emails', methods=['GET', 'POST'])
+@cached_result
 def search_with_emails():
     folders = []
     if request.method == 'POST':
@@ -1,8 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from db_conn import db
 from models import RecipientType, Recipient, Email
+from trigram import contains
+from result_cache import cached_result
+import logging
 
 recipient_types_bp = Blueprint('recipient_types', __name__, url_prefix='/recipient_types')
+logger = logging.getLogger(__name__)
 
 @recipient_types_bp.route('/add', methods=['GET', 'POST'])
 def add_recipient_type():
@@ -27,7 +31,7 @@ def add_recipient_type():
         except Exception as e:
             db.session.rollback()
             flash("An error occurred while adding the recipient type.", "error")
-            print(f"Error: {e}")
+            logger.exception("Error adding recipient type")
 
         return redirect(url_for('recipient_types.list_recipient_types'))
 
@@ -69,18 +73,20 @@ def delete_recipient_type(recipient_type_id):
     except Exception as e:
         db.session.rollback()
         flash("An error occurred while deleting the recipient type.", "error")
-        print(f"Error: {e}")
+        logger.exception("Error deleting recipient type %s", recipient_type_id)
     return redirect(url_for('recipient_types.list_recipient_types'))
 
 @recipient_types_bp.route('/search_by_name', methods=['GET', 'POST'])
+@cached_result
 def search_by_name():
     recipient_types = []
     if request.method == 'POST':
         name = request.form['name']
-        recipient_types = RecipientType.query.filter(RecipientType.name.ilike(f"%{name}%")).all()
+        recipient_types = RecipientType.query.filter(contains(RecipientType.name, name)).all()
     return render_template('recipient_type/search_by_name.html', recipient_types=recipient_types)
 
 @recipient_types_bp.route('/search_with_recipients', methods=['GET', 'POST'])
+@cached_result
 def search_with_recipients():
     recipient_data = []
     if request.method == 'POST':
@@ -95,23 +101,24 @@ def search_with_recipients():
                 RecipientType.name.label('recipient_type_name'),
                 Recipient.name.label('recipient_name')
             ).join(Recipient, RecipientType.id == Recipient.recipient_type_id)\
-             .filter(RecipientType.name.ilike(f"%{name}%"))\
+             .filter(contains(RecipientType.name, name))\
              .all()
 
-            print("Query Results:", recipient_data)
+            logger.debug("Recipient type search for '%s' matched %d rows", name, len(recipient_data))
 
             if not recipient_data:
                 flash("No matching recipient types found.", "warning")
 
         except Exception as e:
             flash("An error occurred while searching with recipients.", "error")
-            print(f"Error during query execution: {e}")
+            logger.exception("Error searching recipient types with recipients")
 
     return render_template('recipient_type/search_with_recipients.html', recipient_data=recipient_data)
 
 
 
 @recipient_types_bp.route('/search_with_emails', methods=['GET', 'POST'])
+@cached_result
 def search_with_emails():
     results = []
     if request.method == 'POST':
@@ -128,7 +135,7 @@ def search_with_emails():
                 Recipient.name.label('recipient_name')
             ).join(Recipient, RecipientType.id == Recipient.recipient_type_id)\
              .join(Email, Recipient.email_id == Email.id)\
-             .filter(Recipient.name.ilike(f"%{name}%"))\
+             .filter(contains(Recipient.name, name))\
              .all()
 
             if not results:
@@ -136,6 +143,6 @@ def search_with_emails():
 
         except Exception as e:
             flash("An error occurred while searching with emails.", "error")
-            print(f"Error during query execution: {e}")
+            logger.exception("Error searching recipient types with emails")
 
     return render_template('recipient_type/search_with_emails.html', results=results)
@@ -1,8 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from db_conn import db
+from loading import loading_profile
 from models import Recipient, RecipientType, User, Email
+from pagination import paginate_request
+from trigram import contains
+from bulk import add_recipients, BulkValidationError
+from result_cache import cached_result
+import logging
 
 recipients_bp = Blueprint('recipients', __name__, url_prefix='/recipients')
+logger = logging.getLogger(__name__)
 
 @recipients_bp.route('/add', methods=['GET', 'POST'])
 def add_recipient():
@@ -12,7 +19,11 @@ def add_recipient():
         user_id = request.form.get('user_id')
         recipient_name = request.form.get('recipient_name')
 
-        print(f"Form data: recipient_type_id={recipient_type_id}, email_id={email_id}, user_id={user_id}, recipient_name={recipient_name}")
+        logger.debug(
+            "Recipient form submitted",
+            extra={'event': 'recipient.form', 'recipient_type_id': recipient_type_id, 'email_id': email_id,
+                   'recipient_user_id': user_id},
+        )
 
         if not recipient_type_id or not email_id or not recipient_name or not user_id:  
             flash('All fields are required. Please check the inputs.', 'error')
@@ -60,15 +71,40 @@ def add_recipient():
 
     return render_template('recipients/add.html', recipient_types=recipient_types, emails=emails, users=users)
 
+@recipients_bp.route('/bulk_add', methods=['POST'])
+def bulk_add_recipients():
+    """Add many recipients to one email.
+
+    Expects JSON: {"email_id": 1, "recipients": [{"user_id": 2, "recipient_type_id": 1, "name": "..."}]}
+    """
+    payload = request.get_json(silent=True) or {}
+    email_id = payload.get('email_id')
+    entries = payload.get('recipients')
+    if not isinstance(email_id, int) or not isinstance(entries, list) or not entries:
+        return jsonify(error="email_id and a non-empty recipients list are required."), 400
+
+    try:
+        inserted, skipped = add_recipients(email_id, entries)
+        db.session.commit()
+    except BulkValidationError as e:
+        db.session.rollback()
+        return jsonify(error="Invalid recipients.", details=e.errors), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error adding recipients in bulk")
+        return jsonify(error="An error occurred while adding the recipients."), 500
+
+    return jsonify(inserted=inserted, skipped=skipped), 201
+
 @recipients_bp.route('/list')
 def list_recipients():
-    recipients = (
+    query = (
         db.session.query(Recipient.id, Recipient.email_id, RecipientType.name.label("recipient_type"), 
                          User.username.label("user"), Recipient.name)
         .join(RecipientType, Recipient.recipient_type_id == RecipientType.id)
         .join(User, Recipient.user_id == User.id)
-        .all()
     )
+    recipients = paginate_request(query, Recipient.id)
     return render_template('recipients/list.html', recipients=recipients)
 
 @recipients_bp.route('/update_recipient/<int:recipient_id>', methods=['GET', 'POST'])
@@ -111,10 +147,11 @@ def delete_recipient(recipient_id):
     except Exception as e:
         db.session.rollback()
         flash("An error occurred while deleting the recipient.", "error")
-        print(f"Error: {e}")
+        logger.exception("Error deleting recipient %s", recipient_id)
     return redirect(url_for('recipients.list_recipients'))
 
 @recipients_bp.route('/search_by_type', methods=['GET', 'POST'])
+@cached_result
 def search_recipients_by_type():
     type_name = request.form.get('type_name')  
     recipients = db.session.query(
@@ -122,12 +159,13 @@ def search_recipients_by_type():
         Recipient.email_id,
         RecipientType.name,  
     ).join(RecipientType, Recipient.recipient_type_id == RecipientType.id).filter(
-        RecipientType.name.ilike(f'%{type_name}%') 
+        contains(RecipientType.name, type_name)
     ).all()
 
     return render_template('recipients/search_recipients_by_type.html', recipients=recipients)
 
 @recipients_bp.route('/search_recipients_with_emails', methods=['GET', 'POST'])
+@cached_result
 def search_recipients_with_emails():
     recipients = []
     
@@ -139,13 +177,15 @@ def search_recipients_with_emails():
             return render_template('recipients/search_with_emails.html', recipients=[])
 
         try:
-            recipients = (
-                db.session.query(Recipient.name, Recipient.email_id, Email.subject, Email.body, User.username)
+            rows = (
+                db.session.query(Recipient.name, Recipient.email_id, Email, User.username)
                 .join(Email, Recipient.email_id == Email.id)
                 .join(User, Recipient.user_id == User.id)
                 .filter(Email.subject.ilike(f"%{email_subject}%"))
+                .options(*loading_profile('email_body'))
                 .all()
             )
+            recipients = [(name, email_id, email.subject, email.body, username) for name, email_id, email, username in rows]
 
             if not recipients:
                 flash("No recipients found for the given email subject.", "info")
@@ -1,17 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from werkzeug.security import generate_password_hash
-from db_conn import db
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from passwords import hash_password, PasswordServiceBusy
+from db_conn import db, replica_reads
 import re
 from forms import UpdateUserForm 
-from email_validator import validate_email, EmailNotValidError
+from email_domains import is_valid_email
 from flask_login import login_required, current_user
 from models import User, Folder, Email, Recipient
+from pagination import paginate_request
+from loading import loading_profile
+from session_user import invalidate_session_user
+from trigram import contains
+from result_cache import cached_result
+from export import export_request, sent_criteria
+from mailbox_index import INBOX, SENT, mailbox_page
+import logging
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
+logger = logging.getLogger(__name__)
 
 @user_bp.route('/list', methods=['GET'], endpoint='list_users')
 def list_user():
-    users = User.query.all()
+    users = paginate_request(User.query.options(*loading_profile('row')), User.id)
     return render_template('users/list.html', users=users)
 
 @user_bp.route('/add', methods=['GET', 'POST'])
@@ -19,7 +28,14 @@ def add_user():
     if request.method == 'POST':
         username = request.form['username']
         email = request.form['email']
-        password = generate_password_hash(request.form['password'])
+        if not is_valid_email(email):
+            flash("Invalid email format or domain!", "error")
+            return redirect(url_for('user.add_user'))
+        try:
+            password = hash_password(request.form['password'])
+        except PasswordServiceBusy:
+            flash("The server is busy. Please try again in a moment.", "error")
+            return render_template('users/add.html'), 503
         is_admin = request.form.get('is_admin', '0') == '1'
 
         existing_user = User.query.filter_by(username=username, email=email, password=password, is_admin=is_admin).first()
@@ -41,16 +57,6 @@ def add_user():
 def is_valid_username(username):
     return bool(re.match(r'^[a-zA-Z0-9_]{3,30}$', username))
 
-def is_valid_email(email):
-    return bool(re.match(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$', email))
-
-def is_valid_email(email):
-    try:
-        validate_email(email)  
-        return True
-    except EmailNotValidError:
-        return False
-
 @user_bp.route('/update/<int:user_id>', methods=['GET', 'POST'])
 @login_required
 def update_user(user_id):
@@ -68,6 +74,10 @@ def update_user(user_id):
     form = UpdateUserForm(obj=user)
 
     if form.validate_on_submit():  # Automatically handles POST method
+        # Only a new address needs its domain checked.
+        if form.email.data != user.email and not is_valid_email(form.email.data):
+            flash("Invalid email format or domain!", "error")
+            return redirect(url_for('user.update_user', user_id=user_id))
         try:
             # Update user fields with form data
             form.populate_obj(user)
@@ -80,6 +90,7 @@ def update_user(user_id):
 
             # Save changes to the database
             db.session.commit()
+            invalidate_session_user(user.id)
             flash("User updated successfully!", "success")
             return redirect(url_for('user.list_users'))
 
@@ -97,6 +108,7 @@ def delete_user(user_id):
     try:
         db.session.delete(user)
         db.session.commit()
+        invalidate_session_user(user_id)
         flash("User deleted successfully!", "success")
     except Exception as e:
         db.session.rollback()
@@ -104,7 +116,46 @@ def delete_user(user_id):
     return redirect(url_for('user.list_users'))
 
 
+def _mailbox_json(user_id, mailbox):
+    if user_id != current_user.id and not current_user.is_admin_user():
+        return jsonify(error="You do not have permission to view this user's mail."), 403
+    page, emails = mailbox_page(user_id, mailbox, cursor=request.args.get('cursor'))
+    return jsonify(emails=emails, next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
+
+
+@user_bp.route('/<int:user_id>/inbox')
+@login_required
+@replica_reads
+def inbox(user_id):
+    """The user's received mail, newest first, paged with ?cursor= and ?per_page=."""
+    return _mailbox_json(user_id, INBOX)
+
+
+@user_bp.route('/<int:user_id>/sent')
+@login_required
+@replica_reads
+def sent(user_id):
+    """The user's sent mail, newest first, paged with ?cursor= and ?per_page=."""
+    return _mailbox_json(user_id, SENT)
+
+
+@user_bp.route('/<int:user_id>/sent/export')
+@login_required
+@replica_reads
+def export_sent(user_id):
+    if user_id != current_user.id and not current_user.is_admin_user():
+        return jsonify(error="You do not have permission to export this user's mail."), 403
+    if db.session.get(User, user_id) is None:
+        return jsonify(error="User not found."), 404
+    try:
+        return export_request(sent_criteria(user_id), f"user-{user_id}-sent")
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
 @user_bp.route('/search_users_with_folders', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_users_with_folders():
     folders = Folder.query.all()
 
@@ -120,7 +171,7 @@ def search_users_with_folders():
                     flash("No users found with the specified folder name.", "warning")
             except Exception as e:
                 flash("An error occurred while searching users with folders.", "error")
-                print(f"Error: {e}")
+                logger.exception("Error searching users with folder '%s'", folder_name)
         else:
             flash("Please select a folder.", "warning")
 
@@ -129,6 +180,8 @@ def search_users_with_folders():
 
 
 @user_bp.route('/search_users_with_recipients', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_users_with_recipients():
     if request.method == 'POST':
         recipient_name = request.form.get('recipient_name')  
@@ -140,7 +193,7 @@ def search_users_with_recipients():
             users_with_recipients = (
                 db.session.query(User)
                 .join(Recipient, Recipient.user_id == User.id)  
-                .filter(Recipient.name.ilike(f"%{recipient_name}%"))
+                .filter(contains(Recipient.name, recipient_name))
                 .all()
             )
 
@@ -153,12 +206,14 @@ def search_users_with_recipients():
             )
         except Exception as e:
             flash("An error occurred while searching users with recipients.", "error")
-            print(f"Error: {e}")
+            logger.exception("Error searching users with recipients")
             return render_template('users/search_users_with_recipients.html', users=[])
 
     return render_template('users/search_users_with_recipients.html', users=[])
 
 @user_bp.route('/search_users_with_email_details', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_users_with_email_details():
     users = []  
     
@@ -178,6 +233,8 @@ def search_users_with_email_details():
     return render_template('users/search_users_with_email_details.html', users=users)
 
 @user_bp.route('/search_users_with_folders_emails', methods=['GET', 'POST'])
+@replica_reads
+@cached_result
 def search_users_with_folders_emails():
     users = None  
     if request.method == 'POST':
@@ -193,7 +250,7 @@ def search_users_with_folders_emails():
                     )
                     .join(Folder, User.id == Folder.user_id) 
                     .join(Email, Folder.id == Email.folder_id, isouter=True) 
-                    .filter(User.username.ilike(f"%{search_query}%")) 
+                    .filter(contains(User.username, search_query)) 
                     .order_by(User.username, Folder.folder_name, Email.sent_at)
                     .all()
                 )
@@ -201,6 +258,6 @@ def search_users_with_folders_emails():
                     flash("No users found with the given username.", "warning")
             except Exception as e:
                 flash("An error occurred while searching users.", "error")
-                print(f"Error: {e}")
+                logger.exception("Error searching users with folders and emails")
 
     return render_template('users/search_users_with_folders_emails.html', users=users)
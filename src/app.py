@@ -1,6 +1,14 @@
-from flask import Flask, render_template, redirect, url_for, session, flash
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import logging
+import os
+
+import click
+from flask import Flask, render_template, redirect, url_for, session, flash, request, jsonify, current_app
+from flask.cli import with_appcontext
 from flask_login import LoginManager, current_user
-from flask_sqlalchemy import SQLAlchemy
 from routes.auth import auth_bp
 from routes.recipients import recipients_bp
 from routes.users import user_bp
@@ -8,40 +16,136 @@ from routes.attachments import attachment_bp
 from routes.folders import folders_bp
 from routes.recipient_type import recipient_types_bp
 from routes.emails import email_bp
-from db_conn import db, configure_db
+from db_conn import db, configure_db, pool_metrics
 from models import User, Email, Recipient, Attachment, Folder, RecipientType
+from session_user import load_session_user
+from passwords import init_passwords
+from email_domains import init_email_domains
+from rate_limit import limiter
+from stats import get_counts, recipient_type_totals, rebuild_stats
+from search import rebuild_search_index
+from trigram import rebuild_trigram_index
+from mailbox_index import rebuild_mailbox_index
+from folder_stats import reconcile_folder_stats
+from body_store import CONVERT_BATCH_SIZE, convert_legacy_bodies, pending_conversions
+from migrations import upgrade, check_query_plans
+from blob_store import collect_garbage
+from result_cache import result_cache
+from sql_stats import init_sql_stats, endpoint_stats
+from mail_import import DEFAULT_BATCH_SIZE, MailImporter
+from warmup import readiness
+from app_logging import init_logging, pipeline_stats
 
-app = Flask(__name__)
+_IMPORT_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000
 
-app.secret_key = "random_key"
-
-app.config['SESSION_COOKIE_NAME'] = 'session_id'  # Custom session cookie name
-app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevents JavaScript from accessing the session cookie
-app.config['SESSION_COOKIE_SECURE'] = True  # Ensures cookies are only sent over HTTPS (production)
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection; 'Strict' for stricter protection
-app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # Session lifetime in seconds (1 hour)
+logger = logging.getLogger(__name__)
 
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
-configure_db(app)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(recipients_bp, url_prefix='/recipients')
-app.register_blueprint(user_bp, url_prefix='/users')
-app.register_blueprint(attachment_bp, url_prefix='/attachments')
-app.register_blueprint(folders_bp, url_prefix='/folders')
-app.register_blueprint(recipient_types_bp, url_prefix='/recipient_types')
-app.register_blueprint(email_bp, url_prefix='/emails')
+def create_app(config=None):
+    """Build the application; `config` overrides the defaults below.
+
+    Pools, the hashing processes and the DNS resolver start on first use
+    (or in GET /ready), and anything a forked worker inherits is reopened in
+    that worker, so a prefork server can build the app once in the parent:
+    gunicorn --preload 'app:create_app()'.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+
+    app.secret_key = "random_key"
+
+    app.config['SESSION_COOKIE_NAME'] = 'session_id'  # Custom session cookie name
+    app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevents JavaScript from accessing the session cookie
+    app.config['SESSION_COOKIE_SECURE'] = True  # Ensures cookies are only sent over HTTPS (production)
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection; 'Strict' for stricter protection
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # Session lifetime in seconds (1 hour)
+
+    app.config['LIST_PAGE_SIZE'] = 50  # Rows per page on the list views
+    app.config['LIST_MAX_PAGE_SIZE'] = 500  # Upper bound for ?per_page=
+    app.config['USER_CACHE_TTL'] = 60  # Seconds a logged-in user's flags are cached between requests
+    app.config['USER_CACHE_SIZE'] = 10000  # Logged-in users kept in that cache per process
+    app.config['USER_CACHE_VERSION_INTERVAL'] = 1  # Seconds between checks for user changes made by other workers
+    app.config['DASHBOARD_RECENT_ITEMS'] = 10  # Rows shown in the dashboard's "recent" lists
+    app.config['TYPEAHEAD_LIMIT'] = 10  # Suggestions returned per typeahead lookup
+    app.config['SEARCH_BACKEND'] = None  # 'mysql', 'sqlite' or 'like'; None follows the database
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:600000'  # Policy for new hashes; weaker ones are upgraded at login
+    app.config['PASSWORD_SALT_LENGTH'] = 16  # Salt length for new hashes
+    app.config['PASSWORD_HASH_WORKERS'] = 2  # Hashing processes; 0 hashes on the request thread
+    app.config['PASSWORD_HASH_QUEUE'] = 8  # Hash jobs allowed to wait for a worker
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 5  # Seconds to wait for a slot before answering "busy"
+    app.config['EMAIL_DNS_BUDGET'] = 0.5  # Seconds registration waits on a domain's DNS lookup
+    app.config['EMAIL_DNS_FAIL_OPEN'] = True  # Accept the address if DNS is slow or failing
+    app.config['EMAIL_DNS_NAMESERVERS'] = None  # e.g. ['127.0.0.1']; None uses the system resolver
+    app.config['EMAIL_DOMAIN_CACHE_SIZE'] = 10000  # Domains kept in the deliverability cache
+    app.config['EMAIL_DOMAIN_TTL'] = 3600  # Seconds a domain that accepts mail stays cached
+    app.config['EMAIL_DOMAIN_NEGATIVE_TTL'] = 300  # Seconds a domain without mail hosts stays cached
+    app.config['RATELIMIT_STORAGE_URI'] = os.environ.get('RATELIMIT_STORAGE_URI', 'sqlite:///ratelimit.db')  # Shared by all workers; redis:// for several hosts
+    app.config['RATELIMIT_STRATEGY'] = 'sliding-window-counter'
+    app.config['RATELIMIT_SWALLOW_ERRORS'] = True  # Let requests through if the limit storage is down
+    app.config['AUTH_RATE_LIMIT_PER_IP'] = '30 per minute;300 per hour'  # login/register/verify_mfa POSTs per client IP
+    app.config['AUTH_RATE_LIMIT_PER_ACCOUNT'] = '5 per minute;20 per hour'  # ... per email address / pending MFA user
+    app.config['LOGIN_FAILURE_FLUSH_INTERVAL'] = 0  # Seconds to batch failed-login counts in memory; 0 writes each one
+    app.config['ATTACHMENT_STORE'] = os.environ.get('ATTACHMENT_STORE', 'attachment_store')  # Directory for attachment content
+    app.config['ATTACHMENT_MAX_SIZE'] = 100 * 1024 * 1024  # Largest attachment accepted, in bytes
+    app.config['ATTACHMENT_CACHE_MAX_AGE'] = 3600  # Cache-Control max-age for downloads; content never changes under an ETag
+    app.config['RESULT_CACHE_ENABLED'] = True  # Serve repeated identical searches from memory
+    app.config['RESULT_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # Per-process memory for cached search pages
+    app.config['SQL_SERVER_TIMING'] = True  # Add db/app Server-Timing headers to every response
+    app.config['SQL_QUERY_BUDGET'] = 50  # Log requests that run more statements than this
+    app.config['SQL_TIME_BUDGET_MS'] = 250  # ... or spend longer than this in the database
+    app.config['SQL_REPEAT_THRESHOLD'] = 10  # Same statement this many times in one request is logged as N+1
+    app.config['SQL_STATS_PAGE'] = False  # Collect per-endpoint totals for /admin/sql-stats
+    app.config['EXPORT_BATCH_SIZE'] = 500  # Emails read, encoded and sent per chunk of an export download
+    app.config['READY_WARM_CONNECTIONS'] = 2  # Connections per database the readiness check opens and leaves pooled
+    app.config['LOG_FILE'] = os.environ.get('LOG_FILE', 'app.log')  # JSON lines; empty logs to stderr
+    app.config['LOG_SECURITY_FILE'] = 'security.log'  # Copy of the 'security' logger's records; None to skip
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    app.config['LOG_QUEUE_SIZE'] = 10000  # Records waiting for the writer thread before new ones are dropped
+    app.config['LOG_SAMPLE_RATES'] = {'recipient.form': 0.01, 'sql.over_budget': 0.1}  # Fraction of each high-volume event kept
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')  # Let the front-end server send attachment files
+
+    app.config.update(config or {})
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = app.config['ATTACHMENT_MAX_SIZE'] + 1024 * 1024  # Request body limit (attachment + form fields)
+
+    init_logging(app)
+    login_manager.init_app(app)
+    configure_db(app)
+    init_passwords(app)
+    init_email_domains(app)
+    limiter.init_app(app)
+    init_sql_stats(app)
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(recipients_bp, url_prefix='/recipients')
+    app.register_blueprint(user_bp, url_prefix='/users')
+    app.register_blueprint(attachment_bp, url_prefix='/attachments')
+    app.register_blueprint(folders_bp, url_prefix='/folders')
+    app.register_blueprint(recipient_types_bp, url_prefix='/recipient_types')
+    app.register_blueprint(email_bp, url_prefix='/emails')
+
+    for rule, view in VIEWS:
+        app.add_url_rule(rule, view_func=view)
+    for command in CLI_COMMANDS:
+        app.cli.add_command(command)
+
+    app.extensions['boot'] = {
+        'started': _IMPORT_STARTED,
+        'import_ms': round(_IMPORT_MS, 2),
+        'create_app_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info("App created in %.1f ms (imports %.1f ms)", app.extensions['boot']['create_app_ms'], _IMPORT_MS)
+    return app
+
 
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_session_user(int(user_id))
 
-# Home route
-@app.route('/')
 def index():
     if not current_user.is_authenticated:
         return redirect(url_for('auth.login'))
@@ -51,7 +155,6 @@ def index():
     else:
         return redirect(url_for('user_dashboard'))
 
-@app.route('/admin/dashboard')
 def admin_dashboard():
     if not current_user.is_authenticated:
         flash("You must be logged in to access this page.", "error")
@@ -61,37 +164,222 @@ def admin_dashboard():
         flash("You don't have permission to access this page.", "error")
         return redirect(url_for('index'))
     
-    users = User.query.all() 
-    emails = Email.query.all()  
-    recipients = Recipient.query.all()  
-    attachments = Attachment.query.all() 
-    folders = Folder.query.all()
-    recipient_types = RecipientType.query.all()  
+    recent = current_app.config['DASHBOARD_RECENT_ITEMS']
+    counts = get_counts()
+    recent_emails = (
+        db.session.query(Email.id, Email.subject, Email.sent_at)
+        .order_by(Email.id.desc())
+        .limit(recent)
+        .all()
+    )
+    recent_users = (
+        db.session.query(User.id, User.username, User.created_at)
+        .order_by(User.id.desc())
+        .limit(recent)
+        .all()
+    )
 
     return render_template(
         'admin_dashboard.html',
-        users=users,
-        emails=emails,
-        recipients=recipients,
-        attachments=attachments,
-        folders=folders,
-        recipient_types=recipient_types
+        counts=counts,
+        recipient_type_totals=recipient_type_totals(counts),
+        recent_emails=recent_emails,
+        recent_users=recent_users
     )
 
-@app.route('/user/dashboard')
+# Typeahead sources for the dashboard's "Update" menus: the column matched
+# by prefix, and the endpoint/argument of the matching update page.
+TYPEAHEAD_SOURCES = {
+    'users': (User.id, User.username, 'user.update_user', 'user_id'),
+    'emails': (Email.id, Email.subject, 'email.update_email', 'id'),
+    'recipients': (Recipient.id, Recipient.name, 'recipients.update_recipient', 'recipient_id'),
+    'attachments': (Attachment.id, Attachment.file_name, 'attachment.update_attachment', 'attachment_id'),
+    'folders': (Folder.id, Folder.folder_name, 'folders.update_folder', 'folder_id'),
+    'recipient_types': (RecipientType.id, RecipientType.name, 'recipient_types.update_recipient_type', 'recipient_type_id'),
+}
+
+def admin_typeahead(kind):
+    if not current_user.is_authenticated or not current_user.is_admin_user():
+        return jsonify(error="Forbidden"), 403
+    if kind not in TYPEAHEAD_SOURCES:
+        return jsonify(error="Unknown type"), 404
+
+    id_column, label_column, endpoint, arg = TYPEAHEAD_SOURCES[kind]
+    query = db.session.query(id_column, label_column)
+    prefix = request.args.get('q', '').strip()
+    if prefix:
+        query = query.filter(label_column.startswith(prefix, autoescape=True)).order_by(label_column)
+    else:
+        query = query.order_by(id_column.desc())
+    rows = query.limit(current_app.config['TYPEAHEAD_LIMIT']).all()
+
+    return jsonify([
+        {'id': row_id, 'label': label, 'url': url_for(endpoint, **{arg: row_id})}
+        for row_id, label in rows
+    ])
+
+def admin_db_pool():
+    if not current_user.is_authenticated or not current_user.is_admin_user():
+        return jsonify(error="Forbidden"), 403
+    pools = {
+        bind_key or 'primary': engine.pool.status()
+        for bind_key, engine in db.engines.items()
+    }
+    return jsonify(checkout_wait=pool_metrics.snapshot(), pools=pools)
+
+def admin_sql_stats():
+    if not current_app.config['SQL_STATS_PAGE']:
+        return "Enable SQL_STATS_PAGE to collect per-endpoint SQL statistics.", 404
+    if not current_user.is_authenticated or not current_user.is_admin_user():
+        return jsonify(error="Forbidden"), 403
+    sort = request.args.get('sort', 'db_ms')
+    if sort not in ('db_ms', 'max_db_ms', 'avg_db_ms', 'queries', 'max_queries', 'avg_queries', 'n_plus_one', 'rows_read', 'rows_written'):
+        sort = 'db_ms'
+    return render_template('admin/sql_stats.html', endpoints=endpoint_stats.worst(sort), sort=sort)
+
+def admin_result_cache():
+    if not current_user.is_authenticated or not current_user.is_admin_user():
+        return jsonify(error="Forbidden"), 403
+    return jsonify(result_cache.stats())
+
+def admin_logging():
+    if not current_user.is_authenticated or not current_user.is_admin_user():
+        return jsonify(error="Forbidden"), 403
+    return jsonify(pipeline_stats())
+
 def user_dashboard():
     if current_user.is_admin_user():
         flash("Admins don't access this page.", "warning")
         return redirect(url_for('admin_dashboard'))
     return render_template('user_dashboard.html')
 
-@app.route('/dashboard')
 def dashboard():
     if not current_user.is_authenticated: 
         return redirect(url_for('auth.login'))
     return render_template('index.html')
 
+def ready():
+    """Readiness probe: warms this worker on its first call, then checks the databases."""
+    is_ready, report = readiness()
+    return jsonify(ready=is_ready, **report), 200 if is_ready else 503
+
+
+# Registered on each app by create_app; endpoint names are the function names.
+VIEWS = (
+    ('/', index),
+    ('/admin/dashboard', admin_dashboard),
+    ('/admin/typeahead/<kind>', admin_typeahead),
+    ('/admin/db-pool', admin_db_pool),
+    ('/admin/sql-stats', admin_sql_stats),
+    ('/admin/result-cache', admin_result_cache),
+    ('/admin/logging', admin_logging),
+    ('/user/dashboard', user_dashboard),
+    ('/dashboard', dashboard),
+    ('/ready', ready),
+)
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Apply pending schema migrations."""
+    applied = upgrade()
+    print(f"Applied migrations: {applied}" if applied else "Database is up to date.")
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if any registered hot query would scan a whole table."""
+    failures = check_query_plans()
+    for name, scans in failures.items():
+        print(f"{name}: {', '.join(scans)}")
+    if failures:
+        raise SystemExit(1)
+    print("All hot queries use an index.")
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recount the admin dashboard counters from the base tables."""
+    rebuild_stats()
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Re-index every email for full-text search."""
+    rebuild_search_index()
+
+@click.command('rebuild-trigram-index')
+@with_appcontext
+def rebuild_trigram_index_command():
+    """Rebuild the substring-search trigrams for users, folders and recipients."""
+    rebuild_trigram_index()
+
+@click.command('rebuild-mailbox-index')
+@with_appcontext
+def rebuild_mailbox_index_command():
+    """Rebuild every user's inbox and sent mailbox index."""
+    rebuild_mailbox_index()
+
+@click.command('reconcile-folder-stats')
+@with_appcontext
+@click.option('--batch-size', default=1000, show_default=True, help="Folders checked per transaction.")
+def reconcile_folder_stats_command(batch_size):
+    """Recompute the per-folder counters and repair any that drifted."""
+    print(f"Repaired {reconcile_folder_stats(batch_size=batch_size)} folder counter row(s).")
+
+@click.command('convert-email-bodies')
+@with_appcontext
+@click.option('--batch-size', default=CONVERT_BATCH_SIZE, show_default=True, help="Emails converted per commit.")
+@click.option('--max-batches', type=int, help="Stop after this many batches; by default run until done.")
+@click.option('--pause', default=0.0, show_default=True, help="Seconds to sleep between batches.")
+def convert_email_bodies_command(batch_size, max_batches, pause):
+    """Compress bodies still stored in the legacy emails.body column."""
+    converted = convert_legacy_bodies(batch_size=batch_size, max_batches=max_batches, pause=pause)
+    print(f"Converted {converted} email(s); {pending_conversions()} left.")
+
+@click.command('gc-attachments')
+@with_appcontext
+def gc_attachments_command():
+    """Delete stored attachment content that no attachment refers to any more."""
+    print(f"Deleted {collect_garbage()} unreferenced file(s).")
+
+@click.command('import-mail')
+@with_appcontext
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--owner', required=True, help="Username or email of the user whose mailbox this is.")
+@click.option('--folder', default='Imported', show_default=True, help="The owner's folder to file messages in.")
+@click.option('--workers', default=2, show_default=True, help="Parsing processes; 0 parses inline.")
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help="Messages per commit.")
+@click.option('--restart', is_flag=True, help="Ignore saved checkpoints and start each source from the beginning.")
+def import_mail_command(sources, owner, folder, workers, batch_size, restart):
+    """Import mbox files, .eml files or directories of .eml messages."""
+    try:
+        importer = MailImporter(owner, folder_name=folder, batch_size=batch_size, workers=workers)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for source in sources:
+        imported, skipped = importer.run(source, restart=restart)
+        print(f"{source}: imported {imported} message(s), skipped {skipped}.")
+    print(f"Created {importer.addresses.created} user(s) for new addresses.")
+
+
+CLI_COMMANDS = (
+    upgrade_db_command,
+    check_query_plans_command,
+    rebuild_stats_command,
+    rebuild_search_index_command,
+    rebuild_trigram_index_command,
+    rebuild_mailbox_index_command,
+    reconcile_folder_stats_command,
+    convert_email_bodies_command,
+    gc_attachments_command,
+    import_mail_command,
+)
+
+
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()  
+        upgrade()
     app.run(debug=True)
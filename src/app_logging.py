@@ -0,0 +1,206 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Application logging that never blocks a request on disk I/O.
+#
+# Every record goes through one QueueHandler on the root logger. A request
+# thread only does a bounded, non-blocking put; if the queue is full the
+# record is dropped and counted instead of stalling the request. A single
+# QueueListener thread formats the records as JSON lines and writes them
+# to the log files. Request id, user id, method and path are captured when
+# the record is created, because the listener thread has no request
+# context. Records tagged with a high-volume `event` can be sampled through
+# LOG_SAMPLE_RATES.
+#
+#     logger.info("User logged in", extra={'event': 'auth.login', 'login_user_id': user.id})
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: the standard fields, request context and any extras."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records of each sampled event.
+
+    `rates` maps an event name to the fraction kept; kept records carry
+    `sample_rate` so counts can be scaled back up downstream.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+def _request_context():
+    if not has_request_context():
+        return {}
+    # flask_login caches the loaded user on g; reading it here never triggers a load.
+    user = g.get('_login_user')
+    return {
+        'request_id': g.get('request_id'),
+        'user_id': getattr(user, 'id', None),
+        'method': request.method,
+        'path': request.path,
+    }
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without ever waiting for it."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Runs on the calling thread: resolve the message, traceback and
+        # request context now, while they are still available.
+        record = logging.makeLogRecord(vars(record))
+        for key, value in _request_context().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """The process-wide queue, its handler on the root logger and the listener thread."""
+
+    def __init__(self, handlers, queue_size=DEFAULT_QUEUE_SIZE, sample_rates=None):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(SamplingFilter(sample_rates))
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.listener is None:
+                self.listener = QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+                self.listener.start()
+
+    def stop(self):
+        """Flush what is queued and stop the listener thread."""
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def restart_in_child(self):
+        # The listener thread does not survive fork, and the queue may have
+        # been copied mid-operation; a forked worker starts both afresh.
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self._lock = threading.Lock()
+        self.listener = None
+        self.start()
+
+    def stats(self):
+        return {
+            'queued': self.handler.queue.qsize(),
+            'queue_size': self.queue_size,
+            'dropped': self.handler.dropped,
+            'sample_rates': self.handler.filters[0].rates,
+        }
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def _file_handler(path, level=logging.NOTSET):
+    handler = logging.FileHandler(path, delay=True) if path else logging.StreamHandler()
+    handler.setLevel(level)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def _assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+
+def _echo_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers.setdefault('X-Request-ID', request_id)
+    return response
+
+
+def init_logging(app):
+    """Install the logging pipeline (once per process) and request ids for `app`."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            handlers = [_file_handler(app.config.get('LOG_FILE'))]
+            if app.config.get('LOG_SECURITY_FILE'):
+                security = _file_handler(app.config['LOG_SECURITY_FILE'])
+                security.addFilter(logging.Filter('security'))
+                handlers.append(security)
+            _pipeline = LogPipeline(
+                handlers,
+                queue_size=app.config.get('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                sample_rates=app.config.get('LOG_SAMPLE_RATES'),
+            )
+            root = logging.getLogger()
+            root.addHandler(_pipeline.handler)
+            root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+            _pipeline.start()
+            atexit.register(_pipeline.stop)
+            os.register_at_fork(after_in_child=_pipeline.restart_in_child)
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+
+
+def pipeline_stats():
+    return _pipeline.stats() if _pipeline is not None else None
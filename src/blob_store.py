@@ -0,0 +1,147 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import time
+
+from flask import current_app
+
+from db_conn import db
+from models import Attachment
+
+# Content-addressed storage for attachment bytes.
+#
+# Each blob lives at <root>/<aa>/<bb>/<sha256>, so identical uploads share
+# one file. Uploads are copied chunk by chunk into a temporary file in the
+# same directory tree while being hashed, then renamed into place; a worker
+# never holds more than one chunk in memory. Blobs are never deleted when an
+# attachment goes away, since another upload may be reusing the file at that
+# moment; collect_garbage() removes the unreferenced ones later.
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of common attachment formats; anything else falls back to
+# the file name's extension.
+SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+)
+
+
+def sniff_type(head, file_name=None):
+    """MIME type from the first bytes of the content, then the file name."""
+    for signature, mimetype in SIGNATURES:
+        if head.startswith(signature):
+            if mimetype == 'application/zip' and file_name:
+                # docx/xlsx/... are zip containers; keep the specific type.
+                guessed = mimetypes.guess_type(file_name)[0]
+                return guessed or mimetype
+            return mimetype
+    return (file_name and mimetypes.guess_type(file_name)[0]) or 'application/octet-stream'
+
+
+class StoredBlob:
+    __slots__ = ('digest', 'size', 'mimetype')
+
+    def __init__(self, digest, size, mimetype):
+        self.digest = digest
+        self.size = size
+        self.mimetype = mimetype
+
+
+class BlobTooLarge(ValueError):
+    """Raised when an upload exceeds the store's size limit."""
+
+
+class BlobStore:
+    def __init__(self, root, max_size=None):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self._tmp = os.path.join(self.root, 'tmp')
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def save(self, stream, file_name=None, chunk_size=CHUNK_SIZE):
+        """Copy a file-like object into the store; returns a StoredBlob."""
+        sha256 = hashlib.sha256()
+        size = 0
+        head = b''
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    size += len(chunk)
+                    if self.max_size is not None and size > self.max_size:
+                        raise BlobTooLarge(f"Attachment is larger than {self.max_size} bytes.")
+                    sha256.update(chunk)
+                    out.write(chunk)
+            digest = sha256.hexdigest()
+            final_path = self.path(digest)
+            try:
+                # Reusing a stored file: renew its mtime so collect_garbage's
+                # grace period covers it until this upload's row is committed.
+                os.utime(final_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            else:
+                os.unlink(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return StoredBlob(digest, size, sniff_type(head, file_name))
+
+    def files(self):
+        """Yield (path, digest or None for temporary files) for everything in the store."""
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                yield path, None if directory == self._tmp else name
+
+
+_stores = {}
+
+
+def get_blob_store():
+    """The store configured for the current app (ATTACHMENT_STORE)."""
+    root = current_app.config['ATTACHMENT_STORE']
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = BlobStore(root, max_size=current_app.config.get('ATTACHMENT_MAX_SIZE'))
+    return store
+
+
+def collect_garbage(min_age=3600):
+    """Delete blobs no attachment refers to, and abandoned temporary files.
+
+    Files younger than `min_age` seconds are kept: they may belong to an
+    upload whose row is not committed yet. Returns the number deleted.
+    """
+    store = get_blob_store()
+    referenced = set(db.session.scalars(
+        db.select(Attachment.content_hash).where(Attachment.content_hash.isnot(None)).distinct()
+    ))
+    cutoff = time.time() - min_age
+    deleted = 0
+    for path, digest in store.files():
+        if digest in referenced or os.path.getmtime(path) > cutoff:
+            continue
+        os.unlink(path)
+        deleted += 1
+    return deleted
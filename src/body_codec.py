@@ -0,0 +1,45 @@
+import zlib
+
+# Encoding of stored email bodies.
+#
+# Every `email_bodies` row names the codec its content was written with, so
+# the encoding can change (or a new codec be added) without rewriting old
+# rows. Short bodies are stored as plain UTF-8: below a few hundred bytes
+# zlib's header and untrained dictionary cost more than they save.
+
+CODEC_PLAIN = 'plain'
+CODEC_ZLIB = 'zlib'
+
+MIN_COMPRESS_BYTES = 200
+COMPRESSION_LEVEL = 6
+
+_DECODERS = {
+    CODEC_PLAIN: bytes,
+    CODEC_ZLIB: zlib.decompress,
+}
+
+
+def encode_body(text):
+    """Return (codec, content bytes) for the body `text`."""
+    raw = (text or '').encode('utf-8')
+    if len(raw) >= MIN_COMPRESS_BYTES:
+        packed = zlib.compress(raw, COMPRESSION_LEVEL)
+        if len(packed) < len(raw):
+            return CODEC_ZLIB, packed
+    return CODEC_PLAIN, raw
+
+
+def decode_body(codec, content):
+    """The text stored as `content` by `codec`; raises ValueError for an unknown codec."""
+    if content is None:
+        return None
+    try:
+        decode = _DECODERS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown body codec {codec!r}") from None
+    return decode(content).decode('utf-8')
+
+
+def stored_text(codec, content, legacy):
+    """The body of an email row: its email_bodies content if it has any, else the legacy column."""
+    return decode_body(codec, content) if codec is not None else legacy
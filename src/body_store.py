@@ -0,0 +1,65 @@
+import time
+
+from sqlalchemy import func, select, update
+
+from db_conn import db
+from models import Email, EmailBody
+from body_codec import encode_body
+from bulk import insert_ignore
+
+# Background conversion of bodies written before `email_bodies` existed.
+#
+# Those emails keep their text in the legacy `emails.body` column, which
+# Email.body falls back to, so the app serves them unchanged while the
+# conversion runs alongside it. Each batch compresses its bodies into
+# `email_bodies` and empties the legacy column in one short transaction.
+# Emails that already have an email_bodies row are never touched, so the
+# job can be stopped and started again at any point.
+
+CONVERT_BATCH_SIZE = 500
+
+_emails = Email.__table__
+
+
+def _unconverted():
+    return (
+        select(Email.id, Email.legacy_body.label('legacy_body'))
+        .outerjoin(EmailBody, EmailBody.email_id == Email.id)
+        .where(EmailBody.email_id.is_(None))
+    )
+
+
+def pending_conversions():
+    """How many emails still have their body in the legacy column."""
+    return db.session.scalar(select(func.count()).select_from(_unconverted().subquery()))
+
+
+def convert_legacy_bodies(batch_size=CONVERT_BATCH_SIZE, max_batches=None, pause=0.0):
+    """Move legacy bodies into email_bodies, `batch_size` emails per commit.
+
+    Stops after `max_batches` batches if given, sleeping `pause` seconds
+    between batches to leave room for the app's own queries. Returns the
+    number of emails converted.
+    """
+    converted = batches = last_id = 0
+    while max_batches is None or batches < max_batches:
+        rows = db.session.execute(
+            _unconverted().where(Email.id > last_id).order_by(Email.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        connection = db.session.connection()
+        bodies = []
+        for row in rows:
+            codec, content = encode_body(row.legacy_body)
+            bodies.append({'email_id': row.id, 'codec': codec, 'content': content})
+        # An email edited meanwhile already has its new body; keep that one.
+        converted += insert_ignore(connection, EmailBody.__table__, bodies)
+        connection.execute(update(_emails).where(_emails.c.id.in_([row.id for row in rows])).values(body=''))
+        db.session.commit()
+
+        last_id = rows[-1].id
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return converted
@@ -0,0 +1,174 @@
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects import mysql, sqlite
+
+from db_conn import db
+from models import User, Email, Folder, EmailFolder, Recipient, RecipientType
+from stats import adjust_stat, recipient_type_key
+from trigram import index_rows
+from result_cache import bump_versions
+from mailbox_index import refresh_entries
+from folder_stats import adjust_folders
+
+# Set-based writes for fan-out operations.
+#
+# These bypass the ORM unit of work, so they also do the bookkeeping the
+# ORM events would have done for each row (dashboard counters, trigram
+# index, result-cache table versions, mailbox index, folder counters) in
+# bulk.
+
+INSERT_CHUNK_SIZE = 1000
+
+
+class BulkValidationError(ValueError):
+    """Raised with a list of problems when a bulk request refers to rows that do not exist."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def insert_ignore(connection, table, rows):
+    """Multi-row INSERT that skips rows violating a unique key; returns rows inserted."""
+    dialect = connection.dialect.name
+    inserted = 0
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        if dialect == 'mysql':
+            statement = mysql.insert(table).values(chunk).prefix_with('IGNORE')
+        elif dialect == 'sqlite':
+            statement = sqlite.insert(table).values(chunk).on_conflict_do_nothing()
+        else:
+            statement = insert(table).values(chunk)
+        inserted += connection.execute(statement).rowcount
+    return inserted
+
+
+def add_recipients(email_id, entries):
+    """Add many recipients to one email in a handful of statements.
+
+    `entries` is an iterable of dicts with `user_id`, `recipient_type_id` and
+    an optional `name` (defaults to the username). Unknown ids raise
+    `BulkValidationError` before anything is written; pairs that are already
+    recipients of the email are skipped. Returns (inserted, skipped).
+    The caller commits.
+    """
+    wanted = {}
+    malformed = []
+    for position, entry in enumerate(entries):
+        try:
+            key = (int(entry['recipient_type_id']), int(entry['user_id']))
+        except (KeyError, TypeError, ValueError):
+            malformed.append(f"Entry {position} needs integer user_id and recipient_type_id")
+            continue
+        wanted.setdefault(key, entry.get('name'))
+    if malformed:
+        raise BulkValidationError(malformed)
+    if not wanted:
+        return 0, 0
+
+    type_ids = {type_id for type_id, _ in wanted}
+    user_ids = {user_id for _, user_id in wanted}
+
+    errors = []
+    if db.session.execute(select(Email.id).where(Email.id == email_id)).first() is None:
+        errors.append(f"Email {email_id} does not exist")
+    known_types = set(db.session.scalars(select(RecipientType.id).where(RecipientType.id.in_(type_ids))))
+    usernames = dict(db.session.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all())
+    errors.extend(f"Recipient type {type_id} does not exist" for type_id in sorted(type_ids - known_types))
+    errors.extend(f"User {user_id} does not exist" for user_id in sorted(user_ids - usernames.keys()))
+    if errors:
+        raise BulkValidationError(errors)
+
+    existing = set(db.session.execute(
+        select(Recipient.id, Recipient.recipient_type_id, Recipient.user_id).where(Recipient.email_id == email_id)
+    ).all())
+    existing_ids = {row.id for row in existing}
+    existing_pairs = {(row.recipient_type_id, row.user_id) for row in existing}
+
+    rows = [
+        {'email_id': email_id, 'recipient_type_id': type_id, 'user_id': user_id, 'name': name or usernames[user_id]}
+        for (type_id, user_id), name in wanted.items()
+        if (type_id, user_id) not in existing_pairs
+    ]
+    if not rows:
+        return 0, len(wanted)
+
+    connection = db.session.connection()
+    inserted = insert_ignore(connection, Recipient.__table__, rows)
+
+    new_rows = [
+        row for row in db.session.execute(
+            select(Recipient.id, Recipient.recipient_type_id, Recipient.name).where(Recipient.email_id == email_id)
+        ).all()
+        if row.id not in existing_ids
+    ]
+    index_rows(connection, Recipient.name, [(row.id, row.name) for row in new_rows])
+    bump_versions(connection, {Recipient.__tablename__})
+    refresh_entries(connection, [email_id])
+    adjust_stat(connection, Recipient.__tablename__, len(new_rows))
+    per_type = {}
+    for row in new_rows:
+        per_type[row.recipient_type_id] = per_type.get(row.recipient_type_id, 0) + 1
+    for type_id, count in per_type.items():
+        adjust_stat(connection, recipient_type_key(type_id), count)
+
+    return inserted, len(wanted) - inserted
+
+
+def _email_ids(values):
+    ids, malformed = set(), []
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            malformed.append(f"Email id {value!r} is not an integer")
+    if malformed:
+        raise BulkValidationError(malformed)
+    return ids
+
+
+def file_emails(folder_id, email_ids, move=False):
+    """File many emails into one folder with a single validating query and
+    a multi-row insert.
+
+    With `move=True` the emails are also taken out of the folder owner's
+    other folders, so they end up in this folder only. Emails already in
+    the folder are skipped. Returns (inserted, skipped, removed).
+    The caller commits.
+    """
+    ids = _email_ids(email_ids)
+    owner_id = db.session.execute(select(Folder.user_id).where(Folder.id == folder_id)).scalar()
+    errors = [] if owner_id is not None else [f"Folder {folder_id} does not exist"]
+    if ids:
+        known = set(db.session.scalars(select(Email.id).where(Email.id.in_(ids))))
+        errors.extend(f"Email {email_id} does not exist" for email_id in sorted(ids - known))
+    if errors:
+        raise BulkValidationError(errors)
+    if not ids:
+        return 0, 0, 0
+
+    connection = db.session.connection()
+    removed = 0
+    if move:
+        other_folders = select(Folder.id).where(Folder.user_id == owner_id, Folder.id != folder_id)
+        filed_elsewhere = (EmailFolder.email_id.in_(ids), EmailFolder.folder_id.in_(other_folders))
+        moved_out = connection.execute(select(EmailFolder.folder_id, EmailFolder.email_id).where(*filed_elsewhere)).all()
+        removed = connection.execute(delete(EmailFolder.__table__).where(*filed_elsewhere)).rowcount
+        adjust_folders(connection, moved_out, -1)
+
+    already_filed = set(connection.scalars(
+        select(EmailFolder.email_id).where(EmailFolder.folder_id == folder_id, EmailFolder.email_id.in_(ids))
+    ))
+    new_ids = ids - already_filed
+    rows = [{'email_id': email_id, 'folder_id': folder_id} for email_id in sorted(new_ids)]
+    inserted = insert_ignore(connection, EmailFolder.__table__, rows)
+    if inserted < len(rows):
+        # Some were filed by another request in the meantime and skipped;
+        # count only the links this insert added.
+        new_ids = set(connection.scalars(
+            select(EmailFolder.email_id).where(EmailFolder.folder_id == folder_id, EmailFolder.email_id.in_(new_ids))
+        ))
+    adjust_folders(connection, [(folder_id, email_id) for email_id in new_ids], 1)
+    if inserted or removed:
+        bump_versions(connection, {EmailFolder.__tablename__})
+    return inserted, len(ids) - inserted, removed
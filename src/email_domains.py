@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Deliverability checks for email domains without blocking on DNS.
+#
+# Answers are cached per domain (LRU, with separate TTLs for domains that
+# do and do not accept mail). Concurrent checks of the same domain share
+# one lookup, and callers wait at most `budget` seconds for it; a lookup
+# that overruns keeps going in the background and fills the cache for the
+# next caller, while this one gets the fail-open/fail-closed default.
+#
+# dnspython and email_validator are imported on first use: together they add
+# a noticeable share of a worker's boot time, and most requests need neither.
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_TTL = 3600  # seconds a domain that accepts mail is remembered
+DEFAULT_NEGATIVE_TTL = 300  # seconds a domain without mail hosts is remembered
+DEFAULT_BUDGET = 0.5  # seconds a request waits for DNS
+
+
+class DNSResolver:
+    """Answers "does this domain accept mail?" from MX records, falling back
+    to an A record as SMTP does. Raises dns.exception.DNSException on
+    timeouts and server failures so they are not cached as "no".
+
+    Pass `nameservers` to query specific servers, e.g. a local stub. The
+    system configuration is read on the first lookup, not at construction.
+    """
+
+    def __init__(self, nameservers=None, lifetime=2.0):
+        self.nameservers = list(nameservers) if nameservers else None
+        self.lifetime = lifetime
+        self._resolver = None
+        self._lock = threading.Lock()
+
+    def resolver(self):
+        with self._lock:
+            if self._resolver is None:
+                import dns.resolver
+                resolver = dns.resolver.Resolver(configure=not self.nameservers)
+                if self.nameservers:
+                    resolver.nameservers = self.nameservers
+                resolver.lifetime = self.lifetime
+                self._resolver = resolver
+            return self._resolver
+
+    def _has(self, domain, rdtype):
+        import dns.resolver
+        try:
+            return len(self.resolver().resolve(domain, rdtype)) > 0
+        except (dns.resolver.NoAnswer, dns.resolver.NoNameservers):
+            return False
+
+    def __call__(self, domain):
+        import dns.resolver
+        try:
+            return self._has(domain, 'MX') or self._has(domain, 'A')
+        except dns.resolver.NXDOMAIN:
+            return False
+
+
+class DomainValidator:
+    """Cached, coalesced, time-boxed domain deliverability checks.
+
+    `resolver` is any callable taking a domain and returning a bool; it may
+    raise for transient failures.
+    """
+
+    def __init__(self, resolver=None, cache_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, budget=DEFAULT_BUDGET, fail_open=True, lookup_threads=4):
+        self.resolver = resolver or DNSResolver()
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.budget = budget
+        self.fail_open = fail_open
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=lookup_threads, thread_name_prefix='dns')
+        self.hits = self.misses = self.coalesced = self.overruns = 0
+
+    def _cached(self, domain, now):
+        entry = self._cache.get(domain)
+        if entry is None:
+            return None
+        expires, answer = entry
+        if expires <= now:
+            del self._cache[domain]
+            return None
+        self._cache.move_to_end(domain)
+        return answer
+
+    def _store(self, domain, answer):
+        with self._lock:
+            self._inflight.pop(domain, None)
+            if answer is None:
+                return
+            self._cache[domain] = (time.monotonic() + (self.ttl if answer else self.negative_ttl), answer)
+            self._cache.move_to_end(domain)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _lookup(self, domain, future):
+        try:
+            answer = bool(self.resolver(domain))
+        except Exception:
+            answer = None  # transient; don't cache
+        self._store(domain, answer)
+        future.set_result(answer)
+
+    def is_deliverable(self, domain):
+        domain = domain.strip().rstrip('.').lower()
+        with self._lock:
+            answer = self._cached(domain, time.monotonic())
+            if answer is not None:
+                self.hits += 1
+                return answer
+            future = self._inflight.get(domain)
+            if future is None:
+                self.misses += 1
+                future = self._inflight[domain] = Future()
+                self._executor.submit(self._lookup, domain, future)
+            else:
+                self.coalesced += 1
+
+        try:
+            answer = future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            with self._lock:
+                self.overruns += 1
+            return self.fail_open
+        return self.fail_open if answer is None else answer
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_domains': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'overruns': self.overruns,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def init_email_domains(app, resolver=None):
+    """Build the shared validator from `app.config`; `resolver` overrides DNS."""
+    global _validator
+    nameservers = app.config.get('EMAIL_DNS_NAMESERVERS')
+    _validator = DomainValidator(
+        resolver=resolver or DNSResolver(nameservers=nameservers),
+        cache_size=app.config.get('EMAIL_DOMAIN_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+        ttl=app.config.get('EMAIL_DOMAIN_TTL', DEFAULT_TTL),
+        negative_ttl=app.config.get('EMAIL_DOMAIN_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL),
+        budget=app.config.get('EMAIL_DNS_BUDGET', DEFAULT_BUDGET),
+        fail_open=app.config.get('EMAIL_DNS_FAIL_OPEN', True),
+    )
+
+
+def get_validator():
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = DomainValidator()
+        return _validator
+
+
+def warm_up():
+    """Do the first-use work (imports, resolver configuration) before traffic arrives."""
+    import email_validator  # noqa: F401
+    resolver = get_validator().resolver
+    if isinstance(resolver, DNSResolver):
+        resolver.resolver()
+
+
+def has_mail_host(domain):
+    return get_validator().is_deliverable(domain)
+
+
+def is_valid_email(email):
+    """Check the address syntax, then whether its domain accepts mail."""
+    from email_validator import validate_email, EmailNotValidError
+    try:
+        validated = validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        return False
+    return has_mail_host(validated.ascii_domain)
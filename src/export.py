@@ -0,0 +1,268 @@
+import csv
+import io
+import json
+import zlib
+from collections import namedtuple
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime, formataddr
+
+from flask import Response, current_app, request
+from sqlalchemy import false, select
+
+from db_conn import db
+from models import User, Email, EmailBody, Recipient, RecipientType, EmailFolder
+from body_codec import stored_text
+from search import search_condition
+from trigram import contains
+
+# Streaming exports of emails as CSV, JSON Lines or mbox.
+#
+# Emails are read through a server-side cursor (yield_per) on a connection
+# of their own, one partition at a time. The recipients of each partition
+# come from one query on a second connection, because a streaming cursor
+# keeps its connection busy. Each partition is encoded (and optionally
+# gzip-compressed) and sent before the next is read. Memory therefore stays
+# flat however many emails match, and the first bytes go out as soon as
+# the first partition is ready. Bodies are decompressed one partition at a
+# time as well.
+
+EXPORT_BATCH_SIZE = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'mbox': 'application/mbox',
+}
+
+CSV_COLUMNS = ('id', 'sent_at', 'sender', 'subject', 'to', 'cc', 'bcc', 'body')
+RECIPIENT_KINDS = ('to', 'cc', 'bcc')
+
+_MBOX_POLICY = policy.default.clone(linesep='\n', max_line_length=998)
+
+ExportRow = namedtuple('ExportRow', 'id sent_at subject body username email')
+
+
+def _emails(connection, criteria, batch_size):
+    statement = (
+        select(Email.id, Email.sent_at, Email.subject, EmailBody.codec, EmailBody.content,
+               Email.legacy_body.label('legacy_body'), User.username, User.email)
+        .join(User, Email.sender_id == User.id)
+        .outerjoin(EmailBody, EmailBody.email_id == Email.id)
+        .where(*criteria)
+        .order_by(Email.id)
+    )
+    for partition in connection.execution_options(yield_per=batch_size).execute(statement).partitions():
+        yield [
+            ExportRow(row.id, row.sent_at, row.subject, stored_text(row.codec, row.content, row.legacy_body),
+                      row.username, row.email)
+            for row in partition
+        ]
+
+
+def _recipients(connection, email_ids):
+    """{email id: {recipient type: [(name, address)]}} for one partition."""
+    found = {}
+    rows = connection.execute(
+        select(Recipient.email_id, RecipientType.name, Recipient.name, User.email)
+        .join(User, Recipient.user_id == User.id)
+        .outerjoin(RecipientType, Recipient.recipient_type_id == RecipientType.id)
+        .where(Recipient.email_id.in_(email_ids))
+        .order_by(Recipient.id)
+    )
+    for email_id, kind, name, address in rows:
+        kind = kind if kind in RECIPIENT_KINDS else 'to'
+        found.setdefault(email_id, {}).setdefault(kind, []).append((name, address))
+    return found
+
+
+def _address_list(pairs):
+    return ', '.join(formataddr(pair) for pair in pairs)
+
+
+def _csv_header():
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue()
+
+
+def _csv(rows, recipients):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        kinds = recipients.get(row.id, {})
+        writer.writerow((
+            row.id, row.sent_at.isoformat(sep=' ') if row.sent_at else '', formataddr((row.username, row.email)),
+            row.subject, *(_address_list(kinds.get(kind, ())) for kind in RECIPIENT_KINDS), row.body,
+        ))
+    return buffer.getvalue()
+
+
+def _jsonl(rows, recipients):
+    lines = []
+    for row in rows:
+        kinds = recipients.get(row.id, {})
+        record = {
+            'id': row.id,
+            'sent_at': row.sent_at.isoformat() if row.sent_at else None,
+            'sender': {'name': row.username, 'email': row.email},
+            'subject': row.subject,
+            **{kind: [{'name': name, 'email': address} for name, address in kinds.get(kind, ())]
+               for kind in RECIPIENT_KINDS},
+            'body': row.body,
+        }
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _mbox_message(row, kinds):
+    message = EmailMessage(policy=_MBOX_POLICY)
+    message['From'] = formataddr((row.username, row.email))
+    for kind in RECIPIENT_KINDS:
+        if kinds.get(kind):
+            message[kind.capitalize()] = _address_list(kinds[kind])
+    message['Subject'] = ' '.join((row.subject or '').split())
+    if row.sent_at:
+        message['Date'] = format_datetime(row.sent_at)
+    message['X-Email-Id'] = str(row.id)
+    message.set_content(row.body or '')
+
+    sent_at = row.sent_at.strftime('%a %b %d %H:%M:%S %Y') if row.sent_at else 'Thu Jan  1 00:00:00 1970'
+    lines = [f"From {row.email or 'MAILER-DAEMON'} {sent_at}\n"]
+    for line in message.as_string().splitlines(keepends=True):
+        # mboxrd: quote ">*From " lines so readers can split messages safely.
+        if line.lstrip('>').startswith('From '):
+            line = '>' + line
+        lines.append(line)
+    if not lines[-1].endswith('\n'):
+        lines.append('\n')
+    lines.append('\n')
+    return ''.join(lines)
+
+
+def _mbox(rows, recipients):
+    return ''.join(_mbox_message(row, recipients.get(row.id, {})) for row in rows)
+
+
+ENCODERS = {
+    'csv': (_csv_header, _csv),
+    'jsonl': (None, _jsonl),
+    'mbox': (None, _mbox),
+}
+
+
+def _generate(engine, criteria, fmt, batch_size):
+    header, encode = ENCODERS[fmt]
+    with engine.connect() as stream, engine.connect() as lookup:
+        if header:
+            yield header().encode('utf-8')
+        for partition in _emails(stream, criteria, batch_size):
+            recipients = _recipients(lookup, [row.id for row in partition])
+            yield encode(partition, recipients).encode('utf-8')
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        # A sync flush per partition sends it now instead of when zlib's buffer fills.
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_response(criteria, fmt, name, compress=False):
+    """A streamed download of the emails matching `criteria` (WHERE clauses on Email).
+
+    Raises ValueError for an unknown format.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(FORMATS)}.")
+    # Picked now, inside the view, so replica_reads applies to the export.
+    engine = db.session.get_bind(mapper=Email)
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', EXPORT_BATCH_SIZE)
+
+    body = _generate(engine, list(criteria), fmt, batch_size)
+    filename, mimetype = f"{name}.{fmt}", FORMATS[fmt]
+    if compress:
+        body, filename, mimetype = _gzipped(body), filename + '.gz', 'application/gzip'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Let the bytes through as they are produced instead of buffering the download in a proxy.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_request(criteria, name):
+    """export_response with the format and compression taken from the query string."""
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    return export_response(criteria, request.args.get('format', 'csv'), name, compress=compress)
+
+
+def folder_criteria(folder_id):
+    return [Email.id.in_(select(EmailFolder.email_id).where(EmailFolder.folder_id == folder_id))]
+
+
+def sent_criteria(user_id):
+    return [Email.sender_id == user_id]
+
+
+def _required(args, *names):
+    values = [args.get(name, '').strip() for name in names]
+    missing = [name for name, value in zip(names, values) if not value]
+    if missing:
+        raise ValueError(f"Missing search parameter(s): {', '.join(missing)}.")
+    return values
+
+
+def _keywords(args, fields):
+    keywords, = _required(args, 'keywords')
+    condition = search_condition(keywords, fields)
+    return [condition if condition is not None else false()]
+
+
+def _sender_ids(query, by_email=False):
+    user = User.query.filter(contains(User.username, query)).first()
+    if user is None and by_email:
+        user = User.query.filter(contains(User.email, query)).first()
+    return user.id if user else None
+
+
+def _by_sender(args):
+    sender, = _required(args, 'sender')
+    sender_id = _sender_ids(sender)
+    return [Email.sender_id == sender_id] if sender_id else [false()]
+
+
+def _by_subject_sender(args):
+    subject, sender = args.get('subject', '').strip(), args.get('sender', '').strip()
+    if not subject and not sender:
+        raise ValueError("Provide a subject or a sender.")
+    criteria = [Email.subject.ilike(f"%{subject}%")]
+    sender_id = _sender_ids(sender.lower(), by_email=True) if sender else None
+    if sender_id:
+        criteria.append(Email.sender_id == sender_id)
+    return criteria
+
+
+def _by_date_range(args):
+    start_date, end_date = _required(args, 'start_date', 'end_date')
+    return [Email.sent_at.between(start_date, end_date)]
+
+
+def _by_recipient(args):
+    recipient, = _required(args, 'recipient')
+    matching = select(Recipient.email_id).where(
+        Recipient.name.ilike(f"%{recipient}%") | Recipient.email_id.ilike(f"%{recipient}%")
+    )
+    return [Email.id.in_(matching)]
+
+
+# The email searches in routes/emails.py, by endpoint name, as export criteria.
+SEARCHES = {
+    'search_by_sender': _by_sender,
+    'search_by_keywords': lambda args: _keywords(args, ('body',)),
+    'search_emails_with_sender': lambda args: _keywords(args, ('body',)),
+    'search_full_email_info': lambda args: _keywords(args, ('subject', 'body')),
+    'search_by_date_range': _by_date_range,
+    'search_by_subject_and_sender': _by_subject_sender,
+    'search_by_recipient': _by_recipient,
+}
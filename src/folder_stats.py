@@ -0,0 +1,216 @@
+from sqlalchemy import case, delete, event, func, insert, inspect, or_, select, update
+
+from db_conn import db
+from models import Email, Folder, EmailFolder, Attachment, FolderStat
+from result_cache import bump_versions
+
+# Per-folder counters: how many emails a folder holds, the total size of
+# their attachments and when the newest of them was sent.
+#
+# Each `folder_stats` row is adjusted by the write that changes it, in the
+# same transaction: filing or unfiling an email (including the cascade when
+# an email or folder is deleted), adding, resizing or removing one of its
+# attachments, and changing its date. Listing folders with their totals
+# therefore reads one row per folder instead of every email in them.
+# reconcile_folder_stats() recomputes the rows from the base tables and
+# repairs any that drifted.
+
+_folder_stats = FolderStat.__table__
+_c = _folder_stats.c
+
+
+def _adjust(connection, folder_id, count, size, newest):
+    values = {'email_count': _c.email_count + count, 'attachment_bytes': _c.attachment_bytes + size}
+    if newest is not None:
+        values['newest_sent_at'] = case(
+            (or_(_c.newest_sent_at.is_(None), _c.newest_sent_at < newest), newest),
+            else_=_c.newest_sent_at,
+        )
+    result = connection.execute(update(_folder_stats).where(_c.folder_id == folder_id).values(**values))
+    if result.rowcount == 0:
+        connection.execute(insert(_folder_stats).values(
+            folder_id=folder_id, email_count=max(count, 0), attachment_bytes=max(size, 0), newest_sent_at=newest,
+        ))
+
+
+def recompute_newest(connection, folder_ids, at_or_after=None):
+    """Re-read `newest_sent_at` of `folder_ids` (ids or a select of them).
+
+    With `at_or_after`, only folders whose newest email may have been that
+    one are re-read; the others cannot have changed.
+    """
+    newest = (
+        select(func.max(Email.sent_at))
+        .select_from(EmailFolder)
+        .join(Email, Email.id == EmailFolder.email_id)
+        .where(EmailFolder.folder_id == _c.folder_id)
+        .scalar_subquery()
+    )
+    condition = _c.folder_id.in_(folder_ids)
+    if at_or_after is not None:
+        condition = condition & or_(_c.newest_sent_at.is_(None), _c.newest_sent_at <= at_or_after)
+    connection.execute(update(_folder_stats).where(condition).values(newest_sent_at=newest))
+
+
+def adjust_folders(connection, pairs, sign):
+    """Count emails into (`sign` 1) or out of (`sign` -1) folders.
+
+    `pairs` are the (folder_id, email_id) links just inserted or deleted.
+    """
+    by_folder = {}
+    for folder_id, email_id in pairs:
+        by_folder.setdefault(folder_id, set()).add(email_id)
+    if not by_folder:
+        return
+    email_ids = set().union(*by_folder.values())
+    sizes = dict(connection.execute(
+        select(Attachment.email_id, func.sum(Attachment.file_size))
+        .where(Attachment.email_id.in_(email_ids))
+        .group_by(Attachment.email_id)
+    ).all())
+    dates = dict(connection.execute(select(Email.id, Email.sent_at).where(Email.id.in_(email_ids))).all())
+
+    for folder_id, ids in by_folder.items():
+        size = sum(int(sizes.get(email_id) or 0) for email_id in ids)
+        newest = max((dates[email_id] for email_id in ids if dates.get(email_id)), default=None)
+        _adjust(connection, folder_id, sign * len(ids), sign * size, newest if sign > 0 else None)
+        if sign < 0 and newest is not None:
+            recompute_newest(connection, [folder_id], at_or_after=newest)
+    bump_versions(connection, {FolderStat.__tablename__})
+
+
+def adjust_attachment_bytes(connection, email_id, delta):
+    """Add `delta` attachment bytes to every folder holding `email_id`."""
+    if not delta:
+        return
+    connection.execute(
+        update(_folder_stats)
+        .where(_c.folder_id.in_(select(EmailFolder.folder_id).where(EmailFolder.email_id == email_id)))
+        .values(attachment_bytes=_c.attachment_bytes + delta)
+    )
+    bump_versions(connection, {FolderStat.__tablename__})
+
+
+def _changed(target, *names):
+    attrs = inspect(target).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+def _old(target, name):
+    """The value of `name` in the database before this flush."""
+    history = inspect(target).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(target, name)
+
+
+def _on_email_folder_insert(mapper, connection, target):
+    adjust_folders(connection, [(target.folder_id, target.email_id)], 1)
+
+
+def _on_email_folder_delete(mapper, connection, target):
+    adjust_folders(connection, [(_old(target, 'folder_id'), _old(target, 'email_id'))], -1)
+
+
+def _on_email_folder_update(mapper, connection, target):
+    if _changed(target, 'folder_id', 'email_id'):
+        adjust_folders(connection, [(_old(target, 'folder_id'), _old(target, 'email_id'))], -1)
+        adjust_folders(connection, [(target.folder_id, target.email_id)], 1)
+
+
+def _on_attachment_insert(mapper, connection, target):
+    adjust_attachment_bytes(connection, target.email_id, int(target.file_size or 0))
+
+
+def _on_attachment_delete(mapper, connection, target):
+    adjust_attachment_bytes(connection, _old(target, 'email_id'), -int(_old(target, 'file_size') or 0))
+
+
+def _on_attachment_update(mapper, connection, target):
+    if _changed(target, 'email_id', 'file_size'):
+        adjust_attachment_bytes(connection, _old(target, 'email_id'), -int(_old(target, 'file_size') or 0))
+        adjust_attachment_bytes(connection, target.email_id, int(target.file_size or 0))
+
+
+def _on_email_update(mapper, connection, target):
+    if _changed(target, 'sent_at'):
+        recompute_newest(connection, select(EmailFolder.folder_id).where(EmailFolder.email_id == target.id))
+        bump_versions(connection, {FolderStat.__tablename__})
+
+
+def _on_folder_insert(mapper, connection, target):
+    connection.execute(insert(_folder_stats).values(folder_id=target.id, email_count=0, attachment_bytes=0))
+
+
+def _on_folder_delete(mapper, connection, target):
+    connection.execute(delete(_folder_stats).where(_c.folder_id == target.id))
+
+
+event.listen(EmailFolder, 'after_insert', _on_email_folder_insert)
+event.listen(EmailFolder, 'after_delete', _on_email_folder_delete)
+event.listen(EmailFolder, 'after_update', _on_email_folder_update)
+event.listen(Attachment, 'after_insert', _on_attachment_insert)
+event.listen(Attachment, 'after_delete', _on_attachment_delete)
+event.listen(Attachment, 'after_update', _on_attachment_update)
+event.listen(Email, 'after_update', _on_email_update)
+event.listen(Folder, 'after_insert', _on_folder_insert)
+event.listen(Folder, 'after_delete', _on_folder_delete)
+
+
+def _actual(folder_ids):
+    """{folder id: (email_count, attachment_bytes, newest_sent_at)} from the base tables."""
+    actual = {folder_id: (0, 0, None) for folder_id in folder_ids}
+    counts = db.session.execute(
+        select(EmailFolder.folder_id, func.count(EmailFolder.id), func.max(Email.sent_at))
+        .outerjoin(Email, Email.id == EmailFolder.email_id)
+        .where(EmailFolder.folder_id.in_(folder_ids))
+        .group_by(EmailFolder.folder_id)
+    )
+    for folder_id, count, newest in counts:
+        actual[folder_id] = (count, 0, newest)
+    sizes = db.session.execute(
+        select(EmailFolder.folder_id, func.sum(Attachment.file_size))
+        .join(Attachment, Attachment.email_id == EmailFolder.email_id)
+        .where(EmailFolder.folder_id.in_(folder_ids))
+        .group_by(EmailFolder.folder_id)
+    )
+    for folder_id, size in sizes:
+        count, _, newest = actual[folder_id]
+        actual[folder_id] = (count, int(size or 0), newest)
+    return actual
+
+
+def reconcile_folder_stats(batch_size=1000):
+    """Recompute every folder's counters and repair the rows that drifted.
+
+    Folders are checked `batch_size` at a time, one transaction each.
+    Returns the number of rows repaired or removed.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        folder_ids = db.session.scalars(
+            select(Folder.id).where(Folder.id > last_id).order_by(Folder.id).limit(batch_size)
+        ).all()
+        if not folder_ids:
+            break
+        stored = {
+            row.folder_id: (row.email_count, row.attachment_bytes, row.newest_sent_at)
+            for row in db.session.execute(select(_folder_stats).where(_c.folder_id.in_(folder_ids)))
+        }
+        for folder_id, values in _actual(folder_ids).items():
+            if stored.get(folder_id) == values:
+                continue
+            row = dict(zip(('email_count', 'attachment_bytes', 'newest_sent_at'), values))
+            if folder_id in stored:
+                db.session.execute(update(_folder_stats).where(_c.folder_id == folder_id).values(**row))
+            else:
+                db.session.execute(insert(_folder_stats).values(folder_id=folder_id, **row))
+            repaired += 1
+        last_id = folder_ids[-1]
+        db.session.commit()
+
+    # Rows left behind by folders deleted outside the ORM.
+    repaired += db.session.execute(
+        delete(_folder_stats).where(_c.folder_id.not_in(select(Folder.id)))
+    ).rowcount
+    db.session.commit()
+    return repaired
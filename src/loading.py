@@ -0,0 +1,55 @@
+from sqlalchemy.orm import joinedload, raiseload, selectinload, undefer
+
+from models import Email, EmailFolder, Folder
+
+# Relationships are lazy by default (see models.py). Each view that needs
+# related rows asks for them here by name, so what a route loads is visible
+# in one place and anything it did not ask for raises instead of quietly
+# issuing one query per row.
+
+
+def _body():
+    # Email.body reads email_bodies, or the deferred legacy column for rows
+    # convert-email-bodies has not reached yet; load both with the page.
+    return [selectinload(Email.stored_body), undefer(Email.legacy_body)]
+
+
+PROFILES = {
+    # Row in an email listing: sender name and body.
+    'email_list_row': lambda: [
+        joinedload(Email.sender),
+        *_body(),
+        raiseload('*'),
+    ],
+    # Email selected next to other entities that supply the rest of the row.
+    'email_body': lambda: [*_body(), raiseload('*')],
+    # Single email or search hit shown with everything attached to it.
+    'email_detail': lambda: [
+        joinedload(Email.sender),
+        *_body(),
+        selectinload(Email.recipients),
+        selectinload(Email.attachments),
+        raiseload('*'),
+    ],
+    # Emails filed in a folder, with their senders.
+    'folder_contents': lambda: [
+        selectinload(Folder.email_folders)
+        .joinedload(EmailFolder.email)
+        .joinedload(Email.sender),
+    ],
+    # Folder row with its email counters.
+    'folder_row': lambda: [
+        joinedload(Folder.stats),
+        raiseload('*'),
+    ],
+    # Plain column rows: users, folders, attachments, recipient types.
+    'row': lambda: [raiseload('*')],
+}
+
+
+def loading_profile(name):
+    """Return the loader options for the named profile."""
+    try:
+        return PROFILES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown loading profile: {name}") from None
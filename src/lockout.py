@@ -0,0 +1,137 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, case, func, not_, select, update
+
+from db_conn import db
+from models import User, MAX_FAILED_LOGINS, LOCKOUT_DURATION
+from result_cache import bump_versions
+
+# Failed-login tracking as single conditional UPDATEs.
+#
+# The lockout state lives in users.failed_login_attempts and lock_time:
+# an account is locked while it has MAX_FAILED_LOGINS failures and its
+# lock_time is less than LOCKOUT_DURATION old. Every transition is one
+# UPDATE whose WHERE clause re-checks that state, so concurrent attempts
+# cannot lose increments or log in past a lock set a moment earlier.
+#
+# With LOGIN_FAILURE_FLUSH_INTERVAL > 0 failures are counted in memory
+# and written in batches instead; an account that reaches the threshold
+# is written through immediately.
+#
+# The counter updates skip the `users` table version bump, except the one
+# that locks the account: cached session users in every worker must see
+# the lock.
+
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _locked(now):
+    return and_(
+        func.coalesce(User.failed_login_attempts, 0) >= MAX_FAILED_LOGINS,
+        User.lock_time.isnot(None),
+        User.lock_time > now - LOCKOUT_DURATION,
+    )
+
+
+def _lock_expired(now):
+    return and_(User.lock_time.isnot(None), User.lock_time <= now - LOCKOUT_DURATION)
+
+
+def locked_until(failed_login_attempts, lock_time):
+    """When a lock with this state ends, or None if the state is not a lock."""
+    if (failed_login_attempts or 0) >= MAX_FAILED_LOGINS and lock_time:
+        return lock_time + LOCKOUT_DURATION
+    return None
+
+
+def is_locked_out(failed_login_attempts, lock_time):
+    until = locked_until(failed_login_attempts, lock_time)
+    return until is not None and datetime.now() < until
+
+
+def _apply_failures(user_id, count):
+    """Add `count` failures in one UPDATE; returns False if the account was already locked."""
+    now = datetime.now()
+    expired = _lock_expired(now)
+    attempts = case((expired, 0), else_=func.coalesce(User.failed_login_attempts, 0)) + count
+    # MySQL evaluates SET assignments left to right against the updated
+    # row, so there lock_time must test the new count rather than recompute it.
+    if db.session.get_bind(User).dialect.name == 'mysql':
+        new_attempts = User.failed_login_attempts
+    else:
+        new_attempts = attempts
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, not_(_locked(now)))
+        .ordered_values(
+            (User.failed_login_attempts, attempts),
+            (User.lock_time, case((new_attempts >= MAX_FAILED_LOGINS, now), (expired, None), else_=User.lock_time)),
+            (User.last_failed_login, now),
+        )
+        .execution_options(synchronize_session=False, skip_version_bump=True)
+    )
+    if result.rowcount == 0:
+        return False
+    # Locked accounts were excluded above, so reaching the threshold means
+    # this UPDATE set the lock.
+    attempts = db.session.execute(select(User.failed_login_attempts).where(User.id == user_id)).scalar()
+    if (attempts or 0) >= MAX_FAILED_LOGINS:
+        bump_versions(db.session.connection(), {User.__tablename__})
+    return True
+
+
+def flush_failures():
+    """Write all buffered failures. The caller commits."""
+    global _last_flush
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    for user_id, count in batch.items():
+        _apply_failures(user_id, count)
+    return len(batch)
+
+
+def record_failure(user_id, failed_login_attempts=0):
+    """Count a failed login. `failed_login_attempts` is the value read with
+    the user row and decides when a buffered count must be written through.
+    The caller commits."""
+    interval = current_app.config.get('LOGIN_FAILURE_FLUSH_INTERVAL', 0)
+    if not interval:
+        _apply_failures(user_id, 1)
+        return
+
+    with _pending_lock:
+        _pending[user_id] = count = _pending.get(user_id, 0) + 1
+        write_through = (failed_login_attempts or 0) + count >= MAX_FAILED_LOGINS
+        if write_through:
+            del _pending[user_id]
+        due = time.monotonic() - _last_flush >= interval
+    if write_through:
+        _apply_failures(user_id, count)
+    if due:
+        flush_failures()
+
+
+def clear_failures(user_id):
+    """Reset the failure count after a correct password.
+
+    Returns False, and changes nothing, if the account is locked. This is
+    the authoritative lock check: it runs in the same statement as the
+    reset.
+    """
+    with _pending_lock:
+        _pending.pop(user_id, None)
+    now = datetime.now()
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, not_(_locked(now)))
+        .values(failed_login_attempts=0, last_failed_login=None, lock_time=None)
+        .execution_options(synchronize_session=False, skip_version_bump=True)
+    )
+    return result.rowcount > 0
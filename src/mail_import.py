@@ -0,0 +1,482 @@
+import hashlib
+import html
+import logging
+import multiprocessing
+import os
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email import message_from_bytes, policy
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parsedate_to_datetime
+
+from sqlalchemy import insert, select, text
+
+from db_conn import db
+from models import User, Email, EmailBody, Folder, EmailFolder, Recipient, RecipientType, Attachment, ImportCheckpoint
+from bulk import INSERT_CHUNK_SIZE, insert_ignore
+from result_cache import bump_versions
+from search import get_backend
+from stats import adjust_stat, recipient_type_key
+from trigram import index_rows
+from body_codec import encode_body
+from mailbox_index import refresh_entries
+from folder_stats import adjust_folders
+
+# Streaming import of mbox files and directories of .eml messages.
+#
+# Messages are read one at a time and parsed in a process pool, with only a
+# bounded window of them in flight. They are written in batches: one
+# multi-row INSERT per table per batch, then a commit that also advances
+# the source's row in `import_checkpoints`. Memory is bounded by the batch
+# size, the window and the address cache, whatever the size of the
+# archive, and an interrupted import resumes after its last committed batch.
+#
+# People who are not users yet are created as users with an unusable
+# password, since emails and recipients must point at a user row.
+
+DEFAULT_BATCH_SIZE = 500
+ADDRESS_CACHE_SIZE = 50000
+EMAIL_INSERT_CHUNK_SIZE = 100  # bodies are large; keep each statement well under max_allowed_packet
+
+MAX_SUBJECT_LENGTH = 255
+MAX_BODY_BYTES = 65535  # MySQL TEXT
+MAX_ADDRESS_LENGTH = 120
+MAX_USERNAME_LENGTH = 80
+MAX_FILE_TYPE_LENGTH = 50
+UNUSABLE_PASSWORD = '!'  # matches no password hash
+
+RECIPIENT_HEADERS = (('to', 'To'), ('cc', 'Cc'), ('bcc', 'Bcc'))
+
+logger = logging.getLogger(__name__)
+
+
+# Reading
+
+def read_mbox(path, start=0):
+    """Yield (offset after the message, raw message) from an mbox file,
+    starting at byte offset `start`."""
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        lines, in_message = [], False
+        while True:
+            offset = fh.tell()
+            line = fh.readline()
+            if not line or line.startswith(b'From '):
+                if lines:
+                    yield offset, b''.join(lines)
+                    lines = []
+                if not line:
+                    return
+                in_message = True
+                continue
+            if in_message:
+                # mboxrd quoting: one '>' was added to every ">*From " line.
+                if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                    line = line[1:]
+                lines.append(line)
+
+
+def _sorted_files(root, parts=()):
+    with os.scandir(os.path.join(root, *parts)) as entries:
+        entries = sorted((entry for entry in entries if not entry.name.startswith('.')), key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from _sorted_files(root, parts + (entry.name,))
+        elif entry.is_file():
+            yield parts + (entry.name,)
+
+
+def read_eml_directory(path, after=''):
+    """Yield (relative path, raw message) for every file under `path`, in
+    path order, skipping those up to and including `after`."""
+    after_parts = tuple(after.split('/')) if after else ()
+    for parts in _sorted_files(path):
+        if parts <= after_parts:
+            continue
+        with open(os.path.join(path, *parts), 'rb') as fh:
+            yield '/'.join(parts), fh.read()
+
+
+def read_source(path, position):
+    if os.path.isdir(path):
+        return read_eml_directory(path, after=position)
+    if path.lower().endswith('.eml'):
+        return iter(() if position else [('done', open(path, 'rb').read())])
+    return read_mbox(path, start=int(position or 0))
+
+
+# Parsing (runs in the worker processes)
+
+def _decode(value):
+    if value is None:
+        return ''
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (ValueError, LookupError, UnicodeError):
+        return str(value)
+
+
+def _addresses(message, header):
+    found = []
+    for name, address in getaddresses([str(value) for value in message.get_all(header, [])]):
+        address = address.strip().lower()
+        if '@' in address and ' ' not in address and len(address) <= MAX_ADDRESS_LENGTH:
+            found.append((_decode(name).strip(), address))
+    return found
+
+
+def _text(part):
+    payload = part.get_payload(decode=True) or b''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='replace')
+    except LookupError:
+        return payload.decode('utf-8', errors='replace')
+
+
+_TAG = re.compile(r'<(script|style)\b.*?</\1>|<[^>]+>', re.S | re.I)
+
+
+def _is_attachment(part):
+    return part.get_content_disposition() == 'attachment' or part.get_filename() is not None
+
+
+def _body(message):
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or _is_attachment(part):
+            continue
+        if part.get_content_type() == 'text/plain':
+            return _text(part)
+        if part.get_content_type() == 'text/html' and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html.unescape(_TAG.sub(' ', _text(html_part)))
+    return ''
+
+
+def _truncate_bytes(value, limit):
+    encoded = value.encode('utf-8')
+    if len(encoded) <= limit:
+        return value
+    return encoded[:limit].decode('utf-8', errors='ignore')
+
+
+def _sent_at(message):
+    try:
+        sent_at = parsedate_to_datetime(message.get('Date'))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if sent_at.tzinfo is not None:
+        sent_at = sent_at.astimezone().replace(tzinfo=None)
+    return sent_at
+
+
+def parse_message(raw):
+    """The parts of a raw message the importer stores, as plain data."""
+    message = message_from_bytes(raw, policy=policy.compat32)
+    senders = _addresses(message, 'From') or _addresses(message, 'Sender')
+    recipients = []
+    for type_name, header in RECIPIENT_HEADERS:
+        recipients.extend((type_name, name, address) for name, address in _addresses(message, header))
+    attachments = []
+    for part in message.walk():
+        if not part.is_multipart() and _is_attachment(part):
+            payload = part.get_payload(decode=True) or b''
+            file_name = os.path.basename(_decode(part.get_filename()) or 'attachment')
+            attachments.append((file_name[:255], part.get_content_type()[:MAX_FILE_TYPE_LENGTH], len(payload)))
+    return {
+        'sender': senders[0] if senders else None,
+        'subject': _decode(message.get('Subject')).strip()[:MAX_SUBJECT_LENGTH] or '(no subject)',
+        'sent_at': _sent_at(message),
+        'body': _truncate_bytes(_body(message).replace('\x00', ''), MAX_BODY_BYTES),
+        'recipients': recipients,
+        'attachments': attachments,
+    }
+
+
+def _parse_or_none(raw):
+    try:
+        return parse_message(raw)
+    except Exception:
+        return None
+
+
+def parse_stream(messages, workers=0, window=None):
+    """Parse (position, raw) pairs, yielding (position, parsed or None) in
+    the same order. With `workers`, parsing runs in that many processes and
+    at most `window` messages are in flight."""
+    if not workers:
+        for position, raw in messages:
+            yield position, _parse_or_none(raw)
+        return
+    window = window or workers * 16
+    # spawn, not fork: the parent holds database connections and threads.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        for position, raw in messages:
+            pending.append((position, pool.submit(_parse_or_none, raw)))
+            if len(pending) >= window:
+                position, future = pending.popleft()
+                yield position, future.result()
+        while pending:
+            position, future = pending.popleft()
+            yield position, future.result()
+
+
+# Writing
+
+def _placeholder_username(address, salted=False):
+    if not salted and len(address) <= MAX_USERNAME_LENGTH:
+        return address
+    digest = hashlib.sha1(address.encode('utf-8')).hexdigest()[:8]
+    return f"{address[:MAX_USERNAME_LENGTH - 9]}-{digest}"
+
+
+class AddressBook:
+    """Maps email addresses to user ids, creating users for unknown
+    addresses. Lookups are batched and the most recent are cached."""
+
+    def __init__(self, max_size=ADDRESS_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self.created = 0
+
+    def _remember(self, mapping):
+        for address, user_id in mapping.items():
+            self._cache[address] = user_id
+            self._cache.move_to_end(address)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _lookup(self, addresses):
+        found = {}
+        addresses = list(addresses)
+        for start in range(0, len(addresses), INSERT_CHUNK_SIZE):
+            chunk = addresses[start:start + INSERT_CHUNK_SIZE]
+            for user_id, address in db.session.execute(select(User.id, User.email).where(User.email.in_(chunk))):
+                found[address.lower()] = user_id
+        return found
+
+    def _create(self, connection, addresses, salted):
+        rows = [
+            {'username': _placeholder_username(address, salted), 'email': address, 'password': UNUSABLE_PASSWORD}
+            for address in sorted(addresses)
+        ]
+        insert_ignore(connection, User.__table__, rows)
+        created = self._lookup(addresses)
+        new_users = db.session.execute(
+            select(User.id, User.username, User.email).where(User.id.in_(list(created.values())))
+        ).all()
+        index_rows(connection, User.username, [(row.id, row.username) for row in new_users])
+        index_rows(connection, User.email, [(row.id, row.email) for row in new_users])
+        adjust_stat(connection, User.__tablename__, len(new_users))
+        if new_users:
+            bump_versions(connection, {User.__tablename__})
+        self.created += len(new_users)
+        return created
+
+    def resolve(self, addresses):
+        """{address: user id} for `addresses`, which must be lower-case."""
+        result, missing = {}, []
+        for address in addresses:
+            user_id = self._cache.get(address)
+            if user_id is None:
+                missing.append(address)
+            else:
+                self._cache.move_to_end(address)
+                result[address] = user_id
+        if missing:
+            found = self._lookup(missing)
+            connection = db.session.connection()
+            for salted in (False, True):
+                # A second pass with a hashed username covers addresses
+                # whose plain username is already taken by someone else.
+                unknown = [address for address in missing if address not in found]
+                if unknown:
+                    found.update(self._create(connection, unknown, salted))
+            self._remember(found)
+            result.update(found)
+        return result
+
+
+def _consecutive_auto_increment(connection):
+    # With lock modes 0 and 1 InnoDB gives a multi-row INSERT consecutive ids.
+    return connection.execute(text("SELECT @@innodb_autoinc_lock_mode")).scalar() in (0, 1)
+
+
+class MailImporter:
+    """Imports messages into `owner`'s `folder_name` folder.
+
+    `owner` is a username or email address of an existing user.
+    """
+
+    def __init__(self, owner, folder_name='Imported', batch_size=DEFAULT_BATCH_SIZE, workers=0):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.addresses = AddressBook()
+        user = User.query.filter((User.username == owner) | (User.email == owner)).first()
+        if user is None:
+            raise ValueError(f"No user {owner!r}")
+        folder = Folder.query.filter_by(user_id=user.id, folder_name=folder_name).first()
+        if folder is None:
+            folder = Folder(folder_name=folder_name, user_id=user.id)
+            db.session.add(folder)
+        self.type_ids = {}
+        for type_name, _ in RECIPIENT_HEADERS:
+            recipient_type = RecipientType.query.filter_by(name=type_name).first()
+            if recipient_type is None:
+                recipient_type = RecipientType(name=type_name)
+                db.session.add(recipient_type)
+            db.session.flush()
+            self.type_ids[type_name] = recipient_type.id
+        self.folder_id = folder.id
+        db.session.commit()
+        self._email_ids = None
+
+    def _insert_emails(self, connection, rows):
+        """Insert email rows and return their ids, in order."""
+        table = Email.__table__
+        if connection.dialect.insert_executemany_returning_sort_by_parameter_order:
+            statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            return list(connection.execute(statement, rows).scalars())
+        if self._email_ids is None:
+            self._email_ids = connection.dialect.name == 'mysql' and _consecutive_auto_increment(connection)
+        if self._email_ids:
+            ids = []
+            for start in range(0, len(rows), EMAIL_INSERT_CHUNK_SIZE):
+                chunk = rows[start:start + EMAIL_INSERT_CHUNK_SIZE]
+                first = connection.execute(insert(table).values(chunk)).lastrowid
+                ids.extend(range(first, first + len(chunk)))
+            return ids
+        return [connection.execute(insert(table), row).inserted_primary_key[0] for row in rows]
+
+    def _write(self, batch):
+        wanted = set()
+        for message in batch:
+            wanted.add(message['sender'][1])
+            wanted.update(address for _, _, address in message['recipients'])
+        user_ids = self.addresses.resolve(wanted)
+        batch = [message for message in batch if message['sender'][1] in user_ids]
+        if not batch:
+            return 0
+
+        connection = db.session.connection()
+        now = datetime.now()
+        email_ids = self._insert_emails(connection, [
+            {
+                'subject': message['subject'], 'body': '',
+                'sender_id': user_ids[message['sender'][1]], 'sent_at': message['sent_at'] or now,
+            }
+            for message in batch
+        ])
+        bodies = []
+        for email_id, message in zip(email_ids, batch):
+            codec, content = encode_body(message['body'])
+            bodies.append({'email_id': email_id, 'codec': codec, 'content': content})
+        for start in range(0, len(bodies), INSERT_CHUNK_SIZE):
+            connection.execute(insert(EmailBody.__table__), bodies[start:start + INSERT_CHUNK_SIZE])
+
+        recipients, attachments = [], []
+        per_type = {}
+        for email_id, message in zip(email_ids, batch):
+            seen = set()
+            for type_name, name, address in message['recipients']:
+                key = (self.type_ids[type_name], user_ids.get(address))
+                if key[1] is None or key in seen:
+                    continue
+                seen.add(key)
+                per_type[key[0]] = per_type.get(key[0], 0) + 1
+                recipients.append({
+                    'email_id': email_id, 'recipient_type_id': key[0], 'user_id': key[1],
+                    'name': (name or address)[:255],
+                })
+            attachments.extend(
+                {'email_id': email_id, 'file_name': file_name, 'file_type': file_type, 'file_size': size}
+                for file_name, file_type, size in message['attachments']
+            )
+
+        insert_ignore(connection, Recipient.__table__, recipients)
+        for start in range(0, len(attachments), INSERT_CHUNK_SIZE):
+            connection.execute(insert(Attachment.__table__), attachments[start:start + INSERT_CHUNK_SIZE])
+        insert_ignore(connection, EmailFolder.__table__,
+                      [{'email_id': email_id, 'folder_id': self.folder_id} for email_id in email_ids])
+        adjust_folders(connection, [(self.folder_id, email_id) for email_id in email_ids], 1)
+
+        # The bookkeeping the ORM events would have done per row.
+        get_backend().index_new(connection, [
+            {'id': email_id, 'subject': message['subject'], 'body': message['body']}
+            for email_id, message in zip(email_ids, batch)
+        ])
+        if recipients:
+            new_recipients = db.session.execute(
+                select(Recipient.id, Recipient.name).where(Recipient.email_id.in_(email_ids))
+            ).all()
+            index_rows(connection, Recipient.name, new_recipients)
+        refresh_entries(connection, email_ids)
+        adjust_stat(connection, Email.__tablename__, len(email_ids))
+        adjust_stat(connection, Recipient.__tablename__, len(recipients))
+        adjust_stat(connection, Attachment.__tablename__, len(attachments))
+        for type_id, count in per_type.items():
+            adjust_stat(connection, recipient_type_key(type_id), count)
+        bump_versions(connection, {
+            Email.__tablename__, EmailBody.__tablename__, Recipient.__tablename__, Attachment.__tablename__,
+            EmailFolder.__tablename__,
+        })
+        return len(email_ids)
+
+    def _checkpoint(self, key, source, position, imported, skipped):
+        checkpoint = db.session.get(ImportCheckpoint, key)
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint(source_key=key, source=source)
+            db.session.add(checkpoint)
+        checkpoint.position = str(position)
+        checkpoint.imported = imported
+        checkpoint.skipped = skipped
+        checkpoint.updated_at = datetime.now()
+        return checkpoint
+
+    def run(self, source, restart=False):
+        """Import one mbox file, .eml file or directory of messages,
+        resuming from its checkpoint. Returns (imported, skipped) for this run."""
+        source = os.path.abspath(source)
+        key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        checkpoint = db.session.get(ImportCheckpoint, key)
+        position = '' if restart or checkpoint is None else checkpoint.position
+        total_imported = 0 if restart or checkpoint is None else checkpoint.imported
+        total_skipped = 0 if restart or checkpoint is None else checkpoint.skipped
+        db.session.commit()
+        if position:
+            logger.info("Resuming %s after %s", source, position)
+
+        imported = skipped = 0
+        batch = []
+        last_position = position
+
+        def flush():
+            nonlocal imported, skipped
+            written = self._write(batch) if batch else 0
+            skipped += len(batch) - written
+            imported += written
+            self._checkpoint(key, source, last_position, total_imported + imported, total_skipped + skipped)
+            db.session.commit()
+            batch.clear()
+            logger.info("%s: %d imported, %d skipped, at %s", source, imported, skipped, last_position)
+
+        try:
+            for last_position, message in parse_stream(read_source(source, position), self.workers):
+                if message is None or message['sender'] is None:
+                    skipped += 1
+                else:
+                    batch.append(message)
+                if len(batch) >= self.batch_size:
+                    flush()
+            if last_position != position:
+                flush()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return imported, skipped
@@ -0,0 +1,165 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, case, delete, distinct, event, func, inspect, insert, literal, select
+
+from db_conn import db, RoutingSession
+from models import User, Email, Recipient, RecipientType, MailboxEntry
+from pagination import keyset_paginate
+
+# Per-user mailbox index.
+#
+# Received mail exists only as `recipients` rows, so listing an inbox meant
+# joining recipients -> emails -> users and sorting the result by date.
+# Instead every (user, mailbox, email) has a row in `mailbox_entries`, and
+# ix_mailbox_entries_page holds everything a page needs: opening a mailbox
+# is one range scan of that index, newest first, followed by a primary-key
+# fetch of the emails on the page. The entries of an email are rebuilt from
+# the base tables whenever its sender, date or recipients change, in the
+# same flush (or bulk write) as the change itself.
+
+INBOX = 'inbox'
+SENT = 'sent'
+MAILBOXES = (INBOX, SENT)
+
+# The `flags` of an inbox entry: how the user received the email, OR-ed
+# over all their recipient rows for it. Sent entries have no flags.
+FLAG_TO, FLAG_CC, FLAG_BCC, FLAG_OTHER = 1, 2, 4, 8
+RECEIVED_AS = {'to': FLAG_TO, 'cc': FLAG_CC, 'bcc': FLAG_BCC, 'other': FLAG_OTHER}
+
+# The sort key of an email without a date, so it pages as the oldest.
+UNDATED = datetime(1970, 1, 1)
+
+REFRESH_CHUNK_SIZE = 1000
+
+_entries = MailboxEntry.__table__
+_COLUMNS = ['user_id', 'mailbox', 'email_id', 'sent_at', 'flags']
+
+
+def _sort_key():
+    return func.coalesce(Email.sent_at, literal(UNDATED, DateTime))
+
+
+def _recipient_flag():
+    name = func.lower(RecipientType.name)
+    return case(
+        *((name == kind, flag) for kind, flag in RECEIVED_AS.items() if flag != FLAG_OTHER),
+        else_=FLAG_OTHER,
+    )
+
+
+def refresh_entries(connection, email_ids):
+    """Rebuild the sent and inbox entries of `email_ids` from the base tables.
+
+    Emails that no longer exist just lose their entries. Runs on the
+    caller's connection, so it commits or rolls back with the write.
+    """
+    email_ids = sorted({email_id for email_id in email_ids if email_id is not None})
+    for start in range(0, len(email_ids), REFRESH_CHUNK_SIZE):
+        chunk = email_ids[start:start + REFRESH_CHUNK_SIZE]
+        connection.execute(delete(_entries).where(_entries.c.email_id.in_(chunk)))
+        connection.execute(insert(_entries).from_select(_COLUMNS, (
+            select(Email.sender_id, literal(SENT), Email.id, _sort_key(), literal(0))
+            .where(Email.id.in_(chunk))
+        )))
+        # Each flag is a single bit, so SUM(DISTINCT) is a bitwise OR.
+        connection.execute(insert(_entries).from_select(_COLUMNS, (
+            select(Recipient.user_id, literal(INBOX), Recipient.email_id, _sort_key(),
+                   func.sum(distinct(_recipient_flag())))
+            .join(Email, Email.id == Recipient.email_id)
+            .outerjoin(RecipientType, Recipient.recipient_type_id == RecipientType.id)
+            .where(Recipient.email_id.in_(chunk))
+            .group_by(Recipient.user_id, Recipient.email_id, Email.sent_at)
+        )))
+
+
+def _changed(obj, *names):
+    attrs = inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+def _touched_emails(session):
+    """Ids of the emails whose mailbox entries this flush may have changed."""
+    email_ids = set()
+    renamed_types = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Email):
+            email_ids.add(obj.id)
+        elif isinstance(obj, Recipient):
+            email_ids.add(obj.email_id)
+    for obj in session.dirty:
+        if isinstance(obj, Email) and _changed(obj, 'sender_id', 'sent_at'):
+            email_ids.add(obj.id)
+        elif isinstance(obj, Recipient) and _changed(obj, 'email_id', 'user_id', 'recipient_type_id'):
+            history = inspect(obj).attrs.email_id.history
+            email_ids.update(history.deleted)
+            email_ids.add(obj.email_id)
+        elif isinstance(obj, RecipientType) and _changed(obj, 'name'):
+            renamed_types.add(obj.id)
+    if renamed_types:
+        email_ids.update(session.connection().scalars(
+            select(Recipient.email_id).where(Recipient.recipient_type_id.in_(renamed_types)).distinct()
+        ))
+    return email_ids
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _refresh_flushed(session, flush_context):
+    email_ids = _touched_emails(session)
+    if email_ids:
+        refresh_entries(session.connection(), email_ids)
+
+
+def rebuild_mailbox_index(batch_size=5000):
+    """Rebuild every mailbox entry from emails and recipients."""
+    db.session.execute(delete(_entries))
+    last_id = 0
+    while True:
+        email_ids = db.session.scalars(
+            select(Email.id).where(Email.id > last_id).order_by(Email.id).limit(batch_size)
+        ).all()
+        if not email_ids:
+            break
+        refresh_entries(db.session.connection(), email_ids)
+        last_id = email_ids[-1]
+    db.session.commit()
+
+
+def received_as(flags):
+    return [name for name, flag in RECEIVED_AS.items() if flags & flag]
+
+
+def mailbox_page(user_id, mailbox, cursor=None, per_page=None):
+    """One page of a user's inbox or sent mail, newest first.
+
+    Returns the `Page` of entries and a dict per email on it, in page order.
+    Raises ValueError for an unknown mailbox.
+    """
+    if mailbox not in MAILBOXES:
+        raise ValueError(f"Unknown mailbox {mailbox!r}; use one of {', '.join(MAILBOXES)}.")
+    query = db.session.query(MailboxEntry.email_id, MailboxEntry.sent_at, MailboxEntry.flags).filter(
+        MailboxEntry.user_id == user_id, MailboxEntry.mailbox == mailbox
+    )
+    page = keyset_paginate(query, MailboxEntry.sent_at, MailboxEntry.email_id, cursor=cursor, per_page=per_page)
+    if not page:
+        return page, []
+
+    emails = {row.id: row for row in db.session.execute(
+        select(Email.id, Email.subject, Email.sent_at, Email.sender_id, User.username, User.email)
+        .join(User, Email.sender_id == User.id)
+        .where(Email.id.in_([entry.email_id for entry in page]))
+    )}
+    items = []
+    for entry in page:
+        row = emails.get(entry.email_id)
+        if row is None:
+            continue
+        item = {
+            'id': row.id,
+            'subject': row.subject,
+            'sent_at': row.sent_at.isoformat() if row.sent_at else None,
+            'sender': {'id': row.sender_id, 'username': row.username, 'email': row.email},
+        }
+        if mailbox == INBOX:
+            item['received_as'] = received_as(entry.flags)
+        items.append(item)
+    return page, items
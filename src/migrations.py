@@ -0,0 +1,267 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from db_conn import db
+from models import User, Email, Recipient, Attachment, Folder, EmailFolder, MailboxEntry
+from stats import rebuild_stats
+from search import rebuild_search_index
+from trigram import contains, rebuild_trigram_index
+from mailbox_index import INBOX, rebuild_mailbox_index
+from folder_stats import reconcile_folder_stats
+
+# Versioned schema upgrades.
+#
+# Each migration runs once, in order, and is recorded in `schema_version`.
+# They are written to be safe on a database that already has some of the
+# objects (e.g. one created from Emails.session.sql), so every CREATE is
+# guarded by checkfirst.
+
+_version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', _version_metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return register
+
+
+def _create_tables(*names):
+    bind = db.session.connection()
+    for name in names:
+        db.metadata.tables[name].create(bind=bind, checkfirst=True)
+
+
+def _add_columns(table_name, *column_names):
+    bind = db.session.connection()
+    existing = {column['name'] for column in inspect(bind).get_columns(table_name)}
+    table = db.metadata.tables[table_name]
+    for name in column_names:
+        if name not in existing:
+            column_ddl = CreateColumn(table.c[name]).compile(dialect=bind.dialect)
+            bind.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+
+
+def _create_mysql_fulltext_indexes(table_name, indexes):
+    bind = db.session.connection()
+    existing = {index['name'] for index in inspect(bind).get_indexes(table_name)}
+    for name, columns in indexes.items():
+        if name not in existing:
+            bind.execute(text(f"CREATE FULLTEXT INDEX {name} ON {table_name} ({', '.join(columns)})"))
+
+
+def _drop_mysql_indexes(table_name, *index_names):
+    bind = db.session.connection()
+    existing = {index['name'] for index in inspect(bind).get_indexes(table_name)}
+    for name in index_names:
+        if name in existing:
+            bind.execute(text(f"DROP INDEX {name} ON {table_name}"))
+
+
+def _create_indexes(table_name, *index_names):
+    bind = db.session.connection()
+    table = db.metadata.tables[table_name]
+    for index in table.indexes:
+        if index.name in index_names:
+            index.create(bind=bind, checkfirst=True)
+
+
+@migration(1, "Initial schema")
+def initial_schema():
+    _create_tables('users', 'recipient_types', 'folders', 'emails', 'attachments', 'recipients', 'email_folders')
+
+
+@migration(2, "Admin dashboard counters")
+def dashboard_counters():
+    _create_tables('table_stats')
+    rebuild_stats()
+
+
+@migration(3, "Full-text search over email subject and body")
+def full_text_search():
+    # Written against the schema of this version, when bodies were still in
+    # emails.body; migration 11 moves the MySQL indexes to email_search.
+    dialect = db.session.connection().dialect.name
+    if dialect == 'mysql':
+        _create_mysql_fulltext_indexes('emails', {
+            'ft_emails_body': ['body'],
+            'ft_emails_subject_body': ['subject', 'body'],
+        })
+    elif dialect == 'sqlite':
+        db.session.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(subject, body)"))
+        db.session.execute(text("DELETE FROM emails_fts"))
+        db.session.execute(text("INSERT INTO emails_fts (rowid, subject, body) SELECT id, subject, body FROM emails"))
+
+
+@migration(4, "Trigram index for substring lookups")
+def trigram_index():
+    _create_tables('search_trigrams')
+    # The per-trigram counts only exist from migration 13.
+    rebuild_trigram_index(counts=False)
+
+
+@migration(5, "Secondary indexes for the route query workload")
+def workload_indexes():
+    _create_indexes('emails', 'ix_emails_sent_at_id', 'ix_emails_sender_sent_at', 'ix_emails_folder_id')
+    _create_indexes('folders', 'ix_folders_user_name')
+    _create_indexes('email_folders', 'ix_email_folders_folder_id')
+    _create_indexes('recipients', 'ix_recipients_user_id', 'ix_recipients_email_id')
+    _create_indexes('attachments', 'ix_attachments_email_id', 'ix_attachments_file_size')
+
+
+@migration(6, "Attachment content hashes for the blob store")
+def attachment_content():
+    _add_columns('attachments', 'content_hash')
+    _create_indexes('attachments', 'ix_attachments_content_hash')
+
+
+@migration(7, "Table versions for the search result cache")
+def table_versions():
+    _create_tables('table_versions')
+
+
+@migration(8, "Checkpoints for resumable mail imports")
+def import_checkpoints():
+    _create_tables('import_checkpoints')
+
+
+@migration(9, "Per-user mailbox index")
+def mailbox_index():
+    _create_tables('mailbox_entries')
+    rebuild_mailbox_index()
+
+
+@migration(10, "Per-folder email counters")
+def folder_counters():
+    _create_tables('folder_stats')
+    reconcile_folder_stats()
+
+
+@migration(11, "Compressed email bodies")
+def compressed_bodies():
+    # Existing bodies stay readable in emails.body until convert-email-bodies
+    # moves them; only the search copy is built here.
+    dialect = db.session.connection().dialect.name
+    _create_tables('email_bodies')
+    if dialect != 'sqlite':
+        _create_tables('email_search')
+        if dialect == 'mysql':
+            _drop_mysql_indexes('emails', 'ft_emails_body', 'ft_emails_subject_body')
+        rebuild_search_index()
+
+
+@migration(12, "Binary collation for search trigrams")
+def trigram_collation():
+    # search_trigrams tables created by migration 4 before the model named a
+    # collation took the server default, which folds accents and case.
+    if db.session.connection().dialect.name == 'mysql':
+        db.session.execute(text(
+            "ALTER TABLE search_trigrams MODIFY trigram VARCHAR(3) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL"
+        ))
+
+
+@migration(13, "Folded search trigrams with per-trigram row counts")
+def trigram_counts():
+    # Rebuilt rather than converted: existing trigrams were only lowercased.
+    _create_tables('search_trigram_stats')
+    rebuild_trigram_index()
+
+
+def current_version():
+    schema_version.create(bind=db.session.connection(), checkfirst=True)
+    return db.session.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade():
+    """Apply every migration newer than the database; return the versions applied."""
+    applied = []
+    version = current_version()
+    db.session.commit()
+    for number, description, fn in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            fn()
+            db.session.execute(
+                schema_version.insert().values(version=number, description=description, applied_at=datetime.now())
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        applied.append(number)
+    return applied
+
+
+# Queries the routes run on every request, with representative arguments.
+# check_query_plans() EXPLAINs each one and reports any that would read a
+# whole table, so a dropped or mis-declared index fails loudly. MySQL may
+# prefer a scan on nearly empty tables, so run it against real-sized data.
+HOT_QUERIES = {
+    'emails list page': lambda: select(Email.id).order_by(Email.sent_at.desc(), Email.id.desc()).limit(50),
+    'emails by date range': lambda: select(Email.id).where(
+        Email.sent_at.between(datetime(2024, 1, 1), datetime(2024, 2, 1))
+    ),
+    'emails by sender': lambda: select(Email.id).where(Email.sender_id == 1),
+    'emails by folder': lambda: select(Email.id).where(Email.folder_id == 1),
+    'recipients by user': lambda: select(Recipient.id).where(Recipient.user_id == 1),
+    'recipients by email': lambda: select(Recipient.id).where(Recipient.email_id == 1),
+    'attachments by email': lambda: select(Attachment.id).where(Attachment.email_id == 1),
+    'attachments by size': lambda: select(Attachment.id).where(Attachment.file_size.between(1024, 4096)),
+    'folder by user and name': lambda: select(Folder.id).where(Folder.user_id == 1, Folder.folder_name == 'Inbox'),
+    'folder contents': lambda: select(EmailFolder.email_id).where(EmailFolder.folder_id == 1),
+    'user substring lookup': lambda: select(User.id).where(contains(User.username, 'alice')),
+    'mailbox page': lambda: (
+        select(MailboxEntry.email_id, MailboxEntry.sent_at, MailboxEntry.flags)
+        .where(MailboxEntry.user_id == 1, MailboxEntry.mailbox == INBOX)
+        .order_by(MailboxEntry.sent_at.desc(), MailboxEntry.email_id.desc())
+        .limit(50)
+    ),
+    'mailbox entries by email': lambda: select(MailboxEntry.user_id).where(MailboxEntry.email_id == 1),
+}
+
+# Hot queries that may walk a whole index in order because a LIMIT stops
+# them after one page.
+ORDERED_SCANS = {'emails list page'}
+
+
+def _full_scans(statement, allow_index_scan=False):
+    """Tables or indexes the database would read in full to run `statement`."""
+    connection = db.session.connection()
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        # "SCAN t" reads the table, "SCAN t USING [COVERING] INDEX i" reads
+        # all of an index; "SEARCH" is a bounded lookup.
+        return [
+            row[-1] for row in rows
+            if row[-1].startswith('SCAN ') and not (allow_index_scan and ' USING ' in row[-1])
+        ]
+    if dialect == 'mysql':
+        rows = connection.execute(text(f"EXPLAIN {compiled}")).mappings().all()
+        # type=ALL is a table scan, type=index a full index scan.
+        scan_types = {'ALL'} if allow_index_scan else {'ALL', 'index'}
+        return [f"{row['table']} (type={row['type']})" for row in rows if row['type'] in scan_types]
+    return []
+
+
+def check_query_plans():
+    """Return {query name: [full scans]} for every hot query that scans a table."""
+    failures = {}
+    for name, build in HOT_QUERIES.items():
+        scans = _full_scans(build(), allow_index_scan=name in ORDERED_SCANS)
+        if scans:
+            failures[name] = scans
+    return failures
@@ -1,6 +1,11 @@
 from db_conn import db
 from datetime import datetime, timedelta
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import joinedload
+from body_codec import encode_body, decode_body
+
+MAX_FAILED_LOGINS = 5
+LOCKOUT_DURATION = timedelta(minutes=15)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -18,9 +23,9 @@ class User(db.Model):
     mfa_secret = db.Column(db.String(255), nullable=True)
 
     emails_sent = db.relationship(
-        'Email', foreign_keys='Email.sender_id', backref='user_sender', lazy='joined', cascade='all, delete-orphan'
+        'Email', foreign_keys='Email.sender_id', backref='user_sender', cascade='all, delete-orphan'
     )
-    folders = db.relationship('Folder', backref='user', lazy='joined', cascade='all, delete-orphan')
+    folders = db.relationship('Folder', backref='user', cascade='all, delete-orphan')
 
     def get_id(self):
         return str(self.id)
@@ -43,53 +48,110 @@ class User(db.Model):
     def is_regular_user(self):
         return not self.is_admin
 
-    def reset_failed_login(self):
-        self.failed_login_attempts = 0
-        self.last_failed_login = None
-        db.session.commit()
-
     def is_locked(self):
-        if self.failed_login_attempts >= 5:
-            if self.lock_time:
-                lock_time_limit = self.lock_time + timedelta(minutes=15)
-                if datetime.now() < lock_time_limit:
-                    return True  
-                else:
-                    self.failed_login_attempts = 0
-                    self.lock_time = None 
-                    db.session.commit()
-            else:
-                return False
+        # Read-only; lockout.py owns the transitions.
+        if (self.failed_login_attempts or 0) >= MAX_FAILED_LOGINS and self.lock_time:
+            return datetime.now() < self.lock_time + LOCKOUT_DURATION
         return False
 
 
 class Email(db.Model):
     __tablename__ = 'emails'
+    __table_args__ = (
+        # Date-range search and the list page order; sender/folder filters.
+        db.Index('ix_emails_sent_at_id', 'sent_at', 'id'),
+        db.Index('ix_emails_sender_sent_at', 'sender_id', 'sent_at'),
+        db.Index('ix_emails_folder_id', 'folder_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(255), nullable=False)
-    body = db.Column(db.Text, nullable=False)
+    # Bodies written before email_bodies existed; convert-email-bodies moves
+    # them out and leaves ''. Never loaded with the row.
+    legacy_body = db.deferred(db.Column('body', db.Text, nullable=False, default=''))
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False) 
     sent_at = db.Column(db.DateTime, default=datetime.now)
     folder_id = db.Column(db.Integer, db.ForeignKey('folders.id'), nullable=True)
 
-    folder = db.relationship('Folder', backref='emails', lazy='joined')
-    sender = db.relationship('User', backref='sent_emails', lazy='joined', foreign_keys=[sender_id])
-    recipients = db.relationship('Recipient', backref='email', lazy='joined', cascade='all, delete-orphan')
-    attachments = db.relationship('Attachment', backref='email', lazy='joined', cascade='all, delete-orphan')
-    email_folders = db.relationship('EmailFolder', backref='email_folder', lazy='joined', cascade='all, delete-orphan')
+    folder = db.relationship('Folder', backref='emails')
+    sender = db.relationship('User', backref='sent_emails', foreign_keys=[sender_id])
+    recipients = db.relationship('Recipient', backref='email', cascade='all, delete-orphan')
+    attachments = db.relationship('Attachment', backref='email', cascade='all, delete-orphan')
+    email_folders = db.relationship('EmailFolder', backref='email_folder', cascade='all, delete-orphan')
+    stored_body = db.relationship('EmailBody', uselist=False, cascade='all, delete-orphan')
+
+    @property
+    def body(self):
+        """The body text, loaded and decompressed on first access."""
+        if self.stored_body is not None:
+            return self.stored_body.text
+        return self.legacy_body
+
+    @body.setter
+    def body(self, value):
+        if self.stored_body is None:
+            self.stored_body = EmailBody()
+            self.legacy_body = ''
+        self.stored_body.text = value
 
     def __repr__(self):
         return f"<Email {self.subject}>"
+
+
+class EmailBody(db.Model):
+    __tablename__ = 'email_bodies'
+
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), primary_key=True, autoincrement=False)
+    codec = db.Column(db.String(10), nullable=False)  # see body_codec.py
+    content = db.Column(db.LargeBinary, nullable=False)
+
+    @property
+    def text(self):
+        # Cached against the content it came from, so a reload is decoded again.
+        cached = self.__dict__.get('_decoded')
+        if cached is None or cached[0] is not self.content:
+            cached = self._decoded = (self.content, decode_body(self.codec, self.content))
+        return cached[1]
+
+    @text.setter
+    def text(self, value):
+        self.codec, self.content = encode_body(value)
+        self._decoded = (self.content, value or '')
+
+    def __repr__(self):
+        return f"<EmailBody {self.email_id} ({self.codec}, {len(self.content or b'')} bytes)>"
+
+
+class EmailSearch(db.Model):
+    # Plain-text subject and body for the MySQL and LIKE search backends;
+    # SQLite keeps its copy in the FTS5 table instead.
+    __tablename__ = 'email_search'
+    __table_args__ = (
+        db.Index('ft_email_search_body', 'body', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        db.Index('ft_email_search_subject_body', 'subject', 'body', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+
+    email_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f"<EmailSearch {self.email_id}>"
     
 
 class Folder(db.Model):
     __tablename__ = 'folders'
+    __table_args__ = (
+        db.Index('ix_folders_user_name', 'user_id', 'folder_name'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     folder_name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
-    email_folders = db.relationship('EmailFolder', backref='folder_email', lazy='joined', cascade='all, delete-orphan')
+    email_folders = db.relationship('EmailFolder', backref='folder_email', cascade='all, delete-orphan')
+    stats = db.relationship(
+        'FolderStat', primaryjoin='Folder.id == foreign(FolderStat.folder_id)', uselist=False, viewonly=True
+    )
 
     def __repr__(self):
         return f"<Folder {self.folder_name}>"
@@ -97,12 +159,16 @@ class Folder(db.Model):
 
 class EmailFolder(db.Model):
     __tablename__ = 'email_folders'
+    __table_args__ = (
+        db.UniqueConstraint('email_id', 'folder_id', name='uq_email_folders_email_folder'),
+        db.Index('ix_email_folders_folder_id', 'folder_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False)
     folder_id = db.Column(db.Integer, db.ForeignKey('folders.id'), nullable=False)
 
-    email = db.relationship('Email', back_populates='email_folders', lazy='joined')
-    folder = db.relationship('Folder', back_populates='email_folders', lazy='joined')
+    email = db.relationship('Email', back_populates='email_folders')
+    folder = db.relationship('Folder', back_populates='email_folders')
 
     def __repr__(self):
         return f"<EmailFolder Email ID: {self.email_id}, Folder ID: {self.folder_id}>"
@@ -110,6 +176,11 @@ class EmailFolder(db.Model):
 
 class Recipient(db.Model):
     __tablename__ = 'recipients'
+    __table_args__ = (
+        db.UniqueConstraint('recipient_type_id', 'email_id', 'user_id', name='uq_recipients_type_email_user'),
+        db.Index('ix_recipients_user_id', 'user_id'),
+        db.Index('ix_recipients_email_id', 'email_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -117,8 +188,8 @@ class Recipient(db.Model):
     recipient_type_id = db.Column(db.Integer, db.ForeignKey('recipient_types.id'), nullable=True)  
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
-    recipient_type = db.relationship('RecipientType', back_populates='recipients', lazy='joined', uselist=False)
-    user = db.relationship('User', foreign_keys=[user_id], backref='received_emails', lazy='joined')
+    recipient_type = db.relationship('RecipientType', back_populates='recipients', uselist=False)
+    user = db.relationship('User', foreign_keys=[user_id], backref='received_emails')
 
     def __repr__(self):
         return f"<Recipient Email ID: {self.email_id}, User ID: {self.user_id}>"
@@ -134,7 +205,7 @@ class RecipientType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
 
-    recipients = db.relationship('Recipient', back_populates='recipient_type', lazy='joined')
+    recipients = db.relationship('Recipient', back_populates='recipient_type')
 
     def __repr__(self):
         return f"<RecipientType {self.name}>"
@@ -142,12 +213,116 @@ class RecipientType(db.Model):
 
 class Attachment(db.Model):
     __tablename__ = 'attachments'
+    __table_args__ = (
+        db.Index('ix_attachments_email_id', 'email_id'),
+        db.Index('ix_attachments_file_size', 'file_size'),
+        db.Index('ix_attachments_content_hash', 'content_hash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     file_name = db.Column(db.String(255), nullable=False)
     file_type = db.Column(db.String(50), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False)
+    # SHA-256 of the bytes in the blob store; NULL for rows created before
+    # attachments had content.
+    content_hash = db.Column(db.String(64), nullable=True)
 
     def __repr__(self):
         return f"<Attachment {self.file_name} ({self.file_type}, {self.file_size} bytes)>"
+
+
+# Trigrams are folded before they are stored (see trigram.fold). Binary on
+# MySQL, as in Emails.session.sql: the default collation folds case and
+# accents further, so distinct trigrams could collide on a primary key.
+_TRIGRAM = db.String(3).with_variant(mysql.VARCHAR(3, charset='utf8mb4', collation='utf8mb4_bin'), 'mysql')
+
+
+class SearchTrigram(db.Model):
+    __tablename__ = 'search_trigrams'
+    __table_args__ = (
+        db.Index('ix_search_trigrams_row', 'row_id', 'field'),
+    )
+
+    field = db.Column(db.String(40), primary_key=True)
+    trigram = db.Column(_TRIGRAM, primary_key=True)
+    row_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return f"<SearchTrigram {self.field} {self.trigram!r} -> {self.row_id}>"
+
+
+class SearchTrigramStat(db.Model):
+    __tablename__ = 'search_trigram_stats'
+
+    field = db.Column(db.String(40), primary_key=True)
+    trigram = db.Column(_TRIGRAM, primary_key=True)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SearchTrigramStat {self.field} {self.trigram!r}: {self.row_count}>"
+
+
+class TableStat(db.Model):
+    __tablename__ = 'table_stats'
+
+    name = db.Column(db.String(100), primary_key=True)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TableStat {self.name}={self.row_count}>"
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TableVersion {self.name}={self.version}>"
+
+
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+
+    # sha256 of the source path, which may be longer than an indexable key.
+    source_key = db.Column(db.String(64), primary_key=True)
+    source = db.Column(db.String(1024), nullable=False)
+    position = db.Column(db.String(1024), nullable=False)
+    imported = db.Column(db.BigInteger, nullable=False, default=0)
+    skipped = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<ImportCheckpoint {self.source} at {self.position}>"
+
+
+class MailboxEntry(db.Model):
+    __tablename__ = 'mailbox_entries'
+    __table_args__ = (
+        # Covering index for a mailbox page: the range scan reads no table rows.
+        db.Index('ix_mailbox_entries_page', 'user_id', 'mailbox', 'sent_at', 'email_id', 'flags'),
+        db.Index('ix_mailbox_entries_email_id', 'email_id'),
+    )
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    mailbox = db.Column(db.String(10), primary_key=True)  # 'inbox' or 'sent'
+    email_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sent_at = db.Column(db.DateTime, nullable=False)
+    flags = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<MailboxEntry {self.mailbox} of user {self.user_id}: email {self.email_id}>"
+
+
+class FolderStat(db.Model):
+    __tablename__ = 'folder_stats'
+
+    folder_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    email_count = db.Column(db.Integer, nullable=False, default=0)
+    attachment_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    newest_sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<FolderStat {self.folder_id}: {self.email_count} emails>"
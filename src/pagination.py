@@ -0,0 +1,121 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class Page:
+    """One page of a keyset-paginated query plus the cursors around it."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def get_page_size():
+    """Read the page size from ?per_page=, clamped to the configured limits."""
+    default = current_app.config.get('LIST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = current_app.config.get('LIST_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+def encode_cursor(direction, values):
+    payload = [direction, [v.isoformat() if isinstance(v, datetime) else v for v in values]]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Return (direction, values) for a cursor, or (None, None) if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(raw)
+        if direction not in ('next', 'prev') or len(values) != len(columns):
+            return None, None
+        decoded = []
+        for column, value in zip(columns, values):
+            if value is not None and column.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            decoded.append(value)
+        return direction, decoded
+    except (ValueError, TypeError, NotImplementedError):
+        return None, None
+
+
+def _row_key(item, columns):
+    if hasattr(item, '_mapping'):
+        return [item._mapping[column] for column in columns]
+    return [getattr(item, column.key) for column in columns]
+
+
+def _after(columns, values, descending):
+    """Build the row-value comparison `(a, b) < (x, y)` as portable AND/OR terms."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, *columns, cursor=None, per_page=None, descending=True):
+    """Fetch one page of `query` ordered by `columns`, starting after `cursor`.
+
+    The last column must be unique (normally the primary key) so that the
+    ordering is total. Only `per_page + 1` rows are ever read, so the cost
+    of a page does not depend on how deep into the table it is.
+    """
+    per_page = per_page or get_page_size()
+    direction, values = decode_cursor(cursor, columns) if cursor else (None, None)
+
+    # Walking backwards flips both the comparison and the sort, then the
+    # fetched rows are reversed into display order.
+    backwards = direction == 'prev'
+    scan_descending = descending != backwards
+    if values is not None:
+        query = query.filter(_after(columns, values, scan_descending))
+    order = [c.desc() if scan_descending else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor('next', _row_key(rows[-1], columns))
+        if values is not None and (has_more or not backwards):
+            prev_cursor = encode_cursor('prev', _row_key(rows[0], columns))
+    return Page(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def paginate_request(query, *columns, descending=True):
+    """Paginate `query` using the ?cursor= and ?per_page= request arguments."""
+    return keyset_paginate(query, *columns, cursor=request.args.get('cursor'), descending=descending)
@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Password hashing off the request thread.
+#
+# The KDF is deliberately slow, so running it inline lets a burst of logins
+# pin every worker thread. Hashes are computed in a small process pool
+# instead; a semaphore bounds how many may be queued so an overload turns
+# into a fast PasswordServiceBusy rather than an ever-growing backlog.
+
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+DEFAULT_SALT_LENGTH = 16
+
+
+class PasswordServiceBusy(RuntimeError):
+    """Raised when no hashing slot frees up within the queue timeout."""
+
+
+def parse_method(method):
+    """Split a werkzeug method string into (algorithm, params) with defaults filled in."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return name, (hash_name, iterations)
+    if name == 'scrypt':
+        return name, tuple(int(arg) for arg in args) if args else (2 ** 15, 8, 1)
+    return name, tuple(args)
+
+
+def _is_weaker(stored, policy):
+    """True if `stored` params are a weaker setting of the same algorithm than `policy`."""
+    stored_name, stored_params = stored
+    policy_name, policy_params = policy
+    if stored_name != policy_name:
+        return True
+    if stored_name == 'pbkdf2':
+        return stored_params[0] != policy_params[0] or stored_params[1] < policy_params[1]
+    if stored_name == 'scrypt':
+        return any(have < want for have, want in zip(stored_params, policy_params))
+    return stored_params != policy_params
+
+
+class PasswordService:
+    """Hashes and checks passwords in a bounded process pool.
+
+    `workers=0` runs everything inline, which is what the CLI and one-off
+    scripts want.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=DEFAULT_SALT_LENGTH,
+                 workers=2, queue_size=8, queue_timeout=5.0):
+        parse_method(method)  # fail at startup on a malformed policy
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            # A pool inherited through fork belongs to the parent; start our own.
+            if self._executor is None or self._executor_pid != os.getpid():
+                # spawn, not fork: the web process has threads and open
+                # database connections that children must not inherit.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordServiceBusy("Too many password checks in progress.")
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, stored_hash, password):
+        if not stored_hash:
+            return False
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True if `stored_hash` was made with a weaker method or shorter salt than the policy."""
+        try:
+            method, salt, _ = stored_hash.split('$', 2)
+        except ValueError:
+            return True
+        return _is_weaker(parse_method(method), parse_method(self.method)) or len(salt) < self.salt_length
+
+    def warm_up(self):
+        """Start the hashing processes now rather than on the first login."""
+        if self.workers:
+            executor = self._get_executor()
+            for future in [executor.submit(int) for _ in range(self.workers)]:
+                future.result()
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                if self._executor_pid == os.getpid():
+                    self._executor.shutdown()
+                self._executor = None
+
+
+_service = PasswordService(workers=0)
+
+
+def init_passwords(app):
+    """Replace the inline default service with one configured from `app.config`."""
+    global _service
+    _service.shutdown()
+    _service = PasswordService(
+        method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        salt_length=app.config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        queue_size=app.config.get('PASSWORD_HASH_QUEUE', 8),
+        queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5.0),
+    )
+
+
+def hash_password(password):
+    return _service.hash(password)
+
+
+def verify_password(stored_hash, password):
+    return _service.verify(stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    return _service.needs_rehash(stored_hash)
+
+
+def warm_up_passwords():
+    _service.warm_up()
@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+
+from flask import request, session
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+
+# Rate limiting shared by every worker process.
+#
+# Flask-Limiter keeps its counters in the storage named by
+# RATELIMIT_STORAGE_URI. Use redis:// when there is more than one host; for
+# a single host, sqlite:///path/to/ratelimit.db (same path convention as
+# SQLAlchemy) keeps the counters in a WAL-mode SQLite file that all
+# processes share. Only the auth endpoints carry limits, so other routes
+# never touch the storage.
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """limits storage backed by a local SQLite file."""
+
+    STORAGE_SCHEME = ['sqlite']
+    PURGE_INTERVAL = 60  # seconds between sweeps of expired counters
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        self.path = uri[len('sqlite:///'):] or ':memory:'
+        self.timeout = float(options.get('timeout', 5))
+        self._local = threading.local()
+        self._last_purge = 0.0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        with self._transaction() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS ratelimit_counters ("
+                " key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # A forked worker must not share its parent's SQLite handle.
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    class _Transaction:
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __enter__(self):
+            # IMMEDIATE takes the write lock up front, so read-then-write
+            # sequences are atomic across processes.
+            self.connection.execute("BEGIN IMMEDIATE")
+            return self.connection.cursor()
+
+        def __exit__(self, exc_type, exc, tb):
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _transaction(self):
+        return self._Transaction(self._connection())
+
+    def _get(self, cursor, key, now):
+        row = cursor.execute(
+            "SELECT value FROM ratelimit_counters WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _incr(self, cursor, key, expiry, amount, now):
+        cursor.execute(
+            "INSERT INTO ratelimit_counters (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            " value = CASE WHEN expires_at > ? THEN value + excluded.value ELSE excluded.value END,"
+            " expires_at = CASE WHEN expires_at > ? THEN expires_at ELSE excluded.expires_at END",
+            (key, amount, now + expiry, now, now),
+        )
+        if now - self._last_purge > self.PURGE_INTERVAL:
+            self._last_purge = now
+            cursor.execute("DELETE FROM ratelimit_counters WHERE expires_at <= ?", (now,))
+        return self._get(cursor, key, now)
+
+    def incr(self, key, expiry, amount=1):
+        with self._transaction() as cursor:
+            return self._incr(cursor, key, expiry, amount, time.time())
+
+    def get(self, key):
+        return self._get(self._connection().cursor(), key, time.time())
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM ratelimit_counters WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def clear(self, key):
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM ratelimit_counters WHERE key = ?", (key,))
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as cursor:
+            return cursor.execute("DELETE FROM ratelimit_counters").rowcount
+
+    def _window(self, cursor, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._get(cursor, previous_key, now)
+        current_count = self._get(cursor, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as cursor:
+            previous_count, previous_ttl, current_count, _ = self._window(cursor, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            _, current_key = self.sliding_window_keys(key, expiry, now)
+            self._incr(cursor, current_key, 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        with self._transaction() as cursor:
+            return self._window(cursor, key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        with self._transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM ratelimit_counters WHERE key IN (?, ?)",
+                self.sliding_window_keys(key, expiry, time.time()),
+            )
+
+
+def account_key():
+    """Rate-limit key for the account a request is acting on, falling back to the client IP."""
+    account = (request.form.get('email') or '').strip().lower()
+    if not account and 'mfa_user_id' in session:
+        account = f"user:{session['mfa_user_id']}"
+    return f"account:{account}" if account else f"ip:{get_remote_address()}"
+
+
+limiter = Limiter(key_func=get_remote_address)
@@ -0,0 +1,204 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_app_context, make_response, request, session
+from flask.globals import request_ctx
+from flask_login import current_user
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.sql.util import find_tables
+
+from db_conn import db, RoutingSession
+from models import TableVersion
+
+# Read-through cache for the search pages.
+#
+# Every data table has a version in `table_versions` that is bumped in the
+# same transaction as any write to it, so all worker processes see the
+# change together. A cached page remembers the versions of the tables its
+# queries touched (tracked automatically while the view runs) and is only
+# served while those are unchanged. The pages themselves are cached per
+# process, in an LRU bounded by RESULT_CACHE_MAX_BYTES.
+#
+# Bookkeeping writes to columns no cached page renders (login failure
+# counters, password hashes) pass execution_options(skip_version_bump=True),
+# so they neither contend on the shared version row nor invalidate pages.
+# The `users` version also keeps the session user cache current, so locking
+# an account still bumps it (see lockout).
+
+VERSIONED_TABLES = frozenset(
+    {'users', 'emails', 'email_bodies', 'folders', 'email_folders', 'recipients', 'recipient_types', 'attachments',
+     'folder_stats'}
+)
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+_versions = TableVersion.__table__
+
+
+def bump_versions(connection, tables):
+    """Increment the version of each versioned table in `tables`."""
+    names = sorted(VERSIONED_TABLES.intersection(tables))
+    if not names:
+        return
+    result = connection.execute(
+        update(_versions).where(_versions.c.name.in_(names)).values(version=_versions.c.version + 1)
+    )
+    if result.rowcount < len(names):
+        known = set(connection.scalars(select(_versions.c.name).where(_versions.c.name.in_(names))))
+        missing = [{'name': name, 'version': 1} for name in names if name not in known]
+        if missing:
+            connection.execute(insert(_versions), missing)
+
+
+def current_versions():
+    """Table versions as seen by the session's bind.
+
+    Inside `replica_reads` that is the replica the view's own queries will
+    use (RoutingSession keeps one per session), so a page is never stored
+    under versions newer than the data it was built from.
+    """
+    return dict(db.session.execute(select(_versions.c.name, _versions.c.version)).all())
+
+
+def _written_tables(session):
+    tables = set()
+    for obj in session.new | session.deleted:
+        tables.add(db.inspect(obj).mapper.local_table.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tables.add(db.inspect(obj).mapper.local_table.name)
+    return tables
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _bump_flushed(session, flush_context):
+    bump_versions(session.connection(), _written_tables(session))
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _track_statement(orm_execute_state):
+    statement = orm_execute_state.statement
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        # ORM-enabled bulk statements skip the flush.
+        if orm_execute_state.execution_options.get('skip_version_bump'):
+            return
+        bump_versions(orm_execute_state.session.connection(), {statement.table.name})
+    elif orm_execute_state.is_select and has_app_context() and '_result_cache_tables' in g:
+        tables = find_tables(statement, check_columns=True, include_joins=True, include_aliases=True)
+        # Label-only columns (e.g. in the trigram subquery) come back as None.
+        g._result_cache_tables.update(table.name for table in tables if table is not None)
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stale = self.bypassed = self.evictions = 0
+
+    def note_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, mimetype, dependencies, size = entry
+            if any(versions.get(table, 0) != version for table, version in dependencies.items()):
+                self._discard(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, mimetype
+
+    def put(self, key, body, mimetype, dependencies):
+        size = len(body) + len(repr(key))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (body, mimetype, dependencies, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'bypassed': self.bypassed,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
+
+
+def _cache_key():
+    params = tuple(sorted((name, value.strip()) for name, value in request.values.items(multi=True)))
+    user_id = current_user.get_id() if current_user.is_authenticated else None
+    return request.endpoint, tuple(sorted(request.view_args.items())), request.method, params, user_id
+
+
+def cached_result(view):
+    """Serve repeated identical searches from `result_cache`.
+
+    Pages that show flashed messages are neither cached nor served from
+    the cache, since the messages belong to one request. Apply it below
+    `replica_reads`, so the versions come from the same replica as the page.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if not current_app.config.get('RESULT_CACHE_ENABLED', True) or session.get('_flashes'):
+            result_cache.note_bypass()
+            return view(*args, **kwargs)
+
+        result_cache.max_bytes = current_app.config.get('RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        key = _cache_key()
+        # Read before the view runs and on the same bind: a replica that
+        # catches up meanwhile makes the page newer than its versions, which
+        # only costs a miss, never a stale hit.
+        versions = current_versions()
+        cached = result_cache.get(key, versions)
+        if cached is not None:
+            body, mimetype = cached
+            return current_app.response_class(body, mimetype=mimetype)
+
+        g._result_cache_tables = set()
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            touched = g.pop('_result_cache_tables')
+
+        flashed = getattr(request_ctx, 'flashes', None) or session.get('_flashes')
+        if response.status_code == 200 and not response.direct_passthrough and not flashed:
+            dependencies = {table: versions.get(table, 0) for table in touched & VERSIONED_TABLES}
+            result_cache.put(key, response.get_data(), response.mimetype, dependencies)
+        return response
+    return decorated_view
@@ -0,0 +1,296 @@
+import re
+
+from flask import current_app
+from sqlalchemy import DDL, Integer, and_, delete, event, insert, inspect, or_, select, text
+from sqlalchemy.dialects.mysql import match
+
+from db_conn import db
+from models import Email, EmailBody, EmailSearch
+from body_codec import stored_text
+
+# Full-text search over email subjects and bodies.
+#
+# Bodies are stored compressed (see body_codec.py), so every backend
+# searches a plain-text copy kept in step with `emails` by the ORM events
+# below. The backend follows the database in use: MySQL answers from the
+# FULLTEXT indexes on `email_search`, SQLite from an FTS5 table. Any other
+# engine falls back to LIKE over `email_search`.
+
+SEARCH_FIELDS = ('subject', 'body')
+REBUILD_BATCH_SIZE = 1000
+
+_search = EmailSearch.__table__
+
+_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+_WORD_RE = re.compile(r'\w+')
+
+
+def parse_query(raw):
+    """Split a search string into terms, each a list of words.
+
+    Quoted text is kept together as a phrase; punctuation is dropped so
+    user input can never reach the engine's own query syntax.
+    """
+    terms = []
+    for phrase, word in _TERM_RE.findall(raw or ''):
+        words = _WORD_RE.findall(phrase or word)
+        if words:
+            terms.append(words)
+    return terms
+
+
+class SearchPage:
+    """Email ids for one page of ranked results."""
+
+    def __init__(self, ids, page, per_page, has_next):
+        self.ids = ids
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+
+def email_texts(connection, email_ids=None, batch_size=REBUILD_BATCH_SIZE):
+    """Yield batches of {'id', 'subject', 'body'} with the plain body text, in id order."""
+    last_id = 0
+    while True:
+        statement = (
+            select(Email.id, Email.subject, Email.legacy_body.label('legacy_body'), EmailBody.codec, EmailBody.content)
+            .outerjoin(EmailBody, EmailBody.email_id == Email.id)
+            .where(Email.id > last_id)
+            .order_by(Email.id)
+            .limit(batch_size)
+        )
+        if email_ids is not None:
+            statement = statement.where(Email.id.in_(email_ids))
+        rows = connection.execute(statement).all()
+        if not rows:
+            return
+        yield [
+            {'id': row.id, 'subject': row.subject, 'body': stored_text(row.codec, row.content, row.legacy_body)}
+            for row in rows
+        ]
+        last_id = rows[-1].id
+
+
+class MirrorTableBackend:
+    """Keeps the plain-text copy in `email_search` in step with the emails."""
+
+    def index(self, connection, email_id, subject, body):
+        self.remove(connection, email_id)
+        connection.execute(insert(_search).values(email_id=email_id, subject=subject, body=body or ''))
+
+    def index_new(self, connection, rows):
+        """Index emails inserted outside the ORM; `rows` are dicts of id, subject, body."""
+        if rows:
+            connection.execute(insert(_search), [
+                {'email_id': row['id'], 'subject': row['subject'], 'body': row['body'] or ''} for row in rows
+            ])
+
+    def remove(self, connection, email_id):
+        connection.execute(delete(_search).where(_search.c.email_id == email_id))
+
+    def rebuild(self):
+        connection = db.session.connection()
+        # Missing if the database's own backend was in use until now.
+        _search.create(bind=connection, checkfirst=True)
+        connection.execute(delete(_search))
+        for rows in email_texts(connection):
+            self.index_new(connection, rows)
+        db.session.commit()
+
+
+class MySQLFullTextBackend(MirrorTableBackend):
+    """MATCH ... AGAINST in boolean mode; InnoDB maintains the index itself."""
+
+    def _score(self, terms, fields):
+        against = ' '.join(
+            '+"{}"'.format(' '.join(words)) if len(words) > 1 else f'+{words[0]}'
+            for words in terms
+        )
+        return match(*[getattr(EmailSearch, field) for field in fields], against=against).in_boolean_mode()
+
+    def search(self, terms, fields, offset, limit):
+        score = self._score(terms, fields)
+        rows = (
+            db.session.query(EmailSearch.email_id)
+            .filter(score > 0)
+            .order_by(score.desc(), EmailSearch.email_id.desc())
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
+        return [row.email_id for row in rows]
+
+    def matches(self, terms, fields):
+        return Email.id.in_(select(EmailSearch.email_id).where(self._score(terms, fields) > 0))
+
+
+class SQLiteFTSBackend:
+    """FTS5 table `emails_fts` keyed by email id, ranked with bm25."""
+
+    def _query(self, terms, fields):
+        expression = ' '.join('"{}"'.format(' '.join(words)) for words in terms)
+        return '{%s} : (%s)' % (' '.join(fields), expression)
+
+    def search(self, terms, fields, offset, limit):
+        query = self._query(terms, fields)
+        rows = db.session.execute(
+            text(
+                "SELECT rowid FROM emails_fts WHERE emails_fts MATCH :query "
+                "ORDER BY bm25(emails_fts), rowid DESC LIMIT :limit OFFSET :offset"
+            ),
+            {'query': query, 'limit': limit, 'offset': offset},
+        )
+        return [row[0] for row in rows]
+
+    def matches(self, terms, fields):
+        ids = text("SELECT rowid FROM emails_fts WHERE emails_fts MATCH :query").bindparams(
+            query=self._query(terms, fields)
+        ).columns(rowid=Integer)
+        return Email.id.in_(ids)
+
+    def index(self, connection, email_id, subject, body):
+        self.remove(connection, email_id)
+        connection.execute(
+            text("INSERT INTO emails_fts (rowid, subject, body) VALUES (:id, :subject, :body)"),
+            {'id': email_id, 'subject': subject, 'body': body},
+        )
+
+    def index_new(self, connection, rows):
+        """Index emails inserted outside the ORM; `rows` are dicts of id, subject, body."""
+        if rows:
+            connection.execute(
+                text("INSERT INTO emails_fts (rowid, subject, body) VALUES (:id, :subject, :body)"), rows
+            )
+
+    def remove(self, connection, email_id):
+        connection.execute(text("DELETE FROM emails_fts WHERE rowid = :id"), {'id': email_id})
+
+    def rebuild(self):
+        connection = db.session.connection()
+        connection.execute(text("DELETE FROM emails_fts"))
+        for rows in email_texts(connection):
+            self.index_new(connection, rows)
+        db.session.commit()
+
+
+class LikeBackend(MirrorTableBackend):
+    """Unindexed fallback for engines without a full-text index."""
+
+    def _condition(self, terms, fields):
+        return and_(*[
+            or_(*[getattr(EmailSearch, field).like(f"%{' '.join(words)}%") for field in fields])
+            for words in terms
+        ])
+
+    def matches(self, terms, fields):
+        return Email.id.in_(select(EmailSearch.email_id).where(self._condition(terms, fields)))
+
+    def search(self, terms, fields, offset, limit):
+        rows = (
+            db.session.query(EmailSearch.email_id)
+            .filter(self._condition(terms, fields))
+            .order_by(EmailSearch.email_id.desc())
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
+        return [row.email_id for row in rows]
+
+
+BACKENDS = {
+    'mysql': MySQLFullTextBackend(),
+    'sqlite': SQLiteFTSBackend(),
+    'like': LikeBackend(),
+}
+
+
+def get_backend():
+    """Pick the backend named by SEARCH_BACKEND, else the one for the database.
+
+    Searches, rebuilds and the write hooks all go through here, so they
+    always agree on which index is current. After changing SEARCH_BACKEND,
+    run rebuild-search-index to fill the new backend's index.
+    """
+    name = current_app.config.get('SEARCH_BACKEND') or db.engine.dialect.name
+    return BACKENDS.get(name, BACKENDS['like'])
+
+
+def search_emails(raw, fields=SEARCH_FIELDS, page=1, per_page=20):
+    """Return a `SearchPage` of email ids matching `raw`, best match first."""
+    terms = parse_query(raw)
+    page = max(page, 1)
+    if not terms:
+        return SearchPage([], page, per_page, False)
+
+    ids = get_backend().search(terms, fields, (page - 1) * per_page, per_page + 1)
+    return SearchPage(ids[:per_page], page, per_page, len(ids) > per_page)
+
+
+def search_condition(raw, fields=SEARCH_FIELDS):
+    """A WHERE clause on `Email` for every match of `raw`, or None if `raw` has no terms."""
+    terms = parse_query(raw)
+    return get_backend().matches(terms, fields) if terms else None
+
+
+def in_rank_order(rows, ids, key=lambda row: row.id):
+    """Reorder rows fetched with `id IN (...)` back into `ids` order."""
+    position = {email_id: i for i, email_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[key(row)])
+
+
+def rebuild_search_index():
+    """Re-index every email, e.g. after restoring a backup."""
+    get_backend().rebuild()
+
+
+event.listen(
+    Email.__table__, 'after_create',
+    DDL("CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(subject, body)").execute_if(dialect='sqlite'),
+)
+event.listen(
+    Email.__table__, 'before_drop',
+    DDL("DROP TABLE IF EXISTS emails_fts").execute_if(dialect='sqlite'),
+)
+
+
+def _reindex(connection, email_id, subject=None, body=None):
+    # Whatever the flush did not hand us is read back from the database.
+    if subject is None or body is None:
+        stored = next(email_texts(connection, email_ids=[email_id]), None)
+        if not stored:
+            return
+        subject = stored[0]['subject'] if subject is None else subject
+        body = stored[0]['body'] if body is None else body
+    get_backend().index(connection, email_id, subject, body)
+
+
+def _on_insert(mapper, connection, target):
+    # An email with a body is indexed when its email_bodies row is inserted.
+    if target.stored_body is None:
+        _reindex(connection, target.id, target.subject, '')
+
+
+def _on_update(mapper, connection, target):
+    if inspect(target).attrs.subject.history.has_changes():
+        _reindex(connection, target.id, subject=target.subject)
+
+
+def _on_delete(mapper, connection, target):
+    get_backend().remove(connection, target.id)
+
+
+def _on_body_write(mapper, connection, target):
+    if inspect(target).attrs.content.history.has_changes():
+        _reindex(connection, target.email_id, body=target.text)
+
+
+event.listen(Email, 'after_insert', _on_insert)
+event.listen(Email, 'after_update', _on_update)
+event.listen(Email, 'after_delete', _on_delete)
+event.listen(EmailBody, 'after_insert', _on_body_write)
+event.listen(EmailBody, 'after_update', _on_body_write)
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from db_conn import db, on_primary
+from models import User, TableVersion
+from lockout import locked_until
+
+DEFAULT_TTL = 60  # seconds
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_VERSION_INTERVAL = 1  # seconds
+
+# user id -> (expires at, users version, SessionUser), least recently used
+# first.
+#
+# Every write to `users` bumps its row in `table_versions` (see
+# result_cache), so each worker re-reads that version at most every
+# USER_CACHE_VERSION_INTERVAL seconds and drops entries cached under an
+# older one. A user changed through any worker is then reloaded everywhere
+# within that interval rather than when USER_CACHE_TTL runs out.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_users_version = None
+_version_checked = None
+
+
+class SessionUser:
+    """The logged-in user as seen by Flask-Login on every request.
+
+    Holds just enough to authorize a request. Views that need the rest of
+    the account load the `User` row themselves.
+    """
+
+    __slots__ = ('id', 'is_admin', 'is_banned', 'locked_until')
+
+    def __init__(self, id, is_admin=False, is_banned=False, locked_until=None):
+        self.id = id
+        self.is_admin = bool(is_admin)
+        self.is_banned = bool(is_banned)
+        self.locked_until = locked_until
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def is_admin_user(self):
+        return self.is_admin
+
+    def is_regular_user(self):
+        return not self.is_admin
+
+    def is_locked(self):
+        return self.locked_until is not None and datetime.now() < self.locked_until
+
+    def __repr__(self):
+        return f"<SessionUser {self.id}>"
+
+
+def _fetch(user_id):
+    # Authorization must not depend on replica lag.
+    with on_primary():
+        row = (
+            db.session.query(User.id, User.is_admin, User.is_banned, User.failed_login_attempts, User.lock_time)
+            .filter(User.id == user_id)
+            .first()
+        )
+    if row is None:
+        return None
+
+    return SessionUser(
+        row.id, row.is_admin, row.is_banned, locked_until(row.failed_login_attempts, row.lock_time)
+    )
+
+
+def _check_users_version(now):
+    """Re-read the `users` table version if it is due; returns the latest one seen."""
+    global _users_version, _version_checked
+    interval = current_app.config.get('USER_CACHE_VERSION_INTERVAL', DEFAULT_VERSION_INTERVAL)
+    with _cache_lock:
+        if _version_checked is not None and now - _version_checked < interval:
+            return _users_version
+        _version_checked = now
+    with on_primary():
+        version = db.session.execute(
+            select(TableVersion.version).where(TableVersion.name == User.__tablename__)
+        ).scalar()
+    with _cache_lock:
+        if version != _users_version:
+            _cache.clear()
+            _users_version = version
+    return version
+
+
+def load_session_user(user_id):
+    """Return the cached `SessionUser` for `user_id`, querying on a miss."""
+    now = time.monotonic()
+    version = _check_users_version(now)
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is not None:
+            if entry[0] > now and entry[1] == version:
+                _cache.move_to_end(user_id)
+                return entry[2]
+            del _cache[user_id]
+
+    # Read after the version, so the row is at least as new as what it is cached under.
+    principal = _fetch(user_id)
+    if principal is not None:
+        ttl = current_app.config.get('USER_CACHE_TTL', DEFAULT_TTL)
+        max_size = current_app.config.get('USER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        with _cache_lock:
+            _cache[user_id] = (now + ttl, version, principal)
+            _cache.move_to_end(user_id)
+            # Evict past the size limit, and any expired entries at the cold end.
+            while _cache and (len(_cache) > max_size or next(iter(_cache.values()))[0] <= now):
+                _cache.popitem(last=False)
+    return principal
+
+
+def invalidate_session_user(user_id):
+    """Drop `user_id` from this process's cache after its row changed.
+
+    Other processes notice the change through the `users` table version.
+    """
+    with _cache_lock:
+        _cache.pop(int(user_id), None)
@@ -0,0 +1,198 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request SQL accounting.
+#
+# Engine events time every statement a request runs and group them by
+# fingerprint (the SQL with parameters and IN lists collapsed), so one
+# statement repeated per row - the N+1 pattern - stands out. Rows read are
+# counted as the driver hands them over, whatever the ORM then builds from
+# them; rows written are the driver's rowcount for INSERT/UPDATE/DELETE. Each
+# response gets a Server-Timing header; requests over budget are logged; and
+# with SQL_STATS_PAGE on, per-endpoint totals are kept for /admin/sql-stats.
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """The statement with literals and parameter lists collapsed."""
+    statement = _LITERAL.sub('?', statement)
+    statement = _IN_LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+class RequestStats:
+    __slots__ = ('statements', 'db_time', 'rows_read', 'rows_written', 'fingerprints')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.fingerprints = Counter()
+
+    def most_repeated(self):
+        if not self.fingerprints:
+            return 0, None
+        statement, count = self.fingerprints.most_common(1)[0]
+        return count, statement
+
+
+class _CountingCursor:
+    """DB-API cursor that adds the rows fetched through it to `stats.rows_read`."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows_read += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows_read += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows_read += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _current():
+    if has_request_context():
+        return g.get('_sql_stats')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault('_sql_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current()
+    started = conn.info.get('_sql_started')
+    if stats is None or not started:
+        return
+    stats.db_time += time.perf_counter() - started.pop()
+    stats.statements += 1
+    stats.fingerprints[fingerprint(statement)] += 1
+    if context is None:
+        return
+    if context.isinsert or context.isupdate or context.isdelete:
+        stats.rows_written += max(cursor.rowcount, 0)
+    else:
+        # The result is built from context.cursor after this event, so its
+        # fetches go through the wrapper.
+        context.cursor = _CountingCursor(cursor, stats)
+
+
+class EndpointStats:
+    """Running per-endpoint totals for the admin page."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, stats, repeated):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                'endpoint': endpoint, 'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_ms': 0.0, 'max_db_ms': 0.0, 'rows_read': 0, 'rows_written': 0, 'n_plus_one': 0,
+                'worst_repeat': 0, 'worst_statement': None,
+            })
+            db_ms = stats.db_time * 1000
+            count, statement = stats.most_repeated()
+            entry['requests'] += 1
+            entry['queries'] += stats.statements
+            entry['max_queries'] = max(entry['max_queries'], stats.statements)
+            entry['db_ms'] += db_ms
+            entry['max_db_ms'] = max(entry['max_db_ms'], db_ms)
+            entry['rows_read'] += stats.rows_read
+            entry['rows_written'] += stats.rows_written
+            if repeated:
+                entry['n_plus_one'] += 1
+            if count > entry['worst_repeat']:
+                entry['worst_repeat'], entry['worst_statement'] = count, statement
+
+    def worst(self, sort='db_ms', limit=50):
+        with self._lock:
+            rows = [dict(entry) for entry in self._endpoints.values()]
+        for row in rows:
+            row['avg_queries'] = round(row['queries'] / row['requests'], 1)
+            row['avg_db_ms'] = round(row['db_ms'] / row['requests'], 2)
+            row['db_ms'] = round(row['db_ms'], 2)
+            row['max_db_ms'] = round(row['max_db_ms'], 2)
+        return sorted(rows, key=lambda row: row.get(sort) or 0, reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def _start_request():
+    g._sql_stats = RequestStats()
+    g._request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.pop('_sql_stats', None)
+    if stats is None:
+        return response
+    config = current_app.config
+    total_ms = (time.perf_counter() - g.pop('_request_started')) * 1000
+    db_ms = stats.db_time * 1000
+    repeat_count, repeat_statement = stats.most_repeated()
+    repeated = repeat_count >= config.get('SQL_REPEAT_THRESHOLD', 10)
+
+    if config.get('SQL_SERVER_TIMING', True):
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.1f};desc="{stats.statements} queries, '
+            f'{stats.rows_read} rows read, {stats.rows_written} rows written"',
+        )
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+
+    over_budget = (
+        stats.statements > config.get('SQL_QUERY_BUDGET', 50)
+        or db_ms > config.get('SQL_TIME_BUDGET_MS', 250)
+    )
+    if over_budget or repeated:
+        logger.warning(
+            "%s %s: %d queries, %.1f ms in the database, %d rows read, %d written%s",
+            request.method, request.path, stats.statements, db_ms, stats.rows_read, stats.rows_written,
+            f"; repeated {repeat_count}x: {repeat_statement[:200]}" if repeated else "",
+            extra={'event': 'sql.over_budget', 'queries': stats.statements, 'db_ms': round(db_ms, 1)},
+        )
+
+    if config.get('SQL_STATS_PAGE', False):
+        endpoint_stats.record(request.endpoint or request.path, stats, repeated)
+    return response
+
+
+def init_sql_stats(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,89 @@
+from sqlalchemy import event, func, insert, inspect, update
+
+from db_conn import db
+from models import User, Email, Recipient, Attachment, Folder, RecipientType, TableStat
+
+# Row counts shown on the admin dashboard. Each counted model bumps its
+# `table_stats` row inside the same flush that inserts or deletes it, so
+# the numbers commit or roll back together with the data.
+COUNTED_MODELS = (User, Email, Recipient, Attachment, Folder, RecipientType)
+
+_stats = TableStat.__table__
+
+
+def recipient_type_key(recipient_type_id):
+    return f"recipients:type:{recipient_type_id if recipient_type_id is not None else 'none'}"
+
+
+def adjust_stat(connection, name, delta):
+    """Add `delta` to the counter `name`, creating it on first use."""
+    if not delta:
+        return
+    result = connection.execute(
+        update(_stats).where(_stats.c.name == name).values(row_count=_stats.c.row_count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(_stats).values(name=name, row_count=max(delta, 0)))
+
+
+def _on_insert(mapper, connection, target):
+    adjust_stat(connection, mapper.local_table.name, 1)
+    if isinstance(target, Recipient):
+        adjust_stat(connection, recipient_type_key(target.recipient_type_id), 1)
+
+
+def _on_delete(mapper, connection, target):
+    adjust_stat(connection, mapper.local_table.name, -1)
+    if isinstance(target, Recipient):
+        adjust_stat(connection, recipient_type_key(target.recipient_type_id), -1)
+
+
+def _on_recipient_update(mapper, connection, target):
+    history = inspect(target).attrs.recipient_type_id.history
+    if not history.has_changes():
+        return
+    for old in history.deleted:
+        adjust_stat(connection, recipient_type_key(old), -1)
+    for new in history.added:
+        adjust_stat(connection, recipient_type_key(new), 1)
+
+
+for _model in COUNTED_MODELS:
+    event.listen(_model, 'after_insert', _on_insert)
+    event.listen(_model, 'after_delete', _on_delete)
+event.listen(Recipient, 'after_update', _on_recipient_update)
+
+
+def get_counts():
+    """Return {counter name: value} for every maintained counter."""
+    return {stat.name: stat.row_count for stat in TableStat.query.all()}
+
+
+def recipient_type_totals(counts):
+    """Per-type recipient totals as (type name, count), largest first."""
+    names = dict(db.session.query(RecipientType.id, RecipientType.name).all())
+    totals = []
+    for key, value in counts.items():
+        if not key.startswith('recipients:type:'):
+            continue
+        type_id = key.rsplit(':', 1)[1]
+        name = names.get(int(type_id)) if type_id != 'none' else 'No Type'
+        if name is not None and value:
+            totals.append((name, value))
+    return sorted(totals, key=lambda item: item[1], reverse=True)
+
+
+def rebuild_stats():
+    """Recount every counter from the base tables, repairing any drift."""
+    db.session.query(TableStat).delete()
+    for model in COUNTED_MODELS:
+        count = db.session.query(func.count()).select_from(model).scalar()
+        db.session.add(TableStat(name=model.__tablename__, row_count=count))
+    per_type = (
+        db.session.query(Recipient.recipient_type_id, func.count())
+        .group_by(Recipient.recipient_type_id)
+        .all()
+    )
+    for recipient_type_id, count in per_type:
+        db.session.add(TableStat(name=recipient_type_key(recipient_type_id), row_count=count))
+    db.session.commit()
@@ -0,0 +1,207 @@
+import unicodedata
+from collections import Counter
+
+from sqlalchemy import and_, bindparam, delete, event, func, insert, inspect, literal, select, update
+
+from db_conn import db
+from models import User, Folder, Recipient, RecipientType, SearchTrigram, SearchTrigramStat, TableStat
+
+# Substring search for short text columns.
+#
+# A leading-wildcard ILIKE cannot use a B-tree index, so every such search
+# reads the whole table. Instead each indexed value is folded (see fold())
+# and split into trigrams stored in `search_trigrams`; a needle of three or
+# more characters can only occur in rows that contain all of its trigrams,
+# and those rows are found through the primary key of that table.
+#
+# `search_trigram_stats` counts the rows behind each trigram, kept in step
+# by the same writes. A lookup reads only the rows of the needle's rarest
+# trigrams, and when even the rarest is in a large share of the table it
+# scans instead: the probe would read about as many rows and the matches
+# are dense enough for the scan to find them quickly.
+#
+# The folding is at least as coarse as the case- and accent-insensitive
+# collation's, so the candidates include every row the ILIKE can match, and
+# the ILIKE is still applied to them: results are what it returns.
+
+INDEXED_COLUMNS = (
+    User.username,
+    User.email,
+    Folder.folder_name,
+    Recipient.name,
+    RecipientType.name,
+)
+
+PROBE_TRIGRAMS = 2
+COMMON_TRIGRAM_SHARE = 0.1
+
+_trigrams = SearchTrigram.__table__
+_stats = SearchTrigramStat.__table__
+_table_stats = TableStat.__table__
+
+# Letters the accent-insensitive collations compare equal to a base letter
+# but NFKD leaves whole.
+_BASE_LETTERS = str.maketrans({'ø': 'o', 'đ': 'd', 'ð': 'd', 'ħ': 'h', 'ı': 'i', 'ł': 'l', 'ŧ': 't', 'æ': 'ae', 'œ': 'oe'})
+
+
+def field_name(column):
+    return f"{column.class_.__tablename__}.{column.key}"
+
+
+def fold(value):
+    """`value` casefolded, compatibility-decomposed and without accents."""
+    decomposed = unicodedata.normalize('NFKD', (value or '').casefold())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).translate(_BASE_LETTERS)
+
+
+def trigrams(value):
+    """The set of three-character substrings of the folded `value`."""
+    value = fold(value)
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def candidate_ids(column, needle):
+    """Select the ids of rows whose `column` may contain `needle`, or None if
+    the index would not narrow the search: the needle is too short, or even
+    its rarest trigram is common."""
+    grams = trigrams(needle)
+    if not grams:
+        return None
+    field = field_name(column)
+    # The trigrams' counts and, under '', the table's row count in one round trip.
+    counts = dict(db.session.execute(
+        select(_stats.c.trigram, _stats.c.row_count)
+        .where(_stats.c.field == field, _stats.c.trigram.in_(grams))
+        .union_all(
+            select(literal(''), _table_stats.c.row_count).where(_table_stats.c.name == column.class_.__tablename__)
+        )
+    ).all())
+    total = counts.pop('', None)
+    # A trigram without a count is in no row, and the best one to probe.
+    ranked = sorted(grams, key=lambda gram: (counts.get(gram, 0), gram))
+    limit = total * COMMON_TRIGRAM_SHARE if total else None
+    if limit is not None and counts.get(ranked[0], 0) > limit:
+        return None
+    probe = [gram for gram in ranked[:PROBE_TRIGRAMS] if limit is None or counts.get(gram, 0) <= limit]
+    query = select(_trigrams.c.row_id).where(_trigrams.c.field == field, _trigrams.c.trigram.in_(probe))
+    if len(probe) > 1:
+        query = query.group_by(_trigrams.c.row_id).having(func.count() == len(probe))
+    return query
+
+
+def contains(column, needle):
+    """Filter clause for `column` containing `needle` case-insensitively,
+    with LIKE wildcards in the needle taken literally. Backed by the trigram
+    index when that narrows the search."""
+    match = column.icontains(needle, autoescape=True)
+    candidates = candidate_ids(column, needle)
+    if candidates is None:
+        return match
+    id_column = inspect(column.class_).primary_key[0]
+    return and_(id_column.in_(candidates), match)
+
+
+def _count(connection, field, counts):
+    """Add `counts` ({trigram: rows}) to the field's per-trigram row counts."""
+    # In a fixed order, so concurrent writers take the row locks in the same order.
+    grams = sorted(gram for gram, delta in counts.items() if delta)
+    if not grams:
+        return
+    known = set(connection.scalars(
+        select(_stats.c.trigram).where(_stats.c.field == field, _stats.c.trigram.in_(grams))
+    ))
+    changes = [{'b_field': field, 'b_trigram': gram, 'b_delta': counts[gram]} for gram in grams if gram in known]
+    if changes:
+        connection.execute(
+            update(_stats)
+            .where(_stats.c.field == bindparam('b_field'), _stats.c.trigram == bindparam('b_trigram'))
+            .values(row_count=_stats.c.row_count + bindparam('b_delta')),
+            changes,
+        )
+    new = [{'field': field, 'trigram': gram, 'row_count': max(counts[gram], 0)} for gram in grams if gram not in known]
+    if new:
+        connection.execute(insert(_stats), new)
+
+
+def _rows(field, row_id, value):
+    return [{'field': field, 'trigram': gram, 'row_id': row_id} for gram in trigrams(value)]
+
+
+def _index(connection, field, row_id, value):
+    rows = _rows(field, row_id, value)
+    if rows:
+        connection.execute(insert(_trigrams), rows)
+        _count(connection, field, {row['trigram']: 1 for row in rows})
+
+
+def _unindex(connection, field, row_id):
+    condition = and_(_trigrams.c.field == field, _trigrams.c.row_id == row_id)
+    grams = connection.scalars(select(_trigrams.c.trigram).where(condition)).all()
+    if grams:
+        connection.execute(delete(_trigrams).where(condition))
+        _count(connection, field, {gram: -1 for gram in grams})
+
+
+def index_rows(connection, column, rows):
+    """Index (row id, value) pairs written outside the ORM, e.g. by bulk inserts."""
+    field = field_name(column)
+    pending = [gram for row_id, value in rows for gram in _rows(field, row_id, value)]
+    if pending:
+        connection.execute(insert(_trigrams), pending)
+        _count(connection, field, Counter(row['trigram'] for row in pending))
+
+
+def _columns_for(mapper):
+    return [column for column in INDEXED_COLUMNS if column.class_ is mapper.class_]
+
+
+def _on_insert(mapper, connection, target):
+    for column in _columns_for(mapper):
+        _index(connection, field_name(column), target.id, getattr(target, column.key))
+
+
+def _on_update(mapper, connection, target):
+    state = inspect(target)
+    for column in _columns_for(mapper):
+        if state.attrs[column.key].history.has_changes():
+            field = field_name(column)
+            _unindex(connection, field, target.id)
+            _index(connection, field, target.id, getattr(target, column.key))
+
+
+def _on_delete(mapper, connection, target):
+    for column in _columns_for(mapper):
+        _unindex(connection, field_name(column), target.id)
+
+
+for _model in {column.class_ for column in INDEXED_COLUMNS}:
+    event.listen(_model, 'after_insert', _on_insert)
+    event.listen(_model, 'after_update', _on_update)
+    event.listen(_model, 'after_delete', _on_delete)
+
+
+def rebuild_trigram_index(batch_size=5000, counts=True):
+    """Rebuild the trigram table from the indexed columns, and with `counts`
+    the per-trigram row counts from it."""
+    db.session.execute(delete(_trigrams))
+    for column in INDEXED_COLUMNS:
+        field = field_name(column)
+        id_column = inspect(column.class_).primary_key[0]
+        last_id = 0
+        while True:
+            batch = db.session.execute(
+                select(id_column, column).where(id_column > last_id).order_by(id_column).limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            rows = [row for row_id, value in batch for row in _rows(field, row_id, value)]
+            if rows:
+                db.session.execute(insert(_trigrams), rows)
+            last_id = batch[-1][0]
+    if counts:
+        db.session.execute(delete(_stats))
+        db.session.execute(insert(_stats).from_select(
+            ['field', 'trigram', 'row_count'],
+            select(_trigrams.c.field, _trigrams.c.trigram, func.count()).group_by(_trigrams.c.field, _trigrams.c.trigram),
+        ))
+    db.session.commit()
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from jinja2 import TemplateNotFound
+from sqlalchemy.orm import configure_mappers
+
+from db_conn import ping_engines
+from email_domains import warm_up as warm_up_email_domains
+from passwords import warm_up_passwords
+from search import get_backend
+from stats import get_counts
+
+# Readiness checks and first-use warm-up for a freshly booted worker.
+#
+# A new worker starts with an empty connection pool, unconfigured mappers,
+# uncompiled templates, optional dependencies not yet imported and no
+# password-hashing processes. Without a warm-up the first real requests pay
+# for all of that. The readiness endpoint does this work once per process,
+# before the load balancer sends traffic. After that it only checks that
+# the databases still answer.
+
+logger = logging.getLogger(__name__)
+
+WARM_TEMPLATES = (
+    'base.html', 'auth/login.html', 'admin_dashboard.html', 'user_dashboard.html',
+    'emails/list.html', 'folders/list.html',
+)
+
+_lock = threading.Lock()
+_warmed = {}  # pid -> report of that process's warm-up
+
+
+def _warm_templates():
+    missing = []
+    for name in WARM_TEMPLATES:
+        try:
+            current_app.jinja_env.get_template(name)
+        except TemplateNotFound:
+            missing.append(name)
+    if missing:
+        raise TemplateNotFound(', '.join(missing))
+
+
+def _warm_statements():
+    # Compiles and caches the statements behind the dashboard and search.
+    get_counts()
+    get_backend()
+
+
+WARM_STEPS = (
+    ('database', lambda: ping_engines(current_app.config.get('READY_WARM_CONNECTIONS', 2))),
+    ('mappers', configure_mappers),
+    ('statements', _warm_statements),
+    ('templates', _warm_templates),
+    ('email_domains', warm_up_email_domains),
+    ('passwords', warm_up_passwords),
+)
+
+
+def _timed(step):
+    started = time.perf_counter()
+    try:
+        step()
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+        logger.warning("Warm-up step failed: %s", e)
+    return {'ms': round((time.perf_counter() - started) * 1000, 2), 'error': error}
+
+
+def warm_up():
+    """Run the warm-up steps once in this process; returns their timings.
+
+    A run whose database step failed is not remembered, so the next
+    readiness check tries again.
+    """
+    pid = os.getpid()
+    with _lock:
+        if pid in _warmed:
+            return _warmed[pid]
+        started = time.perf_counter()
+        steps = {name: _timed(step) for name, step in WARM_STEPS}
+        boot = current_app.extensions.get('boot')
+        report = {
+            'steps': steps,
+            'ms': round((time.perf_counter() - started) * 1000, 2),
+            # From the start of app.py's imports until this worker could serve traffic.
+            'since_boot_ms': round((time.perf_counter() - boot['started']) * 1000, 2) if boot else None,
+        }
+        if steps['database']['error'] is None:
+            _warmed[pid] = report
+            logger.info("Worker %d warmed up in %.1f ms", pid, report['ms'])
+        return report
+
+
+def readiness():
+    """(ready, report) for the readiness endpoint."""
+    report = {'pid': os.getpid(), 'warm_up': warm_up()}
+    boot = current_app.extensions.get('boot')
+    if boot:
+        report['boot'] = {key: value for key, value in boot.items() if key != 'started'}
+    try:
+        report['database'] = ping_engines()
+    except Exception as e:
+        report['database'] = {'error': type(e).__name__}
+        return False, report
+    return True, report
@@ -0,0 +1,54 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const inputs = document.querySelectorAll('[data-typeahead-url]');
+
+    inputs.forEach(function (input) {
+        const results = input.closest('.dropdown-menu').querySelector('[data-typeahead-results]');
+        let timer = null;
+        let controller = null;
+
+        function render(items) {
+            results.innerHTML = '';
+            if (items.length === 0) {
+                const empty = document.createElement('li');
+                empty.className = 'dropdown-item text-muted';
+                empty.textContent = 'No matches';
+                results.appendChild(empty);
+                return;
+            }
+            items.forEach(function (item) {
+                const li = document.createElement('li');
+                const link = document.createElement('a');
+                link.className = 'dropdown-item';
+                link.href = item.url;
+                link.textContent = item.label;
+                li.appendChild(link);
+                results.appendChild(li);
+            });
+        }
+
+        function lookup() {
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            const url = input.dataset.typeaheadUrl + '?q=' + encodeURIComponent(input.value.trim());
+            fetch(url, { signal: controller.signal, credentials: 'same-origin' })
+                .then(function (response) { return response.ok ? response.json() : []; })
+                .then(render)
+                .catch(function (error) {
+                    if (error.name !== 'AbortError') {
+                        render([]);
+                    }
+                });
+        }
+
+        input.addEventListener('click', function (e) {
+            e.stopPropagation();
+        });
+        input.addEventListener('focus', lookup, { once: true });
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(lookup, 200);
+        });
+    });
+});
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app imports its modules top-level from src/ and the blueprints from routes/.
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src')]
@@ -0,0 +1,153 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+from conftest import ROOT
+from app import create_app
+from db_conn import db
+from models import User, Email, EmailBody, Recipient, RecipientType, Attachment, Folder, EmailFolder
+from session_user import invalidate_session_user
+
+# SQL statements and rows each list and search page costs, as reported by
+# sql_stats in the Server-Timing header. The data below has several rows
+# behind every page, so a relationship loaded one row at a time shows up as
+# a jump in these numbers. When a change moves one on purpose, update it
+# here in the same commit.
+
+EMAIL_COUNT = 40
+
+_DB_TIMING = re.compile(r'desc="(\d+) queries, (\d+) rows read, \d+ rows written"')
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_BINDS': {},
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'RESULT_CACHE_ENABLED': False,
+        'PASSWORD_HASH_WORKERS': 0,
+        'USER_CACHE_VERSION_INTERVAL': 0,
+        'SESSION_COOKIE_SECURE': False,
+        'LOG_FILE': '',
+        'LOG_SECURITY_FILE': None,
+        'TESTING': True,
+    })
+    app.template_folder = f'{ROOT}/templates'
+    app.static_folder = f'{ROOT}/static'
+    # Requests must not run inside this context, or they would share its
+    # session and find each other's rows already loaded.
+    with app.app_context():
+        db.create_all()
+        _seed()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def _seed():
+    alice = User(username='alice', email='alice@example.com', password='x', is_admin=True)
+    bob = User(username='bob', email='bob@example.com', password='x')
+    carol = User(username='carol', email='carol@example.org', password='x')
+    to, cc = RecipientType(name='to'), RecipientType(name='cc')
+    db.session.add_all([alice, bob, carol, to, cc])
+    db.session.flush()
+    inbox = Folder(folder_name='Inbox', user_id=alice.id)
+    archive = Folder(folder_name='Archive', user_id=bob.id)
+    db.session.add_all([inbox, archive])
+    db.session.flush()
+
+    started = datetime(2024, 1, 1)
+    for i in range(EMAIL_COUNT):
+        email = Email(
+            subject=f'subject {i}',
+            body=f'hello body {i} ' + 'lorem ipsum ' * (i % 3) * 30,
+            sender_id=(alice, bob)[i % 2].id,
+            sent_at=started + timedelta(hours=i),
+        )
+        db.session.add(email)
+        db.session.flush()
+        db.session.add_all([
+            Recipient(name='Bob', email_id=email.id, user_id=bob.id, recipient_type_id=to.id),
+            Recipient(name='Carol', email_id=email.id, user_id=carol.id, recipient_type_id=cc.id),
+            Attachment(file_name=f'file{i}.txt', file_type='text/plain', file_size=100 + i, email_id=email.id),
+            EmailFolder(email_id=email.id, folder_id=(inbox, archive)[i % 2].id),
+        ])
+    db.session.commit()
+
+    # Every third email still has its body in the legacy column, as before
+    # convert-email-bodies has run.
+    legacy = [email_id for email_id in range(1, EMAIL_COUNT + 1) if email_id % 3 == 0]
+    db.session.execute(delete(EmailBody).where(EmailBody.email_id.in_(legacy)))
+    db.session.execute(update(Email).where(Email.id.in_(legacy)).values(legacy_body='legacy body'))
+    db.session.commit()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    # Each request then pays for loading the user, so counts don't depend on test order.
+    invalidate_session_user(1)
+    return client
+
+
+def sql_counts(response):
+    """(statements, rows read) of the request, from its Server-Timing header."""
+    for header in response.headers.getlist('Server-Timing'):
+        match = _DB_TIMING.search(header)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    raise AssertionError(f"No db Server-Timing header in {response.headers}")
+
+
+# (method, url, form data, statements, rows)
+ENDPOINTS = [
+    ('GET', '/emails/list', None, 4, 69),
+    ('GET', '/users/list', None, 3, 5),
+    ('GET', '/attachments/list', None, 3, 42),
+    ('GET', '/folders/folders/list', None, 3, 4),
+    ('GET', '/recipients/list', None, 3, 53),
+    ('GET', '/recipient_types/list', None, 3, 4),
+    ('GET', '/users/2/inbox', None, 4, 82),
+    ('GET', '/users/1/sent', None, 4, 42),
+    ('POST', '/emails/search_by_sender', {'sender': 'alice'}, 6, 40),
+    ('POST', '/emails/search_by_keywords', {'keywords': 'hello'}, 5, 109),
+    ('POST', '/emails/search_by_date_range', {'start_date': '2024-01-01', 'end_date': '2024-01-03'}, 4, 69),
+    ('POST', '/emails/search_by_subject_sender', {'subject': 'subject', 'sender': 'bob'}, 8, 42),
+    ('POST', '/emails/search_emails_with_sender', {'keywords': 'hello'}, 5, 109),
+    ('POST', '/emails/search_by_recipient', {'recipient': 'Carol'}, 4, 69),
+    ('POST', '/emails/search_by_domain', {'domain': 'example.com'}, 3, 4),
+    ('POST', '/emails/search_full_email_info', {'keywords': 'hello'}, 7, 229),
+    ('POST', '/attachments/attachments/search_by_email_id', {'email_id': '1'}, 3, 3),
+    ('POST', '/attachments/attachments/search_by_file_name', {'file_name': 'file'}, 3, 42),
+    ('POST', '/attachments/attachments/search_by_file_size', {'min_size': '100', 'max_size': '120'}, 3, 23),
+    ('POST', '/attachments/attachments/search_by_email_and_file_name', {'email_id': '1', 'file_name': 'file'}, 3, 3),
+    ('POST', '/attachments/attachments/search_with_users_info', {'search_query': 'file'}, 3, 42),
+    ('POST', '/folders/folders/search_by_name', {'folder_name': 'Inbox'}, 4, 7),
+    ('POST', '/folders/folders/search_by_user_id', {'user_id': '1'}, 3, 3),
+    ('POST', '/folders/folders/search_with_user_info', {'folder_name': 'Inbox'}, 4, 7),
+    ('POST', '/folders/folders/search_by_email_folder', {'folder_id': '1'}, 5, 25),
+    ('POST', '/recipient_types/search_by_name', {'name': 'to'}, 3, 3),
+    ('POST', '/recipient_types/search_with_recipients', {'name': 'cc'}, 3, 42),
+    ('POST', '/recipient_types/search_with_emails', {'name': 'cc'}, 3, 2),
+    ('POST', '/recipients/search_by_type', {'type_name': 'cc'}, 3, 42),
+    ('POST', '/recipients/search_recipients_with_emails', {'email_subject': 'subject'}, 4, 109),
+    ('POST', '/users/search_users_with_folders', {'folder_name': 'Inbox'}, 4, 5),
+    ('POST', '/users/search_users_with_recipients', {'recipient_name': 'Carol'}, 4, 46),
+    ('POST', '/users/search_users_with_email_details', {'email_query': 'subject'}, 3, 42),
+    ('POST', '/users/search_users_with_folders_emails', {'username': 'alice'}, 4, 7),
+]
+
+
+@pytest.mark.parametrize(
+    'method, url, data, statements, rows', ENDPOINTS, ids=[f'{method} {url}' for method, url, *_ in ENDPOINTS]
+)
+def test_statements_and_rows(client, method, url, data, statements, rows):
+    response = client.open(url, method=method, data=data)
+    assert response.status_code == 200
+    assert sql_counts(response) == (statements, rows)